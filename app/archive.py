@@ -0,0 +1,180 @@
+"""
+Columnar archive for AirWatch ASEAN
+Sealed (finished) months of raw measurements exported to NumPy partitions:
+
+    ARCHIVE_DIR/<station_uid>/<YYYY-MM>.npy   structured array (ts, aqi, pm25)
+    ARCHIVE_DIR/manifest.json                 {"sealed_through": "YYYY-MM"}
+
+Months are UTC months (the raw compaction cutoff is in UTC); ts is the
+station-local time, like the API timestamps, so a partition may end a few
+hours into the next local month.
+
+Partitions are memory-mapped on read, so a station's history loads without
+SQL or copies. The retention job exports a month before its raw rows are
+compacted.
+
+    python -m app.archive export      # export every sealed month not archived yet
+    python -m app.archive info [uid]
+"""
+import os
+import sys
+import json
+import logging
+from datetime import datetime
+
+import numpy as np
+
+from app.config import ARCHIVE_DIR, setup_logging
+from app.db import get_read_connection, to_epoch, local_iso
+
+# NaN = station did not report the value
+PARTITION_DTYPE = np.dtype([("ts", "M8[s]"), ("aqi", "<f4"), ("pm25", "<f4")])
+
+
+def _month_start(month):
+    return datetime.strptime(month, "%Y-%m")
+
+
+def _next_month(month):
+    start = _month_start(month)
+    return f"{start.year + start.month // 12:04d}-{start.month % 12 + 1:02d}"
+
+
+def read_manifest(root=ARCHIVE_DIR):
+    try:
+        with open(os.path.join(root, "manifest.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_atomic(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def sealed_until(root=ARCHIVE_DIR):
+    """First instant not covered by the archive (None if nothing is archived)"""
+    sealed = read_manifest(root).get("sealed_through")
+    return _month_start(_next_month(sealed)) if sealed else None
+
+
+def export_month(cursor, month, root=ARCHIVE_DIR):
+    """Write one partition per station for `month` (YYYY-MM); returns rows exported"""
+    cursor.execute("""
+        SELECT station_uid, timestamp + utc_offset, aqi, pm25 FROM measurements
+        WHERE timestamp >= ? AND timestamp < ?
+        ORDER BY station_uid, timestamp
+    """, (to_epoch(_month_start(month)), to_epoch(_month_start(_next_month(month)))))
+    rows = cursor.fetchall()
+    if not rows:
+        return 0
+
+    uids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    data = np.empty(len(rows), dtype=PARTITION_DTYPE)
+    data["ts"] = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows)).astype("M8[s]")
+    data["aqi"] = np.array([row[2] for row in rows], dtype=np.float64)
+    data["pm25"] = np.array([row[3] for row in rows], dtype=np.float64)
+
+    # rows are sorted by station: split at each change of uid
+    bounds = np.flatnonzero(np.diff(uids)) + 1
+    for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(rows)]):
+        path = os.path.join(root, str(uids[start]), f"{month}.npy")
+        _write_atomic(path, lambda f, part=data[start:end]: np.save(f, part))
+    return len(rows)
+
+
+def export_sealed(now=None, root=ARCHIVE_DIR):
+    """Export every finished month after the manifest's sealed_through; returns months written"""
+    now = now or datetime.utcnow()
+    current = now.strftime("%Y-%m")
+    cursor = get_read_connection().cursor()
+
+    sealed = read_manifest(root).get("sealed_through")
+    if sealed:
+        month = _next_month(sealed)
+    else:
+        cursor.execute("SELECT MIN(timestamp) FROM measurements")
+        oldest = cursor.fetchone()[0]
+        if oldest is None:
+            return []
+        month = local_iso(oldest)[:7]
+
+    exported = []
+    while month < current:
+        rows = export_month(cursor, month, root)
+        _write_atomic(
+            os.path.join(root, "manifest.json"),
+            lambda f, m=month: f.write(json.dumps({"sealed_through": m}).encode())
+        )
+        exported.append((month, rows))
+        month = _next_month(month)
+    if exported:
+        logging.info(f"Archive: exported {', '.join(f'{m} ({n} rows)' for m, n in exported)}")
+    return exported
+
+
+def archived_months(uid, root=ARCHIVE_DIR):
+    try:
+        names = os.listdir(os.path.join(root, str(uid)))
+    except OSError:
+        return []
+    return sorted(name[:-4] for name in names if name.endswith(".npy"))
+
+
+def archived_stations(root=ARCHIVE_DIR):
+    try:
+        return sorted(int(name) for name in os.listdir(root) if name.lstrip("-").isdigit())
+    except OSError:
+        return []
+
+
+def load_partition(uid, month, root=ARCHIVE_DIR):
+    """Memory-mapped (read-only, zero-copy) partition of one station and month"""
+    return np.load(os.path.join(root, str(uid), f"{month}.npy"), mmap_mode="r")
+
+
+def load_series(uid, start=None, end=None, root=ARCHIVE_DIR):
+    """
+    Archived readings of a station in [start, end), oldest first, as a
+    PARTITION_DTYPE array. A range inside one month is a view on the
+    memory map (no copy); longer ranges concatenate their partitions.
+    """
+    months = archived_months(uid, root)
+    if start is not None:
+        # the month before may hold the first local hours of `start`'s month
+        first = start.strftime("%Y-%m")
+        months = [m for m in months if _next_month(m) >= first]
+    if end is not None:
+        months = [m for m in months if _month_start(m) < end]
+    parts = []
+    for month in months:
+        part = load_partition(uid, month, root)
+        lo = np.searchsorted(part["ts"], np.datetime64(start, "s")) if start is not None else 0
+        hi = np.searchsorted(part["ts"], np.datetime64(end, "s")) if end is not None else len(part)
+        parts.append(part[lo:hi])
+    if not parts:
+        return np.empty(0, dtype=PARTITION_DTYPE)
+    return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+if __name__ == "__main__":
+    setup_logging()
+    command = sys.argv[1] if len(sys.argv) > 1 else "export"
+    if command == "export":
+        for month, rows in export_sealed():
+            print(f"{month}: {rows} rows")
+        print(f"Sealed through {read_manifest().get('sealed_through')}")
+    elif command == "info":
+        if len(sys.argv) > 2:
+            uid = int(sys.argv[2])
+            series = load_series(uid)
+            print(f"Station {uid}: {len(series)} rows in {len(archived_months(uid))} months")
+        else:
+            print(f"{len(archived_stations())} stations, sealed through {read_manifest().get('sealed_through')}")
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,259 @@
+"""
+Historical backfill for AirWatch ASEAN
+Bulk-loads past readings so a new deployment does not start with an empty
+measurements table (and a predictor stuck on "Đang học..."). Inputs:
+
+- WAQI data-platform CSV dumps, one file per station:
+  `date, pm25, pm10, o3, no2, so2, co` (AQI sub-indices; AQI = the highest,
+  or an `aqi` column). Station uid from --uid, a `uid` column or the file
+  name (`1832.csv`).
+- NDJSON (.ndjson/.jsonl): one WAQI feed payload ({"status": "ok", "data": ...})
+  or one flat record ({"uid", "aqi", "pm25", "timestamp", ...}) per line.
+
+Every row goes through the crawler's parse_station_feed, so the crawler's
+validation rules apply. Files are streamed; rows are inserted with
+executemany in large transactions with synchronous=OFF. With
+--defer-indexes the secondary measurement indexes are dropped for the load
+and rebuilt once at the end (faster for large dumps, but only while the web
+app is stopped); if the load is killed first, the next store.init()
+re-creates them. Rows already stored are left alone and no spike alerts are
+raised for historical data.
+
+    python -m app.backfill dumps/1832.csv dumps/*.ndjson [--uid 1832] [--batch 50000] [--defer-indexes]
+
+Rows in months the archive has already sealed are rolled up by the next
+retention run but not added to the .npy archive.
+"""
+import os
+import csv
+import sys
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+
+from app.config import STATIONS_CONFIG, setup_logging
+from app.db import get_write_connection, write_lock, IAQI_COLUMNS
+from app.storage import store, INSERT_MEASUREMENT_SQL, measurement_row
+from app.crawler import parse_station_feed
+
+STATIONS = {st['uid']: st for st in STATIONS_CONFIG}
+POLLUTANTS = ("pm25", "pm10", "o3", "no2", "so2", "co")  # sub-indices making up the AQI
+CHANNELS = tuple(dict.fromkeys(("pm25", *IAQI_COLUMNS)))
+TIME_FIELDS = ("date", "timestamp", "time")
+TIME_FORMATS = ("%Y/%m/%d", "%Y/%m/%d %H:%M", "%Y/%m/%d %H:%M:%S", "%d/%m/%Y")
+
+# Newest row per station after the load; never replaces a newer live reading
+REFRESH_LATEST_SQL = """
+    INSERT INTO station_latest (station_uid, station_name, aqi, pm25, timestamp, utc_offset, source)
+    SELECT station_uid, station_name, aqi, pm25, MAX(timestamp), utc_offset, source
+    FROM measurements WHERE true GROUP BY station_uid
+    ON CONFLICT(station_uid) DO UPDATE SET
+        station_name = excluded.station_name, aqi = excluded.aqi, pm25 = excluded.pm25,
+        timestamp = excluded.timestamp, utc_offset = excluded.utc_offset, source = excluded.source
+    WHERE excluded.timestamp > station_latest.timestamp
+"""
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_time(value):
+    """ISO (with or without offset) or the dates found in WAQI dumps; None if unreadable"""
+    value = str(value or "").strip()
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for fmt in TIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _station(uid, name=None, lng=None):
+    station = STATIONS.get(uid)
+    if station is None:
+        # Unknown station: times without an offset are read as UTC+7 (most of ASEAN)
+        station = {"uid": uid, "name": name or f"Station {uid}", "lng": lng if lng is not None else 105.0}
+    return station
+
+
+def parse_row(uid, row):
+    """
+    One CSV row / flat record -> measurement record, or None if rejected.
+    Built into a WAQI feed payload so parse_station_feed validates it.
+    """
+    ts = _parse_time(next((row[field] for field in TIME_FIELDS if row.get(field)), None))
+    if uid is None or ts is None:
+        return None
+    values = {key: _float(row[key]) for key in CHANNELS if row.get(key) not in (None, "")}
+    values = {key: value for key, value in values.items() if value is not None}
+    aqi = row.get("aqi")
+    if aqi in (None, ""):
+        sub_indices = [values[key] for key in POLLUTANTS if key in values]
+        aqi = round(max(sub_indices)) if sub_indices else None
+    feed = {"status": "ok", "data": {
+        "aqi": aqi,
+        "iaqi": {key: {"v": value} for key, value in values.items()},
+        "time": {"iso": ts.isoformat()},
+    }}
+    return parse_station_feed(_station(uid, row.get("name"), _float(row.get("lng"))), feed)
+
+
+def parse_feed(raw, uid=None):
+    """WAQI feed payload -> measurement record, or None if rejected"""
+    data = raw.get("data") if isinstance(raw.get("data"), dict) else {}
+    # parse_station_feed falls back to "now" for a bad time; history needs the real one
+    if _parse_time((data.get("time") or {}).get("iso")) is None:
+        return None
+    uid = uid if uid is not None else _int(data.get("idx"))
+    if uid is None:
+        return None
+    city = data.get("city") or {}
+    geo = city.get("geo") or [None, None]
+    return parse_station_feed(_station(uid, city.get("name"), _float(geo[1]) if len(geo) > 1 else None), raw)
+
+
+def read_csv(path, uid=None):
+    """Yield a record (or None when rejected) per data row"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    file_uid = _int(stem) if stem.lstrip("-").isdigit() else None
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        lines = (line for line in f if line.strip() and not line.startswith("#"))
+        for row in csv.DictReader(lines, skipinitialspace=True):
+            row = {key.strip().lower(): (value or "").strip() for key, value in row.items() if key}
+            row_uid = uid if uid is not None else _int(row.get("uid") or row.get("station_uid") or row.get("idx"))
+            yield parse_row(row_uid if row_uid is not None else file_uid, row)
+
+
+def read_ndjson(path, uid=None):
+    """Yield a record (or None when rejected) per line"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                raw = json.loads(line)
+            except ValueError:
+                yield None
+                continue
+            if not isinstance(raw, dict):
+                yield None
+            elif "status" in raw:
+                yield parse_feed(raw, uid)
+            else:
+                yield parse_row(uid if uid is not None else _int(raw.get("uid")), raw)
+
+
+def read_records(paths, uid=None):
+    for path in paths:
+        reader = read_ndjson if path.endswith((".ndjson", ".jsonl")) else read_csv
+        logging.info(f"Backfill: reading {path}")
+        yield from reader(path, uid)
+
+
+def _drop_indexes(conn):
+    """Drop the secondary measurement indexes; returns their CREATE statements"""
+    rows = conn.execute("""
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND tbl_name = 'measurements' AND sql IS NOT NULL
+    """).fetchall()
+    for name, _ in rows:
+        conn.execute(f"DROP INDEX {name}")
+    conn.commit()
+    return [sql for _, sql in rows]
+
+
+def backfill(paths, uid=None, batch_size=50000, defer_indexes=False):
+    """Load every file in `paths`; returns {read, inserted, rejected, seconds}"""
+    stats = {"read": 0, "inserted": 0, "rejected": 0}
+    started = time.monotonic()
+
+    def report():
+        elapsed = max(time.monotonic() - started, 1e-6)
+        logging.info(
+            f"Backfill: {stats['read']:,} rows read, {stats['inserted']:,} inserted, "
+            f"{stats['rejected']:,} rejected ({stats['read'] / elapsed:,.0f} rows/s)"
+        )
+
+    def batches():
+        batch = []
+        for record in read_records(paths, uid):
+            stats["read"] += 1
+            if record is None:
+                stats["rejected"] += 1
+                continue
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    if store.name != "sqlite":
+        # PostgreSQL ingest is already COPY-based
+        for batch in batches():
+            stats["inserted"] += len(store.write_batch(batch, spikes=False))
+            report()
+        stats["seconds"] = round(time.monotonic() - started, 1)
+        return stats
+
+    conn = get_write_connection()
+    with write_lock:
+        indexes = _drop_indexes(conn) if defer_indexes else []
+        conn.execute("PRAGMA synchronous=OFF")
+        try:
+            for batch in batches():
+                changes = conn.total_changes
+                conn.executemany(INSERT_MEASUREMENT_SQL, [measurement_row(record) for record in batch])
+                conn.commit()
+                stats["inserted"] += conn.total_changes - changes
+                report()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if indexes:
+                logging.info(f"Backfill: rebuilding {len(indexes)} indexes...")
+                for sql in indexes:
+                    conn.execute(sql)
+                conn.commit()
+        conn.execute(REFRESH_LATEST_SQL)
+        conn.commit()
+        conn.execute("PRAGMA optimize")
+
+    stats["seconds"] = round(time.monotonic() - started, 1)
+    report()
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-load historical AQI readings (WAQI CSV dumps / NDJSON)")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--uid", type=int, help="station uid for every row (CSV dumps of one station)")
+    parser.add_argument("--batch", type=int, default=50000, help="rows per transaction")
+    parser.add_argument("--defer-indexes", action="store_true", help="drop indexes during the load, rebuild at the end")
+    args = parser.parse_args()
+
+    setup_logging()
+    store.init()
+    result = backfill(args.paths, uid=args.uid, batch_size=args.batch, defer_indexes=args.defer_indexes)
+    print(f"✅ {result['inserted']:,} new rows ({result['rejected']:,} rejected) in {result['seconds']}s")
+    sys.exit(0 if result['read'] else 1)
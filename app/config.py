@@ -11,6 +11,12 @@ load_dotenv()
 # --- CẤU HÌNH ---
 DB_NAME = "air_quality_asean.db"
 
+# Measurements/alerts store: empty = local SQLite file (DB_NAME), postgresql://... = shared PostgreSQL
+AQI_DATABASE_URL = os.getenv("AQI_DATABASE_URL", "")
+if AQI_DATABASE_URL.startswith("postgres://"):
+    AQI_DATABASE_URL = AQI_DATABASE_URL.replace("postgres://", "postgresql://", 1)
+PG_POOL_SIZE = int(os.getenv("PG_POOL_SIZE", "10"))  # max pooled connections per process
+
 # WAQI API Token (from environment variable for security)
 WAQI_TOKEN = os.getenv("WAQI_TOKEN", "")
 if not WAQI_TOKEN:
@@ -23,6 +29,61 @@ OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY", "")
 OPENAQ_API_KEY = os.getenv("OPENAQ_API_KEY", "")
 SATELLITE_ENABLED = bool(OPENWEATHER_API_KEY) or bool(OPENAQ_API_KEY)
 
+# Crawler config
+RUN_CRAWLER = os.getenv("RUN_CRAWLER", "embedded")  # "embedded" (thread in the web process) or "off"
+SCHEMA_WAIT_SECONDS = int(os.getenv("SCHEMA_WAIT_SECONDS", "60"))  # embedded: web workers wait this long for the crawler's migrations
+CRAWL_INTERVAL = int(os.getenv("CRAWL_INTERVAL", "300"))  # seconds between sweeps
+CRAWL_MODE = os.getenv("CRAWL_MODE", "async")  # "async" (pooled httpx client) or "threads"
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "20"))  # max in-flight requests
+CRAWL_TIMEOUT = float(os.getenv("CRAWL_TIMEOUT", "15"))  # per-request timeout (seconds)
+CRAWL_SWEEP_DEADLINE = float(os.getenv("CRAWL_SWEEP_DEADLINE", "60"))  # slower stations wait for next cycle
+CRAWL_HEDGE = os.getenv("CRAWL_HEDGE", "1") == "1"  # hedged 2nd request once a call passes its p95
+CRAWL_SCHEDULE = os.getenv("CRAWL_SCHEDULE", "adaptive")  # "adaptive" (per-station cadence) or "fixed"
+POLL_STALE_AFTER = int(os.getenv("POLL_STALE_AFTER", str(3 * 3600)))  # silence before backing off
+POLL_MAX_INTERVAL = int(os.getenv("POLL_MAX_INTERVAL", "3600"))  # longest gap between polls of a station
+WRITER_BATCH_SIZE = int(os.getenv("WRITER_BATCH_SIZE", "200"))  # rows per write transaction
+WRITER_MAX_DELAY = float(os.getenv("WRITER_MAX_DELAY", "1.0"))  # max seconds a row waits in the queue
+WRITER_DEAD_LETTER = os.getenv("WRITER_DEAD_LETTER", "writer_rejected.ndjson")  # rows that could not be written
+FORECAST_REFRESH_DELAY = float(os.getenv("FORECAST_REFRESH_DELAY", "5"))  # gather new data before re-forecasting
+FORECAST_RELOAD_SECONDS = float(os.getenv("FORECAST_RELOAD_SECONDS", "15"))  # web workers re-read the forecast table
+PREDICTOR_MODE = os.getenv("PREDICTOR_MODE", "global")  # "global" (one pooled sklearn model) or "station" (one per station, scored by app.tree_engine)
+TRAIN_INTERVAL = int(os.getenv("TRAIN_INTERVAL", "600"))  # seconds between checks for models due for retraining
+TRAIN_WORKERS = int(os.getenv("TRAIN_WORKERS", "0"))  # training processes (0 = one per CPU core)
+MODEL_CACHE_MAX_MODELS = int(os.getenv("MODEL_CACHE_MAX_MODELS", "0"))  # loaded models kept per process (0 = no limit)
+MODEL_CACHE_MAX_MB = float(os.getenv("MODEL_CACHE_MAX_MB", "256"))  # size limit of the loaded models (0 = no limit)
+
+# Storage tiering: raw rows -> hourly rollups -> daily rollups (0 days = keep raw forever)
+RAW_RETENTION_DAYS = int(os.getenv("RAW_RETENTION_DAYS", "30"))
+HOURLY_RETENTION_DAYS = int(os.getenv("HOURLY_RETENTION_DAYS", "365"))
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", str(6 * 3600)))  # seconds between compaction runs
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")  # .npy partitions of sealed months ("" = off)
+
+# Bulk map/bounds crawling (async mode only)
+CRAWL_FETCH = os.getenv("CRAWL_FETCH", "feed")  # "feed" (one call per station) or "tiles" (map/bounds)
+CRAWL_TILE_GRID = os.getenv("CRAWL_TILE_GRID", "3x4")  # rows x cols over ASEAN_BOUNDS
+CRAWL_TILE_DETAIL = os.getenv("CRAWL_TILE_DETAIL", "1") == "1"  # feed call for new readings (pm25/iaqi)
+
+# Tọa độ ĐÔNG NAM Á (lat_min, lng_min, lat_max, lng_max) - same box as scan_map.py
+ASEAN_BOUNDS = (-11.0, 92.0, 28.5, 141.0)
+
+# Ingest providers polled by the crawler: waqi, openaq, owm (OpenWeatherMap grid), stub
+INGEST_PROVIDERS = [p.strip() for p in os.getenv("INGEST_PROVIDERS", "waqi").split(",") if p.strip()]
+INGEST_STUB_FILE = os.getenv("INGEST_STUB_FILE", "")  # JSON/NDJSON records replayed by the stub provider
+OWM_GRID_STEP_DEG = float(os.getenv("OWM_GRID_STEP_DEG", "3"))  # grid spacing for OWM points
+OWM_GRID_SPARSE_KM = float(os.getenv("OWM_GRID_SPARSE_KM", "150"))  # only where no WAQI station is this close
+PROVIDER_MERGE_KM = float(os.getenv("PROVIDER_MERGE_KM", "5"))  # other sources skipped this close to WAQI
+
+# Outbound call governor (rate per second, calls per UTC day; 0 = unlimited)
+WAQI_RATE_PER_SEC = float(os.getenv("WAQI_RATE_PER_SEC", "50"))
+WAQI_DAILY_QUOTA = int(os.getenv("WAQI_DAILY_QUOTA", "0"))
+OWM_RATE_PER_SEC = float(os.getenv("OWM_RATE_PER_SEC", "1"))
+OWM_DAILY_QUOTA = int(os.getenv("OWM_DAILY_QUOTA", "1000"))  # free tier
+OPENAQ_RATE_PER_SEC = float(os.getenv("OPENAQ_RATE_PER_SEC", "1"))
+OPENAQ_DAILY_QUOTA = int(os.getenv("OPENAQ_DAILY_QUOTA", "0"))
+GOVERNOR_QUOTA_DB = os.getenv("GOVERNOR_QUOTA_DB", "provider_quota.db")  # daily quota counters shared by all processes
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))  # consecutive failures before failing fast
+BREAKER_RESET_SECONDS = int(os.getenv("BREAKER_RESET_SECONDS", "60"))
+
 
 def load_stations_config():
     """Load danh sách trạm từ stations.json"""
@@ -1,115 +1,505 @@
 """
 Crawler module for AirWatch ASEAN
-Fetches AQI data from WAQI API
+Fetches AQI data from WAQI API (plus OpenAQ / OpenWeatherMap grid
+providers, see app.providers, when listed in INGEST_PROVIDERS)
+
+Run standalone with `python -m app.crawler` (set RUN_CRAWLER=off for the
+web workers). Only one crawler runs per data directory: it holds an OS
+file lock next to the SQLite file.
 """
-import sqlite3
+import os
+import sys
 import time
+import asyncio
 import logging
-import requests
-from datetime import datetime
+from datetime import datetime, timezone
+from threading import Thread
 from concurrent.futures import ThreadPoolExecutor
 
-from app.config import WAQI_TOKEN, STATIONS_CONFIG
-from app.db import get_db_connection
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+    logging.warning("httpx not available, async crawl mode disabled")
+
+from app.config import (
+    DB_NAME, WAQI_TOKEN, STATIONS_CONFIG, CRAWL_INTERVAL, CRAWL_MODE,
+    CRAWL_CONCURRENCY, CRAWL_TIMEOUT, CRAWL_SCHEDULE, CRAWL_SWEEP_DEADLINE, CRAWL_HEDGE,
+    CRAWL_FETCH, CRAWL_TILE_GRID, CRAWL_TILE_DETAIL, ASEAN_BOUNDS, INGEST_PROVIDERS,
+    RAW_RETENTION_DAYS, setup_logging
+)
+from app.db import IAQI_COLUMNS, station_tz
+from app.governor import governed_get, governed_get_async, ProviderUnavailable
+from app.latency import crawler_latency
+from app.providers import Provider, build_extra_providers
+from app.retention import retention_task
+from app.scheduler import PollScheduler
+from app.storage import store
+from app.writer import measurement_writer
+from app.forecasts import forecast_refresher
+from app.training import model_trainer
+
+# Minimum pause between scheduler wake-ups, so stations due close together share a sweep
+CRAWL_TICK = 10
+# Never hedge sooner than this, even for very fast stations
+HEDGE_MIN_DELAY = 0.5
+
+WAQI_FEED_URL = "https://api.waqi.info/feed/@{uid}/"
+WAQI_BOUNDS_URL = "https://api.waqi.info/map/bounds/"
+
+# Scheduler/providers of the crawler running in this process (None/[] if it runs elsewhere)
+crawler_scheduler = None
+crawler_providers = []
+
+
+def parse_station_feed(station, raw):
+    """Validate a WAQI feed payload and turn it into a measurement record"""
+    if raw.get('status') != 'ok':
+        return None
+
+    data = raw.get('data', {})
+    aqi = data.get('aqi')
+    iaqi = data.get('iaqi', {})
+    pm25 = iaqi.get('pm25', {}).get('v', 0)
+
+    if str(aqi).isdigit() and 0 <= int(aqi) <= 999:
+        try:
+            t_str = data.get('time', {}).get('iso')
+            ts = _reading_time(t_str, station)
+        except:
+            ts = datetime.now(timezone.utc)
+
+        record = {
+            "uid": station['uid'], "name": station['name'],
+            "aqi": int(aqi), "pm25": float(pm25) if float(pm25) >= 0 else 0.0,
+            "timestamp": ts
+        }
+        for key, column in IAQI_COLUMNS.items():
+            record[column] = _iaqi_value(iaqi, key)
+        return record
+    return None
+
+
+def _reading_time(t_str, station):
+    """WAQI reading time, kept with its UTC offset (guessed for the station when missing)"""
+    ts = datetime.fromisoformat(t_str)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=station_tz(station.get('lng', 0), station.get('country')))
+    return ts
+
+
+def _iaqi_value(iaqi, key):
+    """Numeric value of one iaqi channel, None if missing or malformed"""
+    try:
+        return float(iaqi[key]['v'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def parse_bounds_entry(station, entry):
+    """
+    Turn a WAQI map/bounds entry into a measurement record.
+    Same AQI rules as parse_station_feed; map/bounds has no iaqi, so pm25 is unknown.
+    """
+    aqi = entry.get('aqi')
+    if not (str(aqi).isdigit() and 0 <= int(aqi) <= 999):
+        return None
+    try:
+        t_str = entry.get('station', {}).get('time')
+        ts = _reading_time(t_str, station)
+    except:
+        return None  # without a reading time we cannot tell if it is new
+
+    return {
+        "uid": station['uid'], "name": station['name'],
+        "aqi": int(aqi), "pm25": None,
+        "timestamp": ts
+    }
+
+
+def split_bounds(bounds, grid):
+    """Split (lat_min, lng_min, lat_max, lng_max) into a rows x cols list of tiles"""
+    rows, cols = (int(n) for n in grid.lower().split("x"))
+    lat_min, lng_min, lat_max, lng_max = bounds
+    lat_step = (lat_max - lat_min) / rows
+    lng_step = (lng_max - lng_min) / cols
+    return [
+        (lat_min + r * lat_step, lng_min + c * lng_step,
+         lat_min + (r + 1) * lat_step, lng_min + (c + 1) * lng_step)
+        for r in range(rows) for c in range(cols)
+    ]
 
 
 def fetch_single_station(station):
     """Fetch AQI data for a single station from WAQI API"""
+    started = time.monotonic()
     try:
         url = f"https://api.waqi.info/feed/@{station['uid']}/?token={WAQI_TOKEN}"
-        resp = requests.get(url, timeout=15)
+        resp = governed_get("waqi", url, wait=CRAWL_TIMEOUT, timeout=CRAWL_TIMEOUT)
+        _observe_latency(station, started)
         if resp.status_code == 200:
-            raw = resp.json()
-            if raw.get('status') == 'ok':
-                data = raw.get('data', {})
-                aqi = data.get('aqi')
-                pm25 = data.get('iaqi', {}).get('pm25', {}).get('v', 0)
-                
-                if str(aqi).isdigit() and 0 <= int(aqi) <= 999:
-                    try:
-                        t_str = data.get('time', {}).get('iso')
-                        ts = datetime.fromisoformat(t_str).replace(tzinfo=None)
-                    except:
-                        ts = datetime.now()
-                    
-                    return {
-                        "uid": station['uid'], "name": station['name'],
-                        "aqi": int(aqi), "pm25": float(pm25) if float(pm25) >= 0 else 0.0,
-                        "timestamp": ts
-                    }
-    except Exception:
+            return parse_station_feed(station, resp.json())
+    except ProviderUnavailable:
         pass
+    except Exception:
+        _observe_latency(station, started, failed=True)
     return None
 
 
-def check_spike_alert(uid, current_aqi):
-    """Kiểm tra đột biến AQI để tạo cảnh báo"""
-    conn = None
-    max_retries = 3
-    for attempt in range(max_retries):
+def _observe_latency(station, started, failed=False):
+    elapsed = time.monotonic() - started
+    crawler_latency.observe(station['uid'], elapsed, timed_out=failed)
+    crawler_latency.observe("waqi", elapsed, timed_out=failed)
+
+
+def _hedge_delay(station):
+    """Send a backup request once a call has taken longer than the station's p95"""
+    if not CRAWL_HEDGE:
+        return None
+    p95 = crawler_latency.percentile(station['uid'], 0.95)
+    if p95 is None:
+        p95 = crawler_latency.percentile("waqi", 0.95)
+    if p95 is None or p95 >= CRAWL_TIMEOUT:
+        return None
+    return max(p95, HEDGE_MIN_DELAY)
+
+
+async def _hedged_get(client, url, params, hedge_after):
+    """
+    GET with an optional hedge: if the first request is not done after
+    `hedge_after` seconds, race a second one and keep whichever answers first.
+    """
+    first = asyncio.create_task(governed_get_async(client, "waqi", url, wait=CRAWL_TIMEOUT, params=params))
+    tasks = {first}
+    try:
+        if hedge_after is not None:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                # The hedge never waits for a token: if the governor says no, just keep waiting
+                tasks.add(asyncio.create_task(governed_get_async(client, "waqi", url, params=params)))
+                crawler_latency.hedges_sent += 1
+
+        while True:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            # exception() on every finished task, so none is reported as "never retrieved"
+            winners = [task for task in done if task.exception() is None]
+            if winners:
+                if first not in winners:
+                    crawler_latency.hedges_won += 1
+                return winners[0].result()
+            if not tasks:
+                raise done.pop().exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def fetch_station_async(client, station, semaphore):
+    """Fetch AQI data for a single station using the shared async client"""
+    async with semaphore:
+        started = time.monotonic()
+        try:
+            resp = await _hedged_get(
+                client, WAQI_FEED_URL.format(uid=station['uid']),
+                {'token': WAQI_TOKEN}, _hedge_delay(station)
+            )
+            _observe_latency(station, started)
+            if resp.status_code == 200:
+                return station, parse_station_feed(station, resp.json())
+        except ProviderUnavailable:
+            pass
+        except Exception:
+            _observe_latency(station, started, failed=True)
+    return station, None
+
+
+async def fetch_tile_async(client, tile, semaphore):
+    """Fetch every station inside one map/bounds tile, returns a list of entries"""
+    async with semaphore:
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT aqi FROM measurements 
-                WHERE station_uid=? 
-                ORDER BY timestamp DESC LIMIT 3
-            """, (uid,))
-            rows = cursor.fetchall()
-            
-            if len(rows) >= 2:
-                prev_avg = sum(r[0] for r in rows[1:]) / len(rows[1:])
-                # Nếu tăng hơn 30% -> cảnh báo
-                if current_aqi > prev_avg * 1.3 and current_aqi > 100:
-                    cursor.execute("""
-                        INSERT INTO alerts (station_uid, alert_type, message, aqi_value)
-                        VALUES (?, 'SPIKE', ?, ?)
-                    """, (uid, f"AQI tăng đột biến từ {int(prev_avg)} lên {current_aqi}", current_aqi))
-                    conn.commit()
-                    logging.warning(f"⚠️ SPIKE ALERT: Station {uid} - AQI {current_aqi}")
-            break  # Success, exit retry loop
-        except sqlite3.OperationalError as e:
-            if "locked" in str(e) and attempt < max_retries - 1:
-                time.sleep(0.5 * (attempt + 1))  # Exponential backoff
+            resp = await governed_get_async(
+                client, "waqi", WAQI_BOUNDS_URL, wait=CRAWL_TIMEOUT,
+                params={'latlng': ",".join(f"{v:.4f}" for v in tile), 'token': WAQI_TOKEN}
+            )
+            if resp.status_code == 200:
+                raw = resp.json()
+                if raw.get('status') == 'ok':
+                    return raw.get('data') or []
+        except Exception:
+            pass
+    return []
+
+
+async def crawl_stations_async(client, stations, on_result=None, on_deferred=None, emit=None):
+    """
+    Sweep the given stations concurrently over one pooled client.
+    Each result goes to emit (default: the writer queue) as soon as it arrives;
+    on_result(station, record_or_None) is called for every station that
+    answered before CRAWL_SWEEP_DEADLINE, on_deferred(station) for the rest.
+    Returns the number of records queued.
+    """
+    emit = emit or measurement_writer.submit
+    semaphore = asyncio.Semaphore(CRAWL_CONCURRENCY)
+    tasks = {
+        asyncio.create_task(fetch_station_async(client, st, semaphore)): st
+        for st in stations
+    }
+
+    queued = 0
+    handled = set()  # uids whose result already went to on_result / emit
+
+    def handle(station, res):
+        nonlocal queued
+        handled.add(station['uid'])
+        if on_result:
+            on_result(station, res)
+        if res:
+            emit(res)
+            queued += 1
+
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=CRAWL_SWEEP_DEADLINE):
+            handle(*await next_done)
+    except asyncio.TimeoutError:
+        # Tasks that finished between the deadline and here still count as answered:
+        # pop_due() already took them off the schedule, so dropping them would lose the station
+        slow = []
+        for task, station in tasks.items():
+            if station['uid'] in handled:
                 continue
-            logging.error(f"Spike check error: {e}")
+            if task.done() and not task.cancelled() and task.exception() is None:
+                handle(*task.result())
+            else:
+                task.cancel()
+                slow.append(station)
+        crawler_latency.deferred += len(slow)
+        logging.info(f"Sweep deadline reached, deferring {len(slow)} slow stations to the next cycle")
+        for station in slow:
+            # Count the cut-off as a timed-out sample so the station shows up as slow
+            crawler_latency.observe(station['uid'], CRAWL_SWEEP_DEADLINE, timed_out=True)
+            if on_deferred:
+                on_deferred(station)
+    return queued
+
+
+async def crawl_tiles_async(client, scheduler, emit=None):
+    """
+    One bulk cycle: fetch the ASEAN box as map/bounds tiles, match entries
+    to STATIONS_CONFIG by uid, then fall back to feed calls only for
+    stations with a new reading (iaqi detail) or missing from the tiles.
+    """
+    emit = emit or measurement_writer.submit
+    semaphore = asyncio.Semaphore(CRAWL_CONCURRENCY)
+    tiles = split_bounds(ASEAN_BOUNDS, CRAWL_TILE_GRID)
+    tile_results = await asyncio.gather(*[fetch_tile_async(client, t, semaphore) for t in tiles])
+    entries = {e.get('uid'): e for result in tile_results for e in result}
+
+    due = {st['uid'] for st in scheduler.pop_due()}
+    from_tiles = {}
+    feed_stations = []
+    for station in STATIONS_CONFIG:
+        uid = station['uid']
+        rec = parse_bounds_entry(station, entries[uid]) if uid in entries else None
+        if rec is not None and scheduler.is_new(uid, rec['timestamp']):
+            from_tiles[uid] = rec
+            if CRAWL_TILE_DETAIL:
+                feed_stations.append(station)
+        elif rec is not None:
+            if uid in due:
+                scheduler.record(station, rec)  # polled via tile, nothing new
+        elif uid in due:
+            feed_stations.append(station)  # missing from tiles
+
+    tile_only = [] if CRAWL_TILE_DETAIL else list(from_tiles.values())
+    for rec in tile_only:
+        scheduler.record(scheduler.stations[rec['uid']], rec)
+
+    def on_feed_result(station, res):
+        if res is None and station['uid'] in from_tiles:
+            # Feed call failed: keep the AQI we already have from the tile
+            res = from_tiles[station['uid']]
+            tile_only.append(res)
+        scheduler.record(station, res)
+
+    queued = await crawl_stations_async(
+        client, feed_stations, on_result=on_feed_result,
+        on_deferred=lambda station: on_feed_result(station, None), emit=emit
+    )
+    for rec in tile_only:
+        emit(rec)
+
+    logging.info(
+        f"Tiles: {len(tiles)} calls, {len(entries)} stations seen, "
+        f"{len(from_tiles)} new readings, {len(feed_stations)} feed calls"
+    )
+    return queued + len(tile_only)
+
+
+def _make_scheduler():
+    global crawler_scheduler
+    scheduler = PollScheduler(STATIONS_CONFIG, adaptive=CRAWL_SCHEDULE == "adaptive")
+    if scheduler.adaptive:
+        scheduler.learn_from_history()
+    crawler_scheduler = scheduler
+    return scheduler
+
+
+class WAQIProvider(Provider):
+    """WAQI stations from stations.json: per-station feed calls or map/bounds tiles"""
+    name = "waqi"
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    async def poll(self, client, emit):
+        started = time.monotonic()
+        if CRAWL_FETCH == "tiles":
+            count = await crawl_tiles_async(client, self.scheduler, emit)
+        else:
+            due = self.scheduler.pop_due()
+            if not due:
+                return
+            logging.info(f"Scanning {len(due)}/{len(STATIONS_CONFIG)} due stations (async)...")
+            count = await crawl_stations_async(
+                client, due, on_result=self.scheduler.record,
+                on_deferred=self.scheduler.defer, emit=emit
+            )
+        logging.info(f"Queued {count} records in {time.monotonic() - started:.1f}s.")
+
+    def next_delay(self):
+        if CRAWL_FETCH == "tiles":
+            return CRAWL_INTERVAL
+        return max(self.scheduler.seconds_until_next(), CRAWL_TICK)
+
+
+def build_providers():
+    """Providers listed in INGEST_PROVIDERS (WAQI first)"""
+    providers = []
+    if "waqi" in INGEST_PROVIDERS:
+        providers.append(WAQIProvider(_make_scheduler()))
+    providers.extend(build_extra_providers(INGEST_PROVIDERS))
+    return providers
+
+
+async def _run_provider(provider, client):
+    """Poll one provider forever; a failing provider never stops the others"""
+    while True:
+        try:
+            await provider.poll(client, measurement_writer.submit)
         except Exception as e:
-            logging.error(f"Spike check error: {e}")
-            break
-        finally:
-            if conn:
-                conn.close()
+            logging.error(f"Provider {provider.name} error: {e}")
+        await asyncio.sleep(provider.next_delay())
 
 
-def crawler_task():
-    """Background task to periodically fetch AQI data from all stations"""
-    logging.info(">>> Crawler started...")
+async def _crawler_loop_async(providers):
+    """Async crawl loop: all providers run concurrently over one keep-alive client"""
+    limits = httpx.Limits(
+        max_connections=CRAWL_CONCURRENCY,
+        max_keepalive_connections=CRAWL_CONCURRENCY
+    )
+    timeout = httpx.Timeout(CRAWL_TIMEOUT, connect=min(5.0, CRAWL_TIMEOUT))
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        await asyncio.gather(*(_run_provider(p, client) for p in providers))
+
+
+def _crawler_loop_threads():
+    """Legacy crawl loop: one blocking feed call per station on a thread pool"""
+    scheduler = _make_scheduler()
     while True:
-        logging.info(f"Scanning {len(STATIONS_CONFIG)} stations...")
-        valid_data_batch = []
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            results = executor.map(fetch_single_station, STATIONS_CONFIG)
-            for res in results:
-                if res: valid_data_batch.append(res)
-
-        if valid_data_batch:
-            try:
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                count = 0
-                for item in valid_data_batch:
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO measurements (station_uid, station_name, aqi, pm25, timestamp) 
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (item['uid'], item['name'], item['aqi'], item['pm25'], item['timestamp']))
-                    if cursor.rowcount > 0: 
-                        count += 1
-                        # Kiểm tra spike alert
-                        check_spike_alert(item['uid'], item['aqi'])
-                conn.commit()
-                conn.close()
-                logging.info(f"Saved {count} new records.")
-            except Exception as e:
-                logging.error(f"DB Write Error: {e}")
-        
-        time.sleep(300)
+        due = scheduler.pop_due()
+        if due:
+            logging.info(f"Scanning {len(due)}/{len(STATIONS_CONFIG)} due stations...")
+            valid_data_batch = []
+            with ThreadPoolExecutor(max_workers=10) as executor:
+                results = executor.map(fetch_single_station, due)
+                for station, res in zip(due, results):
+                    scheduler.record(station, res)
+                    if res: valid_data_batch.append(res)
+
+            measurement_writer.submit_many(valid_data_batch)
+
+        time.sleep(max(scheduler.seconds_until_next(), CRAWL_TICK))
+
+
+def crawler_task(providers=None):
+    """
+    Background task to periodically fetch AQI data from all stations.
+    `providers` overrides INGEST_PROVIDERS (e.g. StubProvider instances for testing).
+    """
+    global crawler_providers
+    logging.info(">>> Crawler started...")
+    if not forecast_refresher.is_alive():
+        measurement_writer.listeners.append(forecast_refresher.on_batch)
+        forecast_refresher.start()
+        forecast_refresher.mark(forecast_refresher.configured)  # forecasts for data from before the restart
+    if not model_trainer.is_alive():
+        model_trainer.listeners.append(forecast_refresher.on_models)
+        model_trainer.start()
+    if not measurement_writer.is_alive():
+        measurement_writer.start()
+    if RAW_RETENTION_DAYS > 0 and store.name == "sqlite":  # Postgres keeps raw partitions
+        Thread(target=retention_task, name="retention", daemon=True).start()
+    if CRAWL_MODE == "async" and HTTPX_AVAILABLE:
+        crawler_providers = providers if providers is not None else build_providers()
+        logging.info(f"Ingest providers: {', '.join(p.name for p in crawler_providers)}")
+        asyncio.run(_crawler_loop_async(crawler_providers))
+    else:
+        if CRAWL_FETCH == "tiles" or INGEST_PROVIDERS != ["waqi"]:
+            logging.warning("Tiles and extra providers need the async crawler, using WAQI feed calls only")
+        _crawler_loop_threads()
+
+
+# Lock file held for the lifetime of the crawler (one per data directory)
+CRAWLER_LOCK_PATH = os.path.abspath(DB_NAME) + ".crawler.lock"
+_crawler_lock = None
+
+
+def acquire_crawler_lock():
+    """
+    Try to take the single-crawler lock without blocking.
+    Returns True if this process now owns the crawler, False if another process does.
+    The OS releases the lock when the process exits, so a crash never leaves it stale.
+    """
+    global _crawler_lock
+    if _crawler_lock is not None:
+        return True
+
+    lock_file = open(CRAWLER_LOCK_PATH, "a+")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    _crawler_lock = lock_file
+    return True
+
+
+def start_embedded_crawler():
+    """Start the crawler thread if no other process owns the crawler lock"""
+    if not acquire_crawler_lock():
+        logging.info("Crawler already running for this data directory, web worker is read-only")
+        return None
+    thread = Thread(target=crawler_task, daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    setup_logging()
+    store.init()
+    if not acquire_crawler_lock():
+        logging.error(f"Another crawler holds {CRAWLER_LOCK_PATH}, exiting.")
+        sys.exit(1)
+    crawler_task()
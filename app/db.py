@@ -5,17 +5,83 @@ SQLite database connection and initialization
 import sqlite3
 import logging
 import os
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta, timezone
 
 from app.config import DB_NAME
 
 
+# Timestamps are stored as integer UTC epoch seconds plus the station's UTC
+# offset (seconds), so comparisons and hour-of-day grouping are integer math.
+# API responses keep the station-local ISO text they always had (local_iso).
+
+def to_epoch(ts):
+    """datetime / ISO text -> UTC epoch seconds (naive values are taken as UTC)"""
+    if ts is None or isinstance(ts, int):
+        return ts
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp())
+
+
+def utc_offset(ts):
+    """Seconds east of UTC of an aware datetime (0 for naive)"""
+    offset = ts.utcoffset() if isinstance(ts, datetime) else None
+    return int(offset.total_seconds()) if offset is not None else 0
+
+
+def to_utc(ts):
+    """Naive UTC datetime (what PostgreSQL TIMESTAMP columns hold)"""
+    return datetime.fromtimestamp(to_epoch(ts), timezone.utc).replace(tzinfo=None)
+
+
+def local_iso(ts, offset=0):
+    """Stored UTC value + offset -> station-local ISO text, the API format"""
+    if ts is None:
+        return None
+    return datetime.fromtimestamp(to_epoch(ts) + (offset or 0), timezone.utc).replace(tzinfo=None).isoformat()
+
+
+# ASEAN countries on one offset; Indonesia spans three (see guess_utc_offset)
+COUNTRY_UTC_OFFSETS = {
+    "Vietnam": 7, "Thailand": 7, "Cambodia": 7, "Laos": 7, "Myanmar": 6.5,
+    "Malaysia": 8, "Singapore": 8, "Philippines": 8, "Brunei": 8, "Timor-Leste": 9,
+}
+
+
+def guess_utc_offset(lng, country=None):
+    """UTC offset in seconds for a station that did not report one"""
+    hours = COUNTRY_UTC_OFFSETS.get(country)
+    if hours is None and country == "Indonesia":
+        hours = 7 if lng < 114.5 else 8 if lng < 127 else 9  # WIB / WITA / WIT
+    if hours is None:
+        hours = round(lng / 15)
+    return int(hours * 3600)
+
+
+def station_tz(lng, country=None):
+    return timezone(timedelta(seconds=guess_utc_offset(lng, country)))
+
+
 def adapt_datetime(ts): 
-    return ts.isoformat()
+    return to_epoch(ts)
 
 
 def convert_datetime(ts): 
-    return datetime.fromisoformat(ts.decode())
+    value = ts.decode()
+    if value.lstrip("-").isdigit():
+        return datetime.fromtimestamp(int(value), timezone.utc)
+    return datetime.fromisoformat(value)
+
+
+# WAQI iaqi channel -> measurements column (REAL, NULL when the station lacks it)
+IAQI_COLUMNS = {
+    'pm10': 'pm10', 'o3': 'o3', 'no2': 'no2', 'so2': 'so2', 'co': 'co',
+    't': 'temperature', 'h': 'humidity', 'p': 'pressure', 'w': 'wind', 'dew': 'dew'
+}
+READING_COLUMNS = tuple(IAQI_COLUMNS.values())
 
 
 # Register adapters
@@ -25,57 +91,80 @@ sqlite3.register_converter("DATETIME", convert_datetime)
 
 def get_db_connection(timeout=30):
     """
-    Get database connection with timeout and WAL mode to prevent locking.
+    Get a new read-write connection with timeout and WAL mode to prevent locking.
     WAL mode allows concurrent reads while writing.
+    For one-off scripts; app code uses get_read_connection / get_write_connection.
     """
-    print(f"📁 [DB] Connecting to database: {DB_NAME}")
-    print(f"📁 [DB] Current working directory: {os.getcwd()}")
     conn = sqlite3.connect(DB_NAME, timeout=timeout)
     conn.execute("PRAGMA journal_mode=WAL")
     conn.execute("PRAGMA busy_timeout=30000")  # 30 seconds
     return conn
 
 
+# Tuned once per connection instead of on every request
+READ_PRAGMAS = (
+    "PRAGMA busy_timeout=30000",
+    "PRAGMA mmap_size=268435456",  # 256 MB memory-mapped reads
+    "PRAGMA cache_size=-16000",  # ~16 MB page cache
+    "PRAGMA temp_store=MEMORY",  # GROUP BY / ORDER BY temp b-trees in RAM
+)
+
+_local = threading.local()
+_writer_conn = None
+# Serializes use of the shared writer connection (writer thread, init_db, maintenance)
+write_lock = threading.RLock()
+
+
+def get_read_connection():
+    """
+    Read-only connection owned by the calling thread, opened and tuned on
+    first use and reused afterwards. Do not close it; set row_factory on
+    the cursor, not the connection.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(f"file:{os.path.abspath(DB_NAME)}?mode=ro", uri=True, timeout=30)
+        for pragma in READ_PRAGMAS:
+            conn.execute(pragma)
+        _local.conn = conn
+    return conn
+
+
+def get_write_connection():
+    """
+    The process-wide writer connection (WAL). Hold write_lock while using it;
+    do not close it.
+    """
+    global _writer_conn
+    with write_lock:
+        if _writer_conn is None:
+            conn = sqlite3.connect(DB_NAME, timeout=30, check_same_thread=False)
+            # Only takes effect on a new file; app.retention converts older DBs once
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute("PRAGMA synchronous=NORMAL")  # safe in WAL, fewer fsyncs per commit
+            _writer_conn = conn
+        return _writer_conn
+
+
 def init_db():
-    """Initialize AQI database tables"""
+    """Initialize AQI database tables (applies pending schema migrations)"""
+    from app.migrations import run_migrations, ensure_indexes  # app.migrations imports this module
     print("🗄️ [DB] Starting database initialization...")
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        print("🗄️ [DB] Creating measurements table...")
-        cursor.execute('''CREATE TABLE IF NOT EXISTS measurements (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, 
-            station_uid INTEGER, 
-            station_name TEXT,
-            aqi INTEGER, 
-            pm25 REAL,
-            timestamp DATETIME,
-            UNIQUE(station_uid, timestamp)
-        )''')
-        
-        # Add station_name column if it doesn't exist (migration for existing DB)
-        try:
-            cursor.execute("ALTER TABLE measurements ADD COLUMN station_name TEXT")
-            print("🗄️ [DB] Added station_name column to existing table")
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-        
-        print("🗄️ [DB] Creating alerts table...")
-        cursor.execute('''CREATE TABLE IF NOT EXISTS alerts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            station_uid INTEGER,
-            alert_type TEXT,
-            message TEXT,
-            aqi_value INTEGER,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )''')
-        
-        conn.commit()
-        conn.close()
+        conn = get_write_connection()
+        with write_lock:
+            applied = run_migrations(conn)
+            rebuilt = ensure_indexes(conn)
+        for version, name in applied:
+            print(f"🗄️ [DB] Applied migration {version:03d} {name}")
+        for name in rebuilt:
+            logging.warning(f"Re-created missing index {name} (interrupted bulk load?)")
         print("✅ [DB] Database initialized successfully!")
         logging.info("Database initialized.")
     except Exception as e:
         print(f"❌ [DB] Database initialization FAILED: {e}")
         logging.error(f"DB Init Failed: {e}")
         raise  # Re-raise to make error visible
+
@@ -0,0 +1,184 @@
+"""
+Forecast cache for AirWatch ASEAN
+Forecasts are computed once per new reading instead of on every request.
+The crawler process re-forecasts the stations that received new data after
+each writer batch (ForecastRefresher) and stores the result in the
+forecasts table; API processes serve them from memory (ForecastCache),
+re-reading the table every FORECAST_RELOAD_SECONDS.
+
+Each entry carries `generated_at` (UTC epoch) and `data_through`, the
+station's latest reading when the forecast was made. Requests never run
+the predictor: an entry whose data_through no longer matches
+store.latest() is served as is (data_through shows its age) and the
+refresher is asked to recompute it; a station with no entry yet gets a
+placeholder. Placeholders ("Đang học...", "N/A") are cached like
+forecasts, keyed by data_through, so untrained and low-data stations are
+not recomputed on every request either.
+"""
+import time
+import logging
+import threading
+
+from app.config import STATIONS_CONFIG, FORECAST_REFRESH_DELAY, FORECAST_RELOAD_SECONDS
+from app.storage import store
+from app.predictor import predictor, GLOBAL_UID
+
+FORECAST_HOURS = [1, 6, 12, 24]
+
+
+def _entries(results, latest):
+    """predict_all results -> {uid: entry}"""
+    now = int(time.time())
+    entries = {}
+    for uid, (preds, trend, confidence) in results.items():
+        row = latest.get(uid)
+        entries[uid] = {
+            "predictions": preds, "trend": trend, "confidence": confidence,
+            "generated_at": now, "data_through": row['timestamp'] if row else None,
+        }
+    return entries
+
+
+def _placeholder():
+    """Served until the refresher has forecast a station"""
+    return {
+        "predictions": {h: "Đang học..." for h in FORECAST_HOURS}, "trend": "stable", "confidence": 0,
+        "generated_at": None, "data_through": None,
+    }
+
+
+class ForecastCache:
+    """In-memory forecasts of this process, backed by the forecasts table"""
+
+    def __init__(self, reload_seconds=FORECAST_RELOAD_SECONDS):
+        self.reload_seconds = reload_seconds
+        self.entries = {}  # uid -> entry
+        self.loaded_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def put(self, entries):
+        with self._lock:
+            self.entries.update(entries)
+
+    def _reload(self):
+        if time.monotonic() - self.loaded_at < self.reload_seconds:
+            return
+        self.loaded_at = time.monotonic()
+        try:
+            stored = store.forecasts()
+        except Exception as e:
+            logging.error(f"Forecast reload error: {e}")
+            return
+        with self._lock:
+            for uid, entry in stored.items():
+                current = self.entries.get(uid)
+                if current is None or entry['generated_at'] >= current['generated_at']:
+                    self.entries[uid] = entry
+
+    def get_many(self, uids, latest=None):
+        """
+        {uid: entry}, never computed here: stale entries are served as they
+        are, missing ones as a placeholder, and both are left to the refresher.
+        """
+        latest = store.latest() if latest is None else latest
+        self._reload()
+        result, misses = {}, []
+        for uid in uids:
+            entry = self.entries.get(uid)
+            row = latest.get(uid)
+            if entry is None or entry['data_through'] != (row['timestamp'] if row else None):
+                misses.append(uid)
+            result[uid] = entry if entry is not None else _placeholder()
+        self.hits += len(uids) - len(misses)
+        self.misses += len(misses)
+        if misses and forecast_refresher.is_alive():
+            forecast_refresher.mark(misses)  # the API process has no refresher; the crawler's sees the same data
+        return result
+
+    def get(self, uid):
+        return self.get_many([uid])[uid]
+
+    def stats(self):
+        return {"cached": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+class ForecastRefresher(threading.Thread):
+    """
+    Re-forecasts stations with new data. Writer batches mark stations dirty;
+    after FORECAST_REFRESH_DELAY seconds (so one crawl cycle becomes one
+    refresh) all dirty stations are predicted together and saved.
+    """
+
+    def __init__(self, cache, delay=FORECAST_REFRESH_DELAY):
+        super().__init__(name="forecast-refresher", daemon=True)
+        self.cache = cache
+        self.delay = delay
+        self.configured = {st['uid'] for st in STATIONS_CONFIG}
+        self.dirty = set()
+        self._cond = threading.Condition()
+        self.refreshes = 0
+        self.refreshed = 0
+        self.errors = 0
+        self.last_seconds = None
+
+    def mark(self, uids):
+        uids = self.configured.intersection(uids)
+        if not uids:
+            return
+        with self._cond:
+            self.dirty.update(uids)
+            self._cond.notify()
+
+    def on_batch(self, new_items):
+        """MeasurementWriter listener"""
+        self.mark(item['uid'] for item in new_items)
+
+    def on_models(self, uids):
+        """ModelTrainer listener: stations whose model was replaced"""
+        self.mark(self.configured if GLOBAL_UID in uids else uids)
+
+    def run(self):
+        logging.info(">>> Forecast refresher started...")
+        while True:
+            with self._cond:
+                while not self.dirty:
+                    self._cond.wait()
+            time.sleep(self.delay)
+            with self._cond:
+                uids, self.dirty = self.dirty, set()
+            try:
+                self.refresh(uids)
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Forecast refresh error: {e}")
+
+    def refresh(self, uids):
+        started = time.monotonic()
+        latest = store.latest()  # read first: data_through must not claim rows the model has not seen
+        uids = sorted(uid for uid in uids if uid in latest)
+        if not uids:
+            return
+        # Placeholders are saved too, so requests do not ask for them again until the data changes
+        entries = _entries(predictor.predict_all(FORECAST_HOURS, uids), latest)
+        store.save_forecasts(entries)
+        self.cache.put(entries)
+        self.refreshes += 1
+        self.refreshed += len(entries)
+        self.last_seconds = round(time.monotonic() - started, 3)
+        logging.info(f"Refreshed {len(entries)} forecasts in {self.last_seconds}s.")
+
+    def stats(self):
+        return {
+            "refreshes": self.refreshes,
+            "refreshed": self.refreshed,
+            "pending": len(self.dirty),
+            "last_seconds": self.last_seconds,
+            "errors": self.errors,
+        }
+
+
+# Singletons: the cache serves the API, the refresher is started by the crawler
+forecast_cache = ForecastCache()
+forecast_refresher = ForecastRefresher(forecast_cache)
@@ -0,0 +1,293 @@
+"""
+Outbound call governor for AirWatch ASEAN
+Token-bucket rate limits, daily quotas and circuit breakers per provider
+(WAQI, OpenWeatherMap, OpenAQ). One instance is shared by the crawler and
+the request handlers. Rates, breakers and counters are per process; daily
+quotas are counted in a small SQLite file (GOVERNOR_QUOTA_DB) shared by
+every process on the host, so N workers still spend one quota.
+"""
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+import requests
+
+from app.config import (
+    WAQI_RATE_PER_SEC, WAQI_DAILY_QUOTA, OWM_RATE_PER_SEC, OWM_DAILY_QUOTA,
+    OPENAQ_RATE_PER_SEC, OPENAQ_DAILY_QUOTA, BREAKER_FAILURES, BREAKER_RESET_SECONDS, GOVERNOR_QUOTA_DB
+)
+
+
+class ProviderUnavailable(Exception):
+    """Raised when the governor refuses an outbound call (rate, quota or open circuit)"""
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """Take one token; returns 0 on success, else seconds until one is available"""
+        if self.rate <= 0:  # 0 = unlimited
+            return 0.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `threshold` consecutive failures;
+    open -> half_open after `reset_timeout` (one trial call);
+    half_open -> closed on success, back to open on failure.
+    """
+
+    def __init__(self, name, threshold, reset_timeout):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+    def allow(self, now):
+        if self.state == "open" and now - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self.trial_in_flight = False
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record(self, ok, now):
+        if ok:
+            self.state = "closed"
+            self.failures = 0
+            self.trial_in_flight = False
+            return
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                logging.warning(f"⚠️ Circuit for {self.name} opened after {self.failures} failures")
+            self.state = "open"
+            self.opened_at = now
+            self.trial_in_flight = False
+
+
+class SharedDailyQuota:
+    """Calls per provider and UTC day, shared by all processes through one SQLite file"""
+
+    def __init__(self, path=GOVERNOR_QUOTA_DB):
+        self.path = path
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS provider_quota (
+                provider TEXT NOT NULL,
+                day TEXT NOT NULL,
+                used INTEGER NOT NULL,
+                PRIMARY KEY (provider, day)
+            )""")
+            self._conn = conn
+        return self._conn
+
+    def take(self, provider, day, limit):
+        """Count one call unless `limit` calls were already made today; returns (allowed, used)"""
+        conn = self._connection()
+        # One statement, so concurrent processes cannot both take the last call
+        allowed = conn.execute("""
+            INSERT INTO provider_quota (provider, day, used) VALUES (?, ?, 1)
+            ON CONFLICT (provider, day) DO UPDATE SET used = used + 1 WHERE used < ?
+        """, (provider, day, limit)).rowcount == 1
+        used = conn.execute(
+            "SELECT used FROM provider_quota WHERE provider = ? AND day = ?", (provider, day)
+        ).fetchone()[0]
+        return allowed, used
+
+    def prune(self, day):
+        """Drop the counters of days before `day`"""
+        self._connection().execute("DELETE FROM provider_quota WHERE day < ?", (day,))
+
+
+class ProviderGate:
+    """Rate limit + daily quota + breaker + counters for one provider"""
+
+    def __init__(self, name, rate_per_sec, daily_quota, burst=None, quota_store=None):
+        self.name = name
+        self.bucket = TokenBucket(rate_per_sec, burst or max(1.0, rate_per_sec))
+        self.breaker = CircuitBreaker(name, BREAKER_FAILURES, BREAKER_RESET_SECONDS)
+        self.daily_quota = daily_quota  # 0 = unlimited
+        self.quota_store = quota_store  # SharedDailyQuota; None = count in this process only
+        self.day = None
+        self.used_today = 0  # by all processes, as of this process's last call
+        self.counters = {
+            "allowed": 0, "throttled": 0, "quota_rejected": 0,
+            "circuit_rejected": 0, "successes": 0, "failures": 0
+        }
+
+    def try_acquire(self, now):
+        """Returns 0 if the call may proceed, a wait in seconds, or None if refused outright"""
+        today = datetime.now(timezone.utc).date()
+        if today != self.day:
+            self.day = today
+            self.used_today = 0
+            if self.daily_quota and self.quota_store:
+                try:
+                    self.quota_store.prune(today.isoformat())
+                except sqlite3.Error as e:
+                    logging.error(f"Quota store error: {e}")
+        if self.daily_quota and self.used_today >= self.daily_quota:
+            self.counters["quota_rejected"] += 1
+            return None
+        if not self.breaker.allow(now):
+            self.counters["circuit_rejected"] += 1
+            return None
+        wait = self.bucket.take(now)
+        if wait > 0:
+            if self.breaker.state == "half_open":
+                self.breaker.trial_in_flight = False  # give the trial slot back
+            return wait
+        if self.daily_quota and self.quota_store:
+            try:
+                allowed, self.used_today = self.quota_store.take(self.name, today.isoformat(), self.daily_quota)
+            except sqlite3.Error as e:
+                logging.error(f"Quota store error: {e}")  # fall back to this process's count
+                allowed, self.used_today = True, self.used_today + 1
+            if not allowed:
+                if self.breaker.state == "half_open":
+                    self.breaker.trial_in_flight = False
+                self.counters["quota_rejected"] += 1
+                return None
+        else:
+            self.used_today += 1
+        self.counters["allowed"] += 1
+        return 0.0
+
+    def stats(self):
+        return {
+            **self.counters,
+            "used_today": self.used_today,
+            "daily_quota": self.daily_quota or None,
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+        }
+
+
+class OutboundGovernor:
+    """Registry of provider gates; thread-safe, usable from sync and async code"""
+
+    def __init__(self, gates):
+        self.gates = {gate.name: gate for gate in gates}
+        self._lock = threading.Lock()
+
+    def _try(self, provider):
+        with self._lock:
+            return self.gates[provider].try_acquire(time.monotonic())
+
+    def _throttled(self, provider):
+        with self._lock:
+            self.gates[provider].counters["throttled"] += 1
+
+    def acquire(self, provider, wait=0.0):
+        """Block up to `wait` seconds for permission to call `provider`"""
+        deadline = time.monotonic() + wait
+        while True:
+            delay = self._try(provider)
+            if delay is None:
+                return False
+            if delay == 0:
+                return True
+            if time.monotonic() + delay > deadline:
+                self._throttled(provider)
+                return False
+            time.sleep(delay)
+
+    async def acquire_async(self, provider, wait=0.0):
+        """Async version of acquire(): waits on the event loop instead of blocking"""
+        deadline = time.monotonic() + wait
+        while True:
+            delay = self._try(provider)
+            if delay is None:
+                return False
+            if delay == 0:
+                return True
+            if time.monotonic() + delay > deadline:
+                self._throttled(provider)
+                return False
+            await asyncio.sleep(delay)
+
+    def record(self, provider, ok):
+        """Report the outcome of a call that was allowed"""
+        with self._lock:
+            gate = self.gates[provider]
+            gate.counters["successes" if ok else "failures"] += 1
+            gate.breaker.record(ok, time.monotonic())
+
+    def release(self, provider):
+        """An allowed call was cancelled before it finished: count nothing, free the trial slot"""
+        with self._lock:
+            self.gates[provider].breaker.trial_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {name: gate.stats() for name, gate in self.gates.items()}
+
+
+def _is_success(status_code):
+    # 4xx (other than 429) is our request's fault, not the upstream being down
+    return status_code < 500 and status_code != 429
+
+
+def governed_get(provider, url, wait=0.0, **kwargs):
+    """requests.get behind the governor; raises ProviderUnavailable if refused"""
+    if not governor.acquire(provider, wait):
+        raise ProviderUnavailable(provider)
+    try:
+        resp = requests.get(url, **kwargs)
+    except Exception:
+        governor.record(provider, False)
+        raise
+    governor.record(provider, _is_success(resp.status_code))
+    return resp
+
+
+async def governed_get_async(client, provider, url, wait=0.0, **kwargs):
+    """client.get (httpx.AsyncClient) behind the governor"""
+    if not await governor.acquire_async(provider, wait):
+        raise ProviderUnavailable(provider)
+    try:
+        resp = await client.get(url, **kwargs)
+    except asyncio.CancelledError:
+        governor.release(provider)
+        raise
+    except Exception:
+        governor.record(provider, False)
+        raise
+    governor.record(provider, _is_success(resp.status_code))
+    return resp
+
+
+# Singleton governor instance
+quota_store = SharedDailyQuota()
+governor = OutboundGovernor([
+    ProviderGate("waqi", WAQI_RATE_PER_SEC, WAQI_DAILY_QUOTA, quota_store=quota_store),
+    ProviderGate("openweathermap", OWM_RATE_PER_SEC, OWM_DAILY_QUOTA, quota_store=quota_store),
+    ProviderGate("openaq", OPENAQ_RATE_PER_SEC, OPENAQ_DAILY_QUOTA, quota_store=quota_store),
+])
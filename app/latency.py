@@ -0,0 +1,75 @@
+"""
+Latency tracking for AirWatch ASEAN
+Rolling per-station and per-host response times for the crawler
+(hedging thresholds and "which stations are slow" monitoring)
+"""
+import threading
+from collections import deque
+
+WINDOW = 50  # samples kept per key
+MIN_SAMPLES = 5  # below this a percentile is not trusted
+
+
+def _percentile(sorted_samples, q):
+    idx = min(int(round(q * (len(sorted_samples) - 1))), len(sorted_samples) - 1)
+    return sorted_samples[idx]
+
+
+class LatencyTracker:
+    """Rolling window of latencies (seconds) per key, thread-safe"""
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.samples = {}
+        self.timeouts = {}
+        self.hedges_sent = 0
+        self.hedges_won = 0
+        self.deferred = 0
+        self._lock = threading.Lock()
+
+    def observe(self, key, seconds, timed_out=False):
+        with self._lock:
+            self.samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+            if timed_out:
+                self.timeouts[key] = self.timeouts.get(key, 0) + 1
+
+    def percentile(self, key, q):
+        """q-quantile of the window for key, None if there are too few samples"""
+        with self._lock:
+            window = self.samples.get(key)
+            if not window or len(window) < MIN_SAMPLES:
+                return None
+            return _percentile(sorted(window), q)
+
+    def summary(self, key):
+        with self._lock:
+            window = sorted(self.samples.get(key) or ())
+            timeouts = self.timeouts.get(key, 0)
+        if not window:
+            return None
+        return {
+            "samples": len(window),
+            "p50": round(_percentile(window, 0.50), 3),
+            "p95": round(_percentile(window, 0.95), 3),
+            "p99": round(_percentile(window, 0.99), 3),
+            "timeouts": timeouts,
+        }
+
+    def stats(self, hosts, top=10):
+        """Per-host summary plus the `top` slowest stations by p95"""
+        with self._lock:
+            station_keys = [k for k in self.samples if k not in hosts]
+        stations = [(key, self.summary(key)) for key in station_keys]
+        stations = [(key, s) for key, s in stations if s and s["samples"] >= MIN_SAMPLES]
+        stations.sort(key=lambda item: item[1]["p95"], reverse=True)
+        return {
+            "hosts": {host: self.summary(host) for host in hosts if self.summary(host)},
+            "slowest_stations": [{"uid": key, **s} for key, s in stations[:top]],
+            "hedges_sent": self.hedges_sent,
+            "hedges_won": self.hedges_won,
+            "deferred": self.deferred,
+        }
+
+
+# Singleton tracker for the crawler
+crawler_latency = LatencyTracker()
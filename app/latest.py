@@ -0,0 +1,60 @@
+"""
+Latest-reading snapshot for AirWatch ASEAN
+In-process copy of station_latest (one row per station). It is reloaded
+only when the database has changed since the last load, so the hot
+endpoints cost O(stations) instead of scanning measurements.
+"""
+import os
+import sqlite3
+import threading
+
+from app.config import DB_NAME
+from app.db import READ_PRAGMAS, local_iso
+
+
+class LatestReadings:
+    """Thread-safe snapshot of station_latest, keyed by station uid"""
+
+    def __init__(self):
+        self._conn = None
+        self._version = None
+        self._rows = {}
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(
+                f"file:{os.path.abspath(DB_NAME)}?mode=ro", uri=True,
+                timeout=30, check_same_thread=False
+            )
+            for pragma in READ_PRAGMAS:
+                self._conn.execute(pragma)
+        return self._conn
+
+    def rows(self):
+        """uid -> {station_name, aqi, pm25, timestamp, source}; do not mutate"""
+        with self._lock:
+            conn = self._connection()
+            # data_version changes whenever another connection (any process) commits
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._version:
+                cursor = conn.execute("""
+                    SELECT station_uid, station_name, aqi, pm25, timestamp, utc_offset, source
+                    FROM station_latest
+                """)
+                self._rows = {
+                    row[0]: {"station_name": row[1], "aqi": row[2], "pm25": row[3],
+                             "timestamp": local_iso(row[4], row[5]), "source": row[6]}
+                    for row in cursor.fetchall()
+                }
+                self._version = version
+                self.reloads += 1
+            return self._rows
+
+    def get(self, uid):
+        return self.rows().get(uid)
+
+
+# Singleton snapshot shared by the request handlers
+latest_readings = LatestReadings()
@@ -0,0 +1,302 @@
+"""
+Schema migrations for AirWatch ASEAN
+Numbered migrations applied in order by the crawler at startup (web
+workers only check the version, see app.storage.require_schema); the
+applied versions are recorded in schema_version. Add new schema changes as
+a new entry at the end of MIGRATIONS, never by editing an applied one.
+
+    python -m app.migrations    # migrate now, e.g. before starting web workers
+"""
+import sqlite3
+
+from app.config import STATIONS_CONFIG, setup_logging
+from app.db import READING_COLUMNS, guess_utc_offset
+
+
+def _baseline(cursor):
+    """Schema as it was before versioning; idempotent so it also adopts old databases"""
+    
+    cursor.execute('''CREATE TABLE IF NOT EXISTS measurements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, 
+        station_uid INTEGER, 
+        station_name TEXT,
+        aqi INTEGER, 
+        pm25 REAL,
+        pm10 REAL, o3 REAL, no2 REAL, so2 REAL, co REAL,
+        temperature REAL, humidity REAL, pressure REAL, wind REAL, dew REAL,
+        timestamp DATETIME,
+        source TEXT DEFAULT 'waqi',
+        UNIQUE(station_uid, timestamp)
+    )''')
+    
+    # Add station_name column if it doesn't exist (migration for existing DB)
+    try:
+        cursor.execute("ALTER TABLE measurements ADD COLUMN station_name TEXT")
+        print("🗄️ [DB] Added station_name column to existing table")
+    except sqlite3.OperationalError:
+        pass  # Column already exists
+    
+    # Pollutant/weather channels from iaqi (migration for existing DB)
+    for column in READING_COLUMNS:
+        try:
+            cursor.execute(f"ALTER TABLE measurements ADD COLUMN {column} REAL")
+            print(f"🗄️ [DB] Added {column} column to existing table")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+    
+    # Source tag for multi-provider ingest (migration for existing DB)
+    try:
+        cursor.execute("ALTER TABLE measurements ADD COLUMN source TEXT DEFAULT 'waqi'")
+        print("🗄️ [DB] Added source column to existing table")
+    except sqlite3.OperationalError:
+        pass  # Column already exists
+    
+    # Coordinates of non-WAQI points (OpenAQ locations, OWM grid cells)
+    cursor.execute('''CREATE TABLE IF NOT EXISTS external_stations (
+        uid INTEGER PRIMARY KEY,
+        source TEXT,
+        name TEXT,
+        lat REAL,
+        lng REAL
+    )''')
+    
+    # Newest reading per station, maintained by the writer in the ingest transaction
+    cursor.execute('''CREATE TABLE IF NOT EXISTS station_latest (
+        station_uid INTEGER PRIMARY KEY,
+        station_name TEXT,
+        aqi INTEGER,
+        pm25 REAL,
+        timestamp DATETIME,
+        source TEXT
+    )''')
+    cursor.execute("SELECT COUNT(*) FROM station_latest")
+    if cursor.fetchone()[0] == 0:
+        # One-time backfill for databases from before the table existed
+        cursor.execute("""
+            INSERT OR IGNORE INTO station_latest (station_uid, station_name, aqi, pm25, timestamp, source)
+            SELECT m.station_uid, m.station_name, m.aqi, m.pm25, m.timestamp, m.source
+            FROM measurements m
+            INNER JOIN (
+                SELECT station_uid, MAX(timestamp) as max_ts
+                FROM measurements GROUP BY station_uid
+            ) latest ON m.station_uid = latest.station_uid AND m.timestamp = latest.max_ts
+        """)
+    
+    cursor.execute('''CREATE TABLE IF NOT EXISTS alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        station_uid INTEGER,
+        alert_type TEXT,
+        message TEXT,
+        aqi_value INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    
+
+
+def _covering_indexes(cursor):
+    """Indexes for the hot read paths (see benchmark_queries.py for the plans)"""
+    # Per-station recent history: predict_multi, api_history, spike detection,
+    # scheduler cadence learning. Covers (aqi, pm25) so no table lookups.
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_measurements_station_ts
+        ON measurements (station_uid, timestamp, aqi, pm25)
+    """)
+    # Time-window scans over all stations: api_trends
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_measurements_ts_aqi
+        ON measurements (timestamp, aqi)
+    """)
+    # Recent alerts list and 24h alert count
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_alerts_created_at
+        ON alerts (created_at)
+    """)
+
+
+def _rollup_tables(cursor):
+    """Hourly and daily aggregates that raw measurements are compacted into"""
+    for table in ("measurements_hourly", "measurements_daily"):
+        cursor.execute(f"""CREATE TABLE IF NOT EXISTS {table} (
+            station_uid INTEGER,
+            bucket TEXT,
+            aqi_min INTEGER, aqi_max INTEGER, aqi_mean REAL, aqi_count INTEGER,
+            pm25_min REAL, pm25_max REAL, pm25_mean REAL, pm25_count INTEGER,
+            PRIMARY KEY (station_uid, bucket)
+        ) WITHOUT ROWID""")
+
+
+def _epoch_timestamps(cursor):
+    """
+    ISO text timestamps -> integer UTC epoch seconds + station UTC offset
+    (measurements, station_latest) and UTC epoch created_at (alerts).
+    Old rows hold station-local wall time without an offset, so the offset
+    is guessed from the station's country / longitude. Readers keep working
+    during the rebuild (WAL); writers wait on busy_timeout.
+    """
+    offsets = {st['uid']: guess_utc_offset(st['lng'], st.get('country')) for st in STATIONS_CONFIG}
+    cursor.execute("SELECT uid, lng FROM external_stations")
+    for uid, lng in cursor.fetchall():
+        offsets.setdefault(uid, guess_utc_offset(lng or 0))
+    cursor.execute("CREATE TEMP TABLE station_offsets (uid INTEGER PRIMARY KEY, utc_offset INTEGER)")
+    cursor.executemany("INSERT INTO station_offsets VALUES (?, ?)", offsets.items())
+    default_offset = 7 * 3600  # most ASEAN stations
+
+    columns = ("station_name", "aqi", "pm25", *READING_COLUMNS, "source")
+    cursor.execute(f'''CREATE TABLE measurements_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        station_uid INTEGER,
+        station_name TEXT,
+        aqi INTEGER,
+        pm25 REAL,
+        {", ".join(f"{column} REAL" for column in READING_COLUMNS)},
+        timestamp INTEGER NOT NULL,
+        utc_offset INTEGER NOT NULL DEFAULT 0,
+        source TEXT DEFAULT 'waqi',
+        UNIQUE(station_uid, timestamp)
+    )''')
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO measurements_new (station_uid, {", ".join(columns)}, timestamp, utc_offset)
+        SELECT m.station_uid, {", ".join(f"m.{column}" for column in columns)},
+               CAST(strftime('%s', m.timestamp) AS INTEGER) - COALESCE(o.utc_offset, {default_offset}),
+               COALESCE(o.utc_offset, {default_offset})
+        FROM measurements m LEFT JOIN station_offsets o ON o.uid = m.station_uid
+        WHERE strftime('%s', m.timestamp) IS NOT NULL
+        ORDER BY m.id
+    """)
+    cursor.execute("DROP TABLE measurements")
+    cursor.execute("ALTER TABLE measurements_new RENAME TO measurements")
+    cursor.execute("DROP TABLE station_offsets")
+
+    cursor.execute("DROP TABLE station_latest")
+    cursor.execute('''CREATE TABLE station_latest (
+        station_uid INTEGER PRIMARY KEY,
+        station_name TEXT,
+        aqi INTEGER,
+        pm25 REAL,
+        timestamp INTEGER,
+        utc_offset INTEGER,
+        source TEXT
+    )''')
+    # Bare columns with MAX() come from the newest row of each station
+    cursor.execute("""
+        INSERT INTO station_latest (station_uid, station_name, aqi, pm25, timestamp, utc_offset, source)
+        SELECT station_uid, station_name, aqi, pm25, MAX(timestamp), utc_offset, source
+        FROM measurements GROUP BY station_uid
+    """)
+
+    cursor.execute('''CREATE TABLE alerts_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        station_uid INTEGER,
+        alert_type TEXT,
+        message TEXT,
+        aqi_value INTEGER,
+        created_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+    )''')
+    cursor.execute("""
+        INSERT INTO alerts_new (id, station_uid, alert_type, message, aqi_value, created_at)
+        SELECT id, station_uid, alert_type, message, aqi_value, CAST(strftime('%s', created_at) AS INTEGER)
+        FROM alerts
+    """)
+    cursor.execute("DROP TABLE alerts")
+    cursor.execute("ALTER TABLE alerts_new RENAME TO alerts")
+
+    # Migration 2's indexes on the rebuilt tables, now also covering utc_offset
+    cursor.execute("""
+        CREATE INDEX idx_measurements_station_ts
+        ON measurements (station_uid, timestamp, utc_offset, aqi, pm25)
+    """)
+    cursor.execute("""
+        CREATE INDEX idx_measurements_ts_aqi
+        ON measurements (timestamp, utc_offset, aqi)
+    """)
+    cursor.execute("CREATE INDEX idx_alerts_created_at ON alerts (created_at)")
+
+
+def _forecast_table(cursor):
+    """Precomputed forecasts, refreshed by the crawler after new data (app.forecasts)"""
+    cursor.execute('''CREATE TABLE IF NOT EXISTS forecasts (
+        station_uid INTEGER PRIMARY KEY,
+        predictions TEXT,
+        trend TEXT,
+        confidence INTEGER,
+        generated_at INTEGER,
+        data_through TEXT
+    )''')
+
+
+# Secondary indexes as the migrations leave them. Checked at every start: a
+# bulk load with deferred indexes (app.backfill --defer-indexes) that was killed
+# before rebuilding them would otherwise leave every read path on full scans.
+INDEXES = {
+    "idx_measurements_station_ts": "measurements (station_uid, timestamp, utc_offset, aqi, pm25)",
+    "idx_measurements_ts_aqi": "measurements (timestamp, utc_offset, aqi)",
+    "idx_alerts_created_at": "alerts (created_at)",
+}
+
+
+def ensure_indexes(conn):
+    """Re-create missing secondary indexes (needs all migrations applied); returns their names"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    existing = {row[0] for row in cursor.fetchall()}
+    missing = [name for name in INDEXES if name not in existing]
+    for name in missing:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {INDEXES[name]}")
+    conn.commit()
+    return missing
+
+
+# (version, name, apply(cursor)) - append only
+MIGRATIONS = [
+    (1, "baseline", _baseline),
+    (2, "covering_indexes", _covering_indexes),
+    (3, "rollup_tables", _rollup_tables),
+    (4, "epoch_timestamps", _epoch_timestamps),
+    (5, "forecast_table", _forecast_table),
+]
+
+
+def current_version(cursor):
+    cursor.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT,
+        applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )""")
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    return cursor.fetchone()[0] or 0
+
+
+def run_migrations(conn, target=None):
+    """
+    Apply pending migrations up to `target` (default: all), each in its own
+    transaction. Safe when several processes start at once: the version is
+    re-checked under the write lock. Returns [(version, name)] applied.
+    """
+    cursor = conn.cursor()
+    version = current_version(cursor)
+    conn.commit()
+
+    applied = []
+    for number, name, migrate in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("SELECT 1 FROM schema_version WHERE version=?", (number,))
+            if cursor.fetchone():
+                conn.rollback()  # another process got here first
+                continue
+            migrate(cursor)
+            cursor.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (number, name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append((number, name))
+    return applied
+
+
+if __name__ == "__main__":
+    from app.storage import store  # app.storage imports this module
+    setup_logging()
+    store.init()
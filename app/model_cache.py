@@ -0,0 +1,80 @@
+"""
+Model cache for AirWatch ASEAN
+Bounded LRU of loaded forecast models for one process. Limits are by count
+(MODEL_CACHE_MAX_MODELS) and by size (MODEL_CACHE_MAX_MB); the size of a
+model is that of its file, which for joblib's uncompressed format is about
+the size of its arrays. The stacked station models (see
+app.predictor.STACKED_KEY) are one more entry, sized by their arrays. The
+least recently used models are evicted first; the registry (app.registry)
+reloads them on demand.
+"""
+import threading
+from collections import OrderedDict
+
+from app.config import MODEL_CACHE_MAX_MODELS, MODEL_CACHE_MAX_MB
+
+
+class ModelCache:
+    """key -> (version, model), thread-safe, least recently used evicted first"""
+
+    def __init__(self, max_models=MODEL_CACHE_MAX_MODELS, max_bytes=int(MODEL_CACHE_MAX_MB * 1024 * 1024)):
+        self.max_models = max_models  # 0 = no limit
+        self.max_bytes = max_bytes  # 0 = no limit
+        self._items = OrderedDict()  # key -> (version, model, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        """The cached model if it is `version`, else None (a miss)"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] != version:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, version, model, nbytes):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._items[key] = (version, model, nbytes)
+            self._bytes += nbytes
+            # Never evict the model just added, even if it alone exceeds the limit
+            while len(self._items) > 1 and (
+                (self.max_models and len(self._items) > self.max_models)
+                or (self.max_bytes and self._bytes > self.max_bytes)
+            ):
+                _, (_, _, size) = self._items.popitem(last=False)
+                self._bytes -= size
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is not None:
+                self._bytes -= item[2]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        return {
+            "models": len(self._items),
+            "bytes": self._bytes,
+            "max_models": self.max_models,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -1,104 +1,197 @@
 """
 AQI Predictor module for AirWatch ASEAN
 Machine Learning predictions for AQI with Model Caching
+
+Two modes (PREDICTOR_MODE):
+- "global": one model trained on every station's history, with station
+  features (lat, lng, country, station mean). Stations with little history
+  borrow from the others instead of using the heuristic fallback.
+- "station": one model per station (>= 15 readings), heuristic below that.
+Models are trained in the background by app.training and versioned in
+app.registry; until a model exists, requests get the heuristic forecast.
+Station models are stored and served as flattened tree arrays
+(app.tree_engine); the global model stays a sklearn estimator, whose
+compiled predict is faster for one large model.
 """
 import os
-import sqlite3
+import time
+import zlib
 import logging
-import pandas as pd
-from datetime import datetime, timedelta
-from pathlib import Path
-
-try:
-    import joblib
-    JOBLIB_AVAILABLE = True
-except ImportError:
-    JOBLIB_AVAILABLE = False
-    logging.warning("joblib not available, model caching disabled")
+import joblib
+import numpy as np
 
 from sklearn.ensemble import GradientBoostingRegressor
-from app.config import DB_NAME
-
-# Model cache directory
-MODELS_DIR = Path("models")
-MODELS_DIR.mkdir(exist_ok=True)
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from app.config import STATIONS_CONFIG, PREDICTOR_MODE
+from app.storage import store
+from app.registry import model_registry
+from app.model_cache import ModelCache
+from app.tree_engine import TreeEnsemble, export_gbr
 
-# Model cache expiration (24 hours)
+# Model cache expiration (24 hours), staggered per model (see _lifetime_factor)
 MODEL_CACHE_HOURS = 24
 
+# Readings per station used for features and training
+HISTORY_ROWS = 168
+
+# Model cache key of the pooled model, and the least rows it is trained on
+GLOBAL_UID = "global"
+GLOBAL_MIN_ROWS = 200
+
+# Model cache key of the station models stacked into one TreeEnsemble; its
+# version is ((uid, registry version), ...), so a rollback or promotion misses
+STACKED_KEY = "stacked"
+
+# Feature schema recorded with each model version; a model built for other features is not used
+FEATURES = ("hour", "day_of_week", "is_weekend", "lag_1", "lag_3")
+GLOBAL_FEATURES = FEATURES + ("lat", "lng", "country", "station_mean")
+
+STATION_MODEL_PARAMS = {"n_estimators": 50, "max_depth": 3, "random_state": 42}
+GLOBAL_MODEL_PARAMS = {"n_estimators": 150, "max_depth": 4, "random_state": 42}
+
+# Country feature: index in this list (fixed, so a saved model keeps its meaning)
+COUNTRIES = ("Brunei", "Cambodia", "Indonesia", "Laos", "Malaysia", "Myanmar",
+             "Philippines", "Singapore", "Thailand", "Timor-Leste", "Vietnam")
+STATION_INFO = {st['uid']: st for st in STATIONS_CONFIG}
+
+
+def _shift(values, group, k):
+    """values[i + k] when row i + k belongs to the same station, else NaN"""
+    out = np.full(len(values), np.nan)
+    if k < len(values):
+        same = group[k:] == group[:-k]
+        out[:-k][same] = values[k:][same]
+    return out
+
+
+def _clip_aqi(values):
+    """int() then clamp to 0..500, element-wise"""
+    return np.clip(np.trunc(values), 0, 500).astype(int)
+
+
+def _history(rows):
+    """
+    rows: [(uid, epoch, utc_offset, aqi)] grouped by station, newest first.
+    Returns (station uids, utc offsets, group of each row with an AQI, AQI,
+    features [hour, day_of_week, is_weekend, lag_1, lag_3]); rows stay
+    grouped and newest first.
+    """
+    uid = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    local = np.fromiter((row[1] + (row[2] or 0) for row in rows), dtype=np.int64, count=len(rows))
+    aqi = np.fromiter((np.nan if row[3] is None else row[3] for row in rows), dtype=float, count=len(rows))
+    starts = np.r_[0, np.flatnonzero(np.diff(uid)) + 1]
+    group = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(rows)]))
+    offsets = np.array([rows[i][2] or 0 for i in starts])
+    
+    # Lag features: next older reading of the same station, own AQI when missing
+    lag_1 = np.where(np.isnan(_shift(aqi, group, 1)), aqi, _shift(aqi, group, 1))
+    lag_3 = np.where(np.isnan(_shift(aqi, group, 3)), aqi, _shift(aqi, group, 3))
+    
+    # Training rows = readings with an AQI
+    valid = ~np.isnan(aqi)
+    local = local[valid]
+    hour = (local % 86400) // 3600
+    day_of_week = (local // 86400 + 3) % 7  # 1970-01-01 was a Thursday
+    is_weekend = (day_of_week >= 5).astype(int)
+    X = np.column_stack([hour, day_of_week, is_weekend, lag_1[valid], lag_3[valid]])
+    return uid[starts], offsets, group[valid], aqi[valid], X
+
+
+def _lifetime_factor(uid):
+    """0.75..1.0, fixed per model, so models trained together do not expire together"""
+    return 0.75 + 0.25 * (zlib.crc32(str(uid).encode()) % 1000) / 1000
+
+
+def fit_model(uid, X, y):
+    """
+    Train one model; runs in a trainer worker process. Returns (model,
+    training metrics); station models are exported to a TreeEnsemble.
+    """
+    model = GradientBoostingRegressor(**(GLOBAL_MODEL_PARAMS if uid == GLOBAL_UID else STATION_MODEL_PARAMS))
+    model.fit(X, y)
+    fitted = model.predict(X)
+    return (model if uid == GLOBAL_UID else export_gbr(model)), {
+        "train_r2": float(r2_score(y, fitted)),
+        "train_mae": float(mean_absolute_error(y, fitted)),
+        "train_rmse": float(np.sqrt(mean_squared_error(y, fitted))),
+    }
+
+
+def _station_features(uids, means):
+    """[lat, lng, country index, mean AQI] per station (global model)"""
+    info = [STATION_INFO.get(int(uid), {}) for uid in uids]
+    return np.column_stack([
+        [st.get('lat') or 0.0 for st in info],
+        [st.get('lng') or 0.0 for st in info],
+        [COUNTRIES.index(st['country']) if st.get('country') in COUNTRIES else -1 for st in info],
+        means,
+    ])
+
 
 class AQIPredictor:
+    """
+    Request-side predictor: serves the current registry version of each
+    station's model (or of the global model) and never trains; models are
+    fitted by app.training and registered with publish_model.
+    """
     def __init__(self):
-        self.models = {}  # In-memory cache: {uid: (model, timestamp)}
-        self.model_metadata = {}  # Track when models were trained
-    
-    def _get_model_path(self, uid):
-        """Get file path for cached model"""
-        return MODELS_DIR / f"station_{uid}_model.joblib"
+        self.models = ModelCache()  # uid -> (registry version, model), bounded LRU
+        self._legacy_scores = {}  # (uid, version) -> score of imported models without metrics
+        self._unloadable = set()  # (uid, version) that failed to load, e.g. pickled by another sklearn
     
-    def _get_metadata_path(self, uid):
-        """Get file path for model metadata"""
-        return MODELS_DIR / f"station_{uid}_meta.joblib"
+    def _entry(self, uid):
+        """Current registry entry of a model, None if missing or built for other features"""
+        entry = model_registry.current().get(str(uid))
+        if entry is None or entry['features'] != list(GLOBAL_FEATURES if uid == GLOBAL_UID else FEATURES):
+            return None
+        return entry
     
-    def _is_model_valid(self, uid):
-        """Check if cached model is still valid (< 24 hours old)"""
-        if uid in self.model_metadata:
-            trained_at = self.model_metadata[uid].get('trained_at')
-            if trained_at:
-                age_hours = (datetime.now() - trained_at).total_seconds() / 3600
-                return age_hours < MODEL_CACHE_HOURS
-        return False
+    def is_due(self, uid):
+        """No usable model, or the newest version is older than its staggered lifetime"""
+        entry = self._entry(uid)
+        if entry is None or (uid, entry['version']) in self._unloadable:
+            return True
+        age_hours = (time.time() - entry['newest_trained_at']) / 3600
+        return age_hours >= MODEL_CACHE_HOURS * _lifetime_factor(uid)
     
-    def _load_cached_model(self, uid):
-        """Load model from disk cache"""
-        if not JOBLIB_AVAILABLE:
+    def _cached_model(self, uid):
+        """
+        (model, registry entry) of the current version, None if there is none
+        yet. Loaded with mmap_mode='r': the node arrays stay mapped, so all
+        processes read them from one copy in the page cache. Station
+        versions saved as sklearn estimators are exported to a TreeEnsemble
+        on load.
+        """
+        entry = self._entry(uid)
+        if entry is None:
             return None
-            
-        model_path = self._get_model_path(uid)
-        meta_path = self._get_metadata_path(uid)
-        
-        if model_path.exists() and meta_path.exists():
+        model = self.models.get(uid, entry['version'])
+        if model is None:
+            if (uid, entry['version']) in self._unloadable:
+                return None
             try:
-                model = joblib.load(model_path)
-                metadata = joblib.load(meta_path)
-                
-                # Check if model is still valid
-                trained_at = metadata.get('trained_at')
-                if trained_at:
-                    age_hours = (datetime.now() - trained_at).total_seconds() / 3600
-                    if age_hours < MODEL_CACHE_HOURS:
-                        self.models[uid] = model
-                        self.model_metadata[uid] = metadata
-                        logging.debug(f"Loaded cached model for station {uid}")
-                        return model
+                model = joblib.load(entry['path'], mmap_mode='r')
+                if uid != GLOBAL_UID and not isinstance(model, TreeEnsemble):
+                    model = export_gbr(model)
+                self.models.put(uid, entry['version'], model, os.path.getsize(entry['path']))
+                logging.debug(f"Loaded model v{entry['version']} for station {uid}")
             except Exception as e:
                 logging.warning(f"Failed to load cached model for {uid}: {e}")
-        
-        return None
+                self._unloadable.add((uid, entry['version']))
+                return None
+        return model, entry
     
-    def _save_model(self, uid, model):
-        """Save model to disk cache"""
-        if not JOBLIB_AVAILABLE:
-            return
-            
-        try:
-            model_path = self._get_model_path(uid)
-            meta_path = self._get_metadata_path(uid)
-            
-            metadata = {
-                'trained_at': datetime.now(),
-                'uid': uid
-            }
-            
-            joblib.dump(model, model_path)
-            joblib.dump(metadata, meta_path)
-            
-            self.models[uid] = model
-            self.model_metadata[uid] = metadata
-            logging.debug(f"Saved model for station {uid}")
-        except Exception as e:
-            logging.warning(f"Failed to save model for {uid}: {e}")
+    def publish_model(self, uid, model, metrics, rows=None, data_through=None):
+        """Register a newly trained model; returns True if it was promoted (not pinned)"""
+        features = GLOBAL_FEATURES if uid == GLOBAL_UID else FEATURES
+        version, promoted = model_registry.register(uid, model, metrics, features, rows, data_through)
+        if promoted:
+            self.models.put(uid, version, model, os.path.getsize(model_registry.file_path(uid, version)))
+            self.models.pop(STACKED_KEY)
+        logging.debug(f"Saved model v{version} for station {uid}")
+        return promoted
     
+
     def get_trend(self, data):
         """Phân tích xu hướng: rising, falling, stable"""
         if len(data) < 3:
@@ -120,167 +213,247 @@ class AQIPredictor:
             return "falling"
         return "stable"
     
-    def predict_multi(self, uid, hours=[1, 6, 12, 24]):
+    def _station_model(self, uid, X, y):
+        """Current model of the station, its confidence score and registry version, None if not trained yet"""
+        cached = self._cached_model(uid)
+        if cached is None:
+            return None
+        model, entry = cached
+        score = entry['metrics'].get('train_r2')
+        if score is None:
+            # Imported model saved before metrics were stored: score once per version
+            key = (uid, entry['version'])
+            if key not in self._legacy_scores:
+                self._legacy_scores[key] = r2_score(y, model.predict(X))
+            score = self._legacy_scores[key]
+        return model, min(int(score * 100), 95), entry['version']
+    
+    def _global_model(self):
+        """The pooled model and its confidence score, None if not trained yet"""
+        cached = self._cached_model(GLOBAL_UID)
+        if cached is None:
+            return None
+        model, entry = cached
+        return model, min(int((entry['metrics'].get('train_r2') or 0) * 100), 95)
+    
+    def training_sets(self, mode=None):
         """
-        Dự báo đa bước: 1h, 6h, 12h, 24h với model caching
-        Sử dụng rolling prediction + historical hourly patterns
+        {model key: (X, y, data_through)} for the models of `mode` (default
+        PREDICTOR_MODE) that are due; data_through = epoch of the newest
+        reading used. Used by the trainer (app.training), never per request.
+        """
+        global_mode = (mode or PREDICTOR_MODE) == "global"
+        if global_mode and not self.is_due(GLOBAL_UID):
+            return {}
+        rows = store.recent_aqi_all(HISTORY_ROWS, list(STATION_INFO))
+        if not rows:
+            return {}
+        station_uids, _, g, y, X = _history(rows)
+        count = np.bincount(g, minlength=len(station_uids))
+        newest = {}
+        for row in rows:
+            newest.setdefault(row[0], row[1])  # rows are newest first
+        if global_mode:
+            if len(y) < GLOBAL_MIN_ROWS:
+                logging.info(f"Global model: {len(y)} rows, need {GLOBAL_MIN_ROWS}")
+                return {}
+            means = np.bincount(g, y, minlength=len(station_uids)) / np.maximum(count, 1)
+            X = np.column_stack([X, _station_features(station_uids, means)[g]])
+            return {GLOBAL_UID: (X, y, max(newest.values()))}
+        
+        first = np.cumsum(count) - count
+        sets = {}
+        for i in np.flatnonzero(count >= 15):
+            uid = int(station_uids[i])
+            if self.is_due(uid):
+                rows_i = slice(first[i], first[i] + count[i])
+                sets[uid] = (X[rows_i], y[rows_i], newest[uid])
+        return sets
+    
+    def predict_all(self, hours=[1, 6, 12, 24], uids=None, mode=None):
+        """
+        Dự báo đa bước cho nhiều trạm cùng lúc (mặc định: mọi trạm trong stations.json).
+        One query loads the last HISTORY_ROWS readings of every station, the
+        features of all stations are built as one array and each rolling
+        step runs for all stations together.
+        `mode` overrides PREDICTOR_MODE ("global" / "station"), e.g. to compare.
+        Returns {uid: (predictions, trend, confidence)}, same as predict_multi.
         """
+        uids = [st['uid'] for st in STATIONS_CONFIG] if uids is None else list(uids)
+        results = {uid: ({h: "Đang học..." for h in hours}, "stable", 0) for uid in uids}
         try:
-            conn = sqlite3.connect(DB_NAME)
-            df = pd.read_sql_query(
-                f"SELECT timestamp, aqi FROM measurements WHERE station_uid={uid} ORDER BY timestamp DESC LIMIT 168", 
-                conn
-            )
-            conn.close()
-            
-            # Cần ít nhất 1 bản ghi để dự báo
-            if len(df) < 1 or df['aqi'].isna().all():
-                return {h: "Đang học..." for h in hours}, "stable", 0
-            
-            aqi_values = df['aqi'].dropna().tolist()
-            current_aqi = aqi_values[0] if aqi_values else 0
-            
-            # Phân tích xu hướng
-            trend = self.get_trend(aqi_values)
-            
-            # === FALLBACK: Dự báo đơn giản khi ít dữ liệu (< 15 records) ===
-            if len(aqi_values) < 15:
-                predictions = {}
-                avg_aqi = sum(aqi_values) / len(aqi_values)
-                
-                # Sử dụng weighted average: 70% current + 30% average
-                base_pred = current_aqi * 0.7 + avg_aqi * 0.3
-                
-                # Điều chỉnh theo trend với variance tăng dần theo thời gian
-                trend_factor = 1.05 if trend == "rising" else (0.95 if trend == "falling" else 1.0)
-                
-                for h in hours:
-                    # Thêm variance dựa trên historical volatility
-                    volatility = abs(max(aqi_values) - min(aqi_values)) / max(avg_aqi, 1) if len(aqi_values) > 1 else 0.1
-                    time_decay = 1 + (volatility * h / 24)  # Uncertainty tăng theo thời gian
-                    pred = base_pred * (trend_factor ** (h / 4)) * time_decay
-                    predictions[h] = max(0, min(500, int(pred)))
-                
-                # Confidence thấp vì chưa đủ dữ liệu
-                confidence = min(len(aqi_values) * 5, 40)
-                return predictions, trend, confidence
-            
-            # === FULL ML MODEL: Khi có đủ dữ liệu (>= 15 records) ===
-            df['ts'] = pd.to_datetime(df['timestamp'])
-            df['hour'] = df['ts'].dt.hour
-            df['day_of_week'] = df['ts'].dt.dayofweek
-            df['is_weekend'] = (df['day_of_week'] >= 5).astype(int)
-            
-            # Thêm lag features với fillna
-            df['lag_1'] = df['aqi'].shift(-1).fillna(df['aqi'])
-            df['lag_3'] = df['aqi'].shift(-3).fillna(df['aqi'])
-            df = df.dropna()
-            
-            if len(df) < 5:
-                # Fallback nếu sau xử lý còn ít dữ liệu
-                predictions = {h: max(0, min(500, int(current_aqi))) for h in hours}
-                return predictions, trend, 30
-            
-            X = df[['hour', 'day_of_week', 'is_weekend', 'lag_1', 'lag_3']].values
-            y = df['aqi'].values
-            
-            # Tính hourly patterns từ dữ liệu lịch sử
-            hourly_avg = df.groupby('hour')['aqi'].mean().to_dict()
-            overall_avg = df['aqi'].mean()
-            
-            # Try to use cached model first
-            model = None
-            if self._is_model_valid(uid):
-                model = self.models.get(uid)
+            rows = store.recent_aqi_all(HISTORY_ROWS, uids)
+            if rows:
+                self._predict_rows(rows, hours, results, mode or PREDICTOR_MODE)
+        except Exception as e:
+            logging.error(f"Prediction error: {e}")
+            return {uid: ({h: "N/A" for h in hours}, "stable", 0) for uid in uids}
+        return results
+    
+    def _predict_rows(self, rows, hours, results, mode):
+        """rows: [(uid, epoch, utc_offset, aqi)] grouped by station, newest first"""
+        station_uids, offsets, g, y, X_all = _history(rows)
+        hour = X_all[:, 0].astype(int)
+        n_groups = len(station_uids)
+        
+        count = np.bincount(g, minlength=n_groups)
+        first = np.cumsum(count) - count
+        rank = np.arange(len(g)) - first[g]
+        has_data = count > 0
+        safe = np.maximum(count, 1)
+        current = np.where(has_data, y[np.minimum(first, len(y) - 1)] if len(y) else 0, 0)
+        mean = np.bincount(g, y, minlength=n_groups) / safe
+        
+        # Xu hướng: 3 giá trị mới nhất so với 3 giá trị trước đó (get_trend)
+        recent_avg = np.bincount(g, y * (rank < 3), minlength=n_groups) / 3
+        older_n = np.bincount(g, (rank >= 3) & (rank < 6), minlength=n_groups)
+        older_avg = np.bincount(g, y * ((rank >= 3) & (rank < 6)), minlength=n_groups) / np.maximum(older_n, 1)
+        diff_pct = np.where(older_avg > 0, (recent_avg - older_avg) / np.where(older_avg > 0, older_avg, 1) * 100, 0)
+        trend = np.where((count >= 3) & (older_n > 0) & (diff_pct > 10), "rising",
+                         np.where((count >= 3) & (older_n > 0) & (diff_pct < -10), "falling", "stable"))
+        rising, falling = trend == "rising", trend == "falling"
+        
+        global_model = self._global_model() if mode == "global" else None
+        if global_model is not None:
+            # === GLOBAL MODEL: mọi trạm có dữ liệu, một lần predict mỗi bước ===
+            model, score = global_model
+            members = np.flatnonzero(has_data)
+            confidence = score * np.minimum(count[members], 15) // 15  # less history, less confidence
+            station_X = _station_features(station_uids[members], mean[members])
             
-            if model is None:
-                model = self._load_cached_model(uid)
+            def predict_step(X_step):
+                return model.predict(np.column_stack([X_step, station_X]))
+        else:
+            # === FULL ML MODEL: Khi có đủ dữ liệu (>= 15 records) và đã có model ===
+            few = has_data & (count < 15)
+            candidates, versions = [], []
+            for i in np.flatnonzero(count >= 15):
+                uid = int(station_uids[i])
+                entry = self._entry(uid)
+                if entry is None or (uid, entry['version']) in self._unloadable:
+                    few[i] = True  # not trained yet
+                    continue
+                candidates.append(i)
+                versions.append((uid, entry['version']))
             
-            # Train new model if no valid cache
-            if model is None:
-                model = GradientBoostingRegressor(n_estimators=50, max_depth=3, random_state=42)
-                model.fit(X, y)
-                self._save_model(uid, model)
-                logging.info(f"Trained new model for station {uid}")
+            # Each station has its own model: stack them so a step is one pass for all stations.
+            # The stack is looked up by registry versions alone, so while no model changes a
+            # request loads no model; it is a copy of the node arrays and counts in the cache budget.
+            stacked = self.models.get(STACKED_KEY, tuple(versions)) if len(versions) > 1 else None
+            if stacked is not None:
+                engine, confidence = stacked
+                members = np.array(candidates, dtype=int)
+            else:
+                models, versions, confidence, members = [], [], [], []
+                for i in candidates:
+                    rows_i = slice(first[i], first[i] + count[i])
+                    try:
+                        cached = self._station_model(int(station_uids[i]), X_all[rows_i], y[rows_i])
+                    except Exception as e:
+                        logging.error(f"Prediction error: {e}")
+                        results[int(station_uids[i])] = ({h: "N/A" for h in hours}, "stable", 0)
+                        continue
+                    if cached is None:
+                        few[i] = True  # failed to load
+                        continue
+                    models.append(cached[0])
+                    confidence.append(cached[1])
+                    versions.append((int(station_uids[i]), cached[2]))
+                    members.append(i)
+                members = np.array(members, dtype=int)
+                if len(models) > 1:
+                    engine = TreeEnsemble.stack(models)
+                    self.models.put(STACKED_KEY, tuple(versions), (engine, confidence), engine.nbytes)
+                else:
+                    engine = models[0] if models else None  # nothing to stack
             
-            # Tính confidence score
-            train_score = model.score(X, y)
-            confidence = min(int(train_score * 100), 95)
+            # === FALLBACK: Dự báo đơn giản khi ít dữ liệu (< 15 records) hoặc chưa có model ===
+            if few.any():
+                low = np.full(n_groups, np.inf)
+                high = np.full(n_groups, -np.inf)
+                np.minimum.at(low, g, y)
+                np.maximum.at(high, g, y)
+                base_pred = current * 0.7 + mean * 0.3
+                trend_factor = np.where(rising, 1.05, np.where(falling, 0.95, 1.0))
+                volatility = np.where(count > 1, np.abs(high - low) / np.maximum(mean, 1), 0.1)
+                preds = {h: _clip_aqi(base_pred * trend_factor ** (h / 4) * (1 + volatility * h / 24)) for h in hours}
+                for i in np.flatnonzero(few):
+                    results[int(station_uids[i])] = (
+                        {h: int(preds[h][i]) for h in hours}, str(trend[i]), int(min(count[i] * 5, 40))
+                    )
+
+            def predict_step(X_step):
+                return engine.predict(X_step, np.arange(len(members)))
+        if not len(members):
+            return
+        
+        # Hourly patterns, mean and volatility from the history
+        by_hour = g * 24 + hour
+        hour_sum = np.bincount(by_hour, y, minlength=n_groups * 24).reshape(n_groups, 24)[members]
+        hour_n = np.bincount(by_hour, minlength=n_groups * 24).reshape(n_groups, 24)[members]
+        overall_avg = mean[members]
+        m_count = count[members]
+        std = np.sqrt(np.bincount(g, (y - mean[g]) ** 2, minlength=n_groups)[members] / np.maximum(m_count - 1, 1))
+        volatility = std / np.maximum(overall_avg, 1)
+        m_current = current[members]
+        m_rising, m_falling = rising[members], falling[members]
+        
+        # === ROLLING PREDICTION: Dự báo từng bước, cùng lúc cho mọi trạm ===
+        now_local = int(time.time()) + offsets[members]
+        prev_lag1 = m_current
+        prev_lag3 = y[first[members] + np.minimum(2, m_count - 1)]
+        prev_pred = m_current
+        prev_hour_offset = 0
+        predictions = {}
+        for h in sorted(hours):
+            target = now_local + h * 3600
+            target_hour = (target % 86400) // 3600
+            target_weekday = (target // 86400 + 3) % 7
+            is_weekend = (target_weekday >= 5).astype(int)
             
-            # === ROLLING PREDICTION: Dự báo từng bước, dùng kết quả trước cho bước sau ===
-            predictions = {}
-            sorted_hours = sorted(hours)
+            hour_pattern = np.where(
+                hour_n[np.arange(len(members)), target_hour] > 0,
+                hour_sum[np.arange(len(members)), target_hour] / np.maximum(hour_n[np.arange(len(members)), target_hour], 1),
+                overall_avg
+            )
+            hour_adjustment = (hour_pattern - overall_avg) / np.maximum(overall_avg, 1)
             
-            # Tính volatility từ dữ liệu lịch sử
-            volatility = df['aqi'].std() / max(overall_avg, 1) if len(df) > 1 else 0.1
+            # Rolling: sử dụng dự báo trước đó làm lag
+            hours_since_last = h - prev_hour_offset
+            est_lag1 = prev_pred if hours_since_last <= 1 else prev_pred * 0.8 + m_current * 0.2
+            est_lag3 = prev_lag3 * 0.7 + prev_pred * 0.3 if hours_since_last <= 3 else prev_pred
             
-            # Khởi tạo lag values từ dữ liệu thực
-            prev_lag1 = current_aqi
-            prev_lag3 = aqi_values[2] if len(aqi_values) > 2 else current_aqi
-            prev_pred = current_aqi
-            prev_hour_offset = 0
+            # Trend adjustment tăng dần theo thời gian
+            trend_strength = 1 + (h / 24) * 0.15
+            trend_adj = np.where(m_rising, 1 + 0.02 * h * trend_strength,
+                                 np.where(m_falling, 1 - 0.02 * h * trend_strength, 1.0))
             
-            for h in sorted_hours:
-                next_time = datetime.now() + timedelta(hours=h)
-                target_hour = next_time.hour
-                target_weekday = next_time.weekday()
-                is_weekend = 1 if target_weekday >= 5 else 0
-                
-                # Tính hourly pattern adjustment
-                hour_pattern = hourly_avg.get(target_hour, overall_avg)
-                hour_adjustment = (hour_pattern - overall_avg) / max(overall_avg, 1)
-                
-                # Rolling: sử dụng dự báo trước đó làm lag
-                hours_since_last = h - prev_hour_offset
-                
-                if hours_since_last <= 1:
-                    est_lag1 = prev_pred
-                else:
-                    # Nội suy giữa current và prev_pred
-                    est_lag1 = prev_pred * 0.8 + current_aqi * 0.2
-                
-                if hours_since_last <= 3:
-                    est_lag3 = prev_lag3 * 0.7 + prev_pred * 0.3
-                else:
-                    est_lag3 = prev_pred
-                
-                # Trend adjustment tăng dần theo thời gian
-                trend_strength = 1 + (h / 24) * 0.15  # Max 15% stronger at 24h
-                if trend == "rising":
-                    trend_adj = 1 + (0.02 * h * trend_strength)
-                elif trend == "falling":
-                    trend_adj = 1 - (0.02 * h * trend_strength)
-                else:
-                    trend_adj = 1.0
-                
-                # Predict với model
-                next_input = [[target_hour, target_weekday, is_weekend, est_lag1, est_lag3]]
-                raw_pred = model.predict(next_input)[0]
-                
-                # Apply adjustments
-                adjusted_pred = raw_pred * trend_adj * (1 + hour_adjustment * 0.3)
-                
-                # Thêm uncertainty margin tăng theo thời gian
-                uncertainty = volatility * (h / 6) * 0.1
-                if trend == "rising":
-                    adjusted_pred *= (1 + uncertainty)
-                elif trend == "falling":
-                    adjusted_pred *= (1 - uncertainty * 0.5)
-                
-                final_pred = max(0, min(500, int(adjusted_pred)))
-                predictions[h] = final_pred
-                
-                # Update rolling values cho bước tiếp theo
-                prev_lag3 = prev_lag1
-                prev_lag1 = prev_pred
-                prev_pred = final_pred
-                prev_hour_offset = h
+            X_step = np.column_stack([target_hour, target_weekday, is_weekend, est_lag1, est_lag3])
+            raw_pred = predict_step(X_step)
             
-            return predictions, trend, confidence
+            adjusted = raw_pred * trend_adj * (1 + hour_adjustment * 0.3)
+            uncertainty = volatility * (h / 6) * 0.1
+            adjusted = np.where(m_rising, adjusted * (1 + uncertainty),
+                                np.where(m_falling, adjusted * (1 - uncertainty * 0.5), adjusted))
+            final_pred = _clip_aqi(adjusted)
+            predictions[h] = final_pred
             
-        except Exception as e:
-            logging.error(f"Prediction error: {e}")
-            return {h: "N/A" for h in hours}, "stable", 0
+            prev_lag3 = prev_lag1
+            prev_lag1 = prev_pred
+            prev_pred = final_pred
+            prev_hour_offset = h
+        
+        for k, i in enumerate(members):
+            results[int(station_uids[i])] = (
+                {h: int(predictions[h][k]) for h in sorted(hours)}, str(trend[i]), int(confidence[k])
+            )
+    
+    def predict_multi(self, uid, hours=[1, 6, 12, 24]):
+        """
+        Dự báo đa bước: 1h, 6h, 12h, 24h với model caching
+        Sử dụng rolling prediction + historical hourly patterns
+        """
+        return self.predict_all(hours, [uid])[uid]
     
     def predict(self, uid):
         """Backward compatible: trả về dự báo 1h"""
@@ -291,20 +464,13 @@ class AQIPredictor:
         """Clear model cache for a station or all stations"""
         if uid:
             # Clear specific station
-            self.models.pop(uid, None)
-            self.model_metadata.pop(uid, None)
-            model_path = self._get_model_path(uid)
-            meta_path = self._get_metadata_path(uid)
-            if model_path.exists():
-                model_path.unlink()
-            if meta_path.exists():
-                meta_path.unlink()
+            self.models.pop(uid)
+            self.models.pop(STACKED_KEY)
+            model_registry.remove(uid)
         else:
             # Clear all
             self.models.clear()
-            self.model_metadata.clear()
-            for f in MODELS_DIR.glob("*.joblib"):
-                f.unlink()
+            model_registry.remove()
 
 
 # Singleton predictor instance
@@ -0,0 +1,289 @@
+"""
+Ingest providers for AirWatch ASEAN
+Each provider is one data source polled by the crawler; records are
+normalized to the measurements layout (AQI via pm25_to_aqi where the
+source only reports concentrations) and tagged with their source.
+
+WAQIProvider lives in app.crawler next to the WAQI fetch code.
+"""
+import json
+import math
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from app.config import (
+    STATIONS_CONFIG, ASEAN_BOUNDS, CRAWL_TIMEOUT, CRAWL_CONCURRENCY,
+    OPENWEATHER_API_KEY, OPENAQ_API_KEY, OWM_DAILY_QUOTA,
+    OWM_GRID_STEP_DEG, OWM_GRID_SPARSE_KM, PROVIDER_MERGE_KM, INGEST_STUB_FILE
+)
+from app.governor import governed_get_async, ProviderUnavailable
+from app.db import station_tz
+from app.utils import haversine_km, pm25_to_aqi
+
+# Non-WAQI points get negative uids so they never collide with WAQI station uids
+OPENAQ_UID_BASE = -1_000_000_000
+OWM_UID_BASE = -2_000_000_000
+
+
+def approx_local_time(utc_dt, lng):
+    """UTC -> aware local time, offset guessed from longitude (for sources without one)"""
+    return utc_dt.astimezone(station_tz(lng))
+
+
+def near_waqi_station(lat, lng, max_km=PROVIDER_MERGE_KM):
+    """True if a configured WAQI station already covers this point"""
+    return any(haversine_km(lat, lng, st['lat'], st['lng']) <= max_km for st in STATIONS_CONFIG)
+
+
+class Provider:
+    """
+    Base class for an ingest source.
+    poll() fetches one round and hands every record to emit(record);
+    next_delay() says how long the crawler should wait before the next round.
+    """
+    name = "base"
+
+    async def poll(self, client, emit):
+        raise NotImplementedError
+
+    def next_delay(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class OpenAQProvider(Provider):
+    """Latest PM2.5 from OpenAQ v3 locations inside the ASEAN box"""
+    name = "openaq"
+    URL = "https://api.openaq.org/v3/parameters/2/latest"  # parameter 2 = pm25 (µg/m³)
+
+    PAGE_SIZE = 1000
+    MAX_PAGES = 50  # safety bound; each page is one governed call
+
+    def __init__(self, interval=3600):
+        self.interval = interval
+        self.points = 0
+        self.pages = 0
+
+    async def fetch_all(self, client):
+        """
+        Every page of latest PM2.5 results inside ASEAN_BOUNDS; None if the
+        first page fails, the pages read so far if a later one does
+        """
+        lat_min, lng_min, lat_max, lng_max = ASEAN_BOUNDS
+        results = []
+        for page in range(1, self.MAX_PAGES + 1):
+            try:
+                resp = await governed_get_async(
+                    client, "openaq", self.URL, wait=CRAWL_TIMEOUT,
+                    params={
+                        'limit': self.PAGE_SIZE, 'page': page,
+                        'bbox': f"{lng_min},{lat_min},{lng_max},{lat_max}",  # min lng, min lat, max lng, max lat
+                    },
+                    headers={'X-API-Key': OPENAQ_API_KEY}
+                )
+            except ProviderUnavailable:
+                if page == 1:
+                    raise
+                logging.warning(f"OpenAQ ingest: governor refused page {page}, keeping {len(results)} results")
+                return results
+            if resp.status_code != 200:
+                logging.warning(f"OpenAQ ingest error: {resp.status_code} (page {page})")
+                return results if page > 1 else None
+            rows = resp.json().get('results', [])
+            results.extend(rows)
+            self.pages = page
+            if len(rows) < self.PAGE_SIZE:
+                return results
+        logging.warning(f"OpenAQ ingest: stopped after {self.MAX_PAGES} pages")
+        return results
+
+    async def poll(self, client, emit):
+        lat_min, lng_min, lat_max, lng_max = ASEAN_BOUNDS
+        try:
+            results = await self.fetch_all(client)
+        except ProviderUnavailable:
+            return
+        except Exception as e:
+            logging.error(f"OpenAQ ingest error: {e}")
+            return
+        if results is None:
+            return
+
+        self.points = 0
+        for row in results:
+            coords = row.get('coordinates') or {}
+            lat, lng, pm25 = coords.get('latitude'), coords.get('longitude'), row.get('value')
+            if lat is None or lng is None or pm25 is None or pm25 < 0:
+                continue
+            if not (lat_min <= lat <= lat_max and lng_min <= lng <= lng_max):
+                continue  # bbox is also checked here in case the API returns points on its edge
+            if near_waqi_station(lat, lng):
+                continue  # WAQI wins where both report
+            try:
+                # Local time with its offset when OpenAQ has it, same as WAQI rows
+                ts = datetime.fromisoformat(row['datetime']['local'])
+                if ts.tzinfo is None:
+                    ts = ts.replace(tzinfo=station_tz(lng))
+            except (KeyError, TypeError, ValueError):
+                try:
+                    utc = datetime.fromisoformat(row['datetime']['utc'].replace('Z', '+00:00'))
+                except (KeyError, TypeError, ValueError):
+                    continue
+                ts = approx_local_time(utc, lng)
+            location_id = row.get('locationsId')
+            if location_id is None:
+                continue
+            self.points += 1
+            emit({
+                "uid": OPENAQ_UID_BASE - location_id, "name": f"OpenAQ location {location_id}",
+                "aqi": pm25_to_aqi(pm25), "pm25": float(pm25),
+                "timestamp": ts,
+                "source": self.name, "lat": lat, "lng": lng
+            })
+
+    def next_delay(self):
+        return self.interval
+
+    def stats(self):
+        return {"points": self.points, "pages": self.pages, "interval_s": self.interval}
+
+
+class OWMGridProvider(Provider):
+    """
+    OpenWeatherMap air pollution on a coarse grid over the parts of the
+    ASEAN box with no WAQI station nearby. The poll interval is derived
+    from the daily quota so the grid never uses more than ~half of it
+    (the rest stays for /api/weather and on-demand satellite lookups).
+    """
+    name = "openweathermap"
+    URL = "http://api.openweathermap.org/data/2.5/air_pollution"
+
+    def __init__(self, step_deg=OWM_GRID_STEP_DEG, sparse_km=OWM_GRID_SPARSE_KM):
+        self.points = self.build_grid(step_deg, sparse_km)
+        budget = max(OWM_DAILY_QUOTA * 0.5, 1) if OWM_DAILY_QUOTA else None
+        per_day = 86400 * len(self.points) / budget if budget else 3600
+        self.interval = max(3600, math.ceil(per_day))
+        self.last_ok = 0
+
+    @staticmethod
+    def build_grid(step_deg, sparse_km):
+        lat_min, lng_min, lat_max, lng_max = ASEAN_BOUNDS
+        points = []
+        lat = lat_min + step_deg / 2
+        while lat < lat_max:
+            lng = lng_min + step_deg / 2
+            while lng < lng_max:
+                if not near_waqi_station(lat, lng, sparse_km):
+                    points.append((len(points), round(lat, 3), round(lng, 3)))
+                lng += step_deg
+            lat += step_deg
+        return points
+
+    async def _fetch_point(self, client, point, semaphore):
+        idx, lat, lng = point
+        async with semaphore:
+            try:
+                resp = await governed_get_async(
+                    client, "openweathermap", self.URL, wait=CRAWL_TIMEOUT,
+                    params={'lat': lat, 'lon': lng, 'appid': OPENWEATHER_API_KEY}
+                )
+                if resp.status_code != 200:
+                    return None
+                items = resp.json().get('list') or []
+            except Exception:
+                return None
+        if not items:
+            return None
+        pollution = items[0]
+        components = pollution.get('components', {})
+        pm25 = components.get('pm2_5')
+        if pm25 is None or pm25 < 0:
+            return None
+        utc = datetime.fromtimestamp(pollution.get('dt', 0), tz=timezone.utc)
+        return {
+            "uid": OWM_UID_BASE - idx, "name": f"OWM grid {lat},{lng}",
+            "aqi": pm25_to_aqi(pm25), "pm25": float(pm25),
+            "pm10": components.get('pm10'), "o3": components.get('o3'),
+            "no2": components.get('no2'), "so2": components.get('so2'), "co": components.get('co'),
+            "timestamp": approx_local_time(utc, lng),
+            "source": self.name, "lat": lat, "lng": lng
+        }
+
+    async def poll(self, client, emit):
+        semaphore = asyncio.Semaphore(min(CRAWL_CONCURRENCY, 5))
+        results = await asyncio.gather(*[self._fetch_point(client, p, semaphore) for p in self.points])
+        self.last_ok = 0
+        for rec in results:
+            if rec:
+                self.last_ok += 1
+                emit(rec)
+
+    def next_delay(self):
+        return self.interval
+
+    def stats(self):
+        return {"points": len(self.points), "last_ok": self.last_ok, "interval_s": self.interval}
+
+
+class StubProvider(Provider):
+    """
+    Local stand-in for any provider: replays records from a JSON/NDJSON
+    file (or a list) on every poll, with no network access.
+    Records need uid, aqi, timestamp (ISO); everything else is optional.
+    Timestamps without an offset are taken as local to lng (UTC if no lng).
+    """
+
+    def __init__(self, records=None, path=None, name="stub", interval=300):
+        self.name = name
+        self.interval = interval
+        self.records = records if records is not None else self.load(path)
+
+    @staticmethod
+    def load(path):
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read().strip()
+        if text.startswith("["):
+            return json.loads(text)
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    async def poll(self, client, emit):
+        for raw in self.records:
+            rec = dict(raw)
+            if isinstance(rec.get('timestamp'), str):
+                rec['timestamp'] = datetime.fromisoformat(rec['timestamp'])
+            if isinstance(rec.get('timestamp'), datetime) and rec['timestamp'].tzinfo is None:
+                tz = station_tz(rec['lng']) if rec.get('lng') is not None else timezone.utc
+                rec['timestamp'] = rec['timestamp'].replace(tzinfo=tz)
+            if rec.get('aqi') is None and rec.get('pm25') is not None:
+                rec['aqi'] = pm25_to_aqi(rec['pm25'])
+            rec.setdefault('name', f"{self.name} {rec['uid']}")
+            rec.setdefault('pm25', None)
+            rec.setdefault('source', self.name)
+            emit(rec)
+
+    def next_delay(self):
+        return self.interval
+
+
+def build_extra_providers(names):
+    """Non-WAQI providers named in INGEST_PROVIDERS that are configured"""
+    providers = []
+    for name in names:
+        if name == "openaq":
+            if OPENAQ_API_KEY:
+                providers.append(OpenAQProvider())
+            else:
+                logging.warning("INGEST_PROVIDERS has openaq but OPENAQ_API_KEY is not set")
+        elif name in ("owm", "openweathermap"):
+            if OPENWEATHER_API_KEY:
+                providers.append(OWMGridProvider())
+            else:
+                logging.warning("INGEST_PROVIDERS has owm but OPENWEATHER_API_KEY is not set")
+        elif name == "stub":
+            providers.append(StubProvider(path=INGEST_STUB_FILE))
+        elif name != "waqi":
+            logging.warning(f"Unknown ingest provider: {name}")
+    return providers
@@ -0,0 +1,315 @@
+"""
+Model registry for AirWatch ASEAN
+Index of trained forecast models in models/registry.db (SQLite, separate
+from the AQI store so it works the same with PostgreSQL). Every training
+run adds a version with its metrics, feature schema, row count and data
+watermark; model_current says which version each station serves. Promotion
+and rollback are one-row updates in a transaction, and model files are
+written before the row that points to them, so readers in any process see
+either the old or the new version, never a half-written one.
+
+A rollback (or a manual promote) pins the station: the trainer keeps adding
+versions but does not promote them until `unpin`.
+
+    python -m app.registry list [key]
+    python -m app.registry promote <key> <version>
+    python -m app.registry rollback <key>
+    python -m app.registry unpin <key>
+
+Keys are station uids, or "global" for the pooled model.
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+
+import joblib  # installed with scikit-learn
+
+# Model cache directory
+MODELS_DIR = Path("models")
+MODELS_DIR.mkdir(exist_ok=True)
+REGISTRY_PATH = MODELS_DIR / "registry.db"
+
+# Versions kept per model besides the current one
+KEEP_VERSIONS = 3
+
+REGISTRY_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS model_versions (
+        model_key TEXT,
+        version INTEGER,
+        path TEXT,
+        trained_at INTEGER,
+        rows INTEGER,
+        data_through INTEGER,
+        features TEXT,
+        metrics TEXT,
+        PRIMARY KEY (model_key, version)
+    )""",
+    """CREATE TABLE IF NOT EXISTS model_current (
+        model_key TEXT PRIMARY KEY,
+        version INTEGER,
+        pinned INTEGER DEFAULT 0,
+        promoted_at INTEGER
+    )""",
+]
+
+
+def _file_name(key, version):
+    return f"global_v{version}.joblib" if key == "global" else f"station_{key}_v{version}.joblib"
+
+
+def _dump(model, path):
+    """Write to a temp file and rename over `path`"""
+    tmp_path = path.with_suffix(".tmp")
+    joblib.dump(model, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class ModelRegistry:
+    """Versions and current model per key; the current map is cached until the file changes"""
+
+    def __init__(self, path=REGISTRY_PATH, keep=KEEP_VERSIONS):
+        self.path = Path(path)
+        self.keep = keep
+        self._conn = None
+        self._version = None
+        self._current = {}
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            for sql in REGISTRY_SCHEMA:
+                conn.execute(sql)
+            self._conn = conn
+            self._import_legacy()
+        return self._conn
+
+    def _import_legacy(self):
+        """
+        One-time import of the unversioned files (station_<uid>_model.joblib +
+        _meta.joblib) as version 1, so existing models keep serving until the
+        trainer replaces them. Their feature schema is the per-station one.
+        """
+        from app.predictor import FEATURES, GLOBAL_FEATURES
+        legacy = sorted(MODELS_DIR.glob("station_*_model.joblib")) + list(MODELS_DIR.glob("global_model.joblib"))
+        if not legacy:
+            return
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM model_versions LIMIT 1").fetchone():
+                conn.execute("ROLLBACK")
+                return
+            imported = 0
+            for model_path in legacy:
+                key = model_path.name[len("station_"):-len("_model.joblib")] if model_path.name.startswith("station_") else "global"
+                meta_path = model_path.with_name(model_path.name.replace("_model.joblib", "_meta.joblib"))
+                try:
+                    metadata = joblib.load(meta_path)
+                except Exception:
+                    continue
+                trained_at = metadata.get('trained_at')
+                metrics = {"train_r2": metadata['train_score']} if metadata.get('train_score') is not None else {}
+                conn.execute(
+                    "INSERT INTO model_versions VALUES (?, 1, ?, ?, NULL, NULL, ?, ?)",
+                    (key, model_path.name, int(trained_at.timestamp()) if trained_at else 0,
+                     json.dumps(list(GLOBAL_FEATURES if key == "global" else FEATURES)), json.dumps(metrics))
+                )
+                conn.execute("INSERT INTO model_current VALUES (?, 1, 0, ?)", (key, int(time.time())))
+                imported += 1
+            conn.execute("COMMIT")
+            logging.info(f"Model registry: imported {imported} unversioned models")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def current(self):
+        """key -> current version entry (path, trained_at, rows, data_through, features, metrics, pinned, newest_trained_at); do not mutate"""
+        with self._lock:
+            conn = self._connection()
+            # data_version changes whenever another connection (any process) commits
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._version:
+                rows = conn.execute("""
+                    SELECT c.model_key, c.version, c.pinned, v.path, v.trained_at, v.rows, v.data_through,
+                           v.features, v.metrics,
+                           (SELECT MAX(trained_at) FROM model_versions n WHERE n.model_key = c.model_key)
+                    FROM model_current c
+                    JOIN model_versions v ON v.model_key = c.model_key AND v.version = c.version
+                """).fetchall()
+                self._current = {
+                    row[0]: {
+                        "version": row[1], "pinned": bool(row[2]), "path": MODELS_DIR / row[3],
+                        "trained_at": row[4], "rows": row[5], "data_through": row[6],
+                        "features": json.loads(row[7]), "metrics": json.loads(row[8]),
+                        "newest_trained_at": row[9],
+                    }
+                    for row in rows
+                }
+                self._version = version
+            return self._current
+
+    def register(self, key, model, metrics, features, rows, data_through):
+        """Store a new version; promoted unless the key is pinned. Returns (version, promoted)."""
+        key = str(key)
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = conn.execute(
+                    "SELECT COALESCE(MAX(version), 0) + 1 FROM model_versions WHERE model_key=?", (key,)
+                ).fetchone()[0]
+                name = _file_name(key, version)
+                _dump(model, MODELS_DIR / name)
+                conn.execute(
+                    "INSERT INTO model_versions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, version, name, int(time.time()), rows, data_through,
+                     json.dumps(list(features)), json.dumps(metrics))
+                )
+                pinned = conn.execute("SELECT pinned FROM model_current WHERE model_key=?", (key,)).fetchone()
+                promoted = not (pinned and pinned[0])
+                if promoted:
+                    self._set_current(conn, key, version, pinned=False)
+                stale = self._prune(conn, key)
+                conn.execute("COMMIT")
+                self._version = None  # data_version does not change for our own commits
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        self._unlink(stale)
+        return version, promoted
+
+    def file_path(self, key, version):
+        return MODELS_DIR / _file_name(str(key), version)
+
+    def _set_current(self, conn, key, version, pinned):
+        conn.execute("""
+            INSERT INTO model_current (model_key, version, pinned, promoted_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(model_key) DO UPDATE SET
+                version = excluded.version, pinned = excluded.pinned, promoted_at = excluded.promoted_at
+        """, (key, version, int(pinned), int(time.time())))
+
+    def _prune(self, conn, key):
+        """Drop versions beyond the newest `keep` (never the current one); returns their files"""
+        rows = conn.execute("""
+            SELECT version, path FROM model_versions
+            WHERE model_key=? AND version NOT IN (SELECT version FROM model_current WHERE model_key=?)
+            ORDER BY version DESC LIMIT -1 OFFSET ?
+        """, (key, key, self.keep)).fetchall()
+        conn.executemany("DELETE FROM model_versions WHERE model_key=? AND version=?",
+                         [(key, version) for version, _ in rows])
+        return [path for _, path in rows]
+
+    def _unlink(self, names):
+        for name in names:
+            paths = [MODELS_DIR / name]
+            if name.endswith("_model.joblib"):  # imported unversioned model
+                paths.append(MODELS_DIR / name.replace("_model.joblib", "_meta.joblib"))
+            for path in paths:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def _update_current(self, key, choose, pinned):
+        key = str(key)
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT version FROM model_current WHERE model_key=?", (key,)).fetchone()
+                version = choose(conn, row[0] if row else None)
+                if version is None:
+                    raise ValueError(f"No version of model {key} to switch to")
+                self._set_current(conn, key, version, pinned)
+                conn.execute("COMMIT")
+                self._version = None  # data_version does not change for our own commits
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return version
+
+    def promote(self, key, version):
+        """Serve `version` and pin it"""
+        def choose(conn, current):
+            found = conn.execute("SELECT version FROM model_versions WHERE model_key=? AND version=?",
+                                 (str(key), version)).fetchone()
+            return found[0] if found else None
+        return self._update_current(key, choose, pinned=True)
+
+    def rollback(self, key):
+        """Serve the version before the current one and pin it"""
+        def choose(conn, current):
+            return conn.execute("SELECT MAX(version) FROM model_versions WHERE model_key=? AND version < ?",
+                                (str(key), current or 0)).fetchone()[0]
+        return self._update_current(key, choose, pinned=True)
+
+    def unpin(self, key):
+        """Back to automatic promotion, starting with the newest version"""
+        def choose(conn, current):
+            return conn.execute("SELECT MAX(version) FROM model_versions WHERE model_key=?",
+                                (str(key),)).fetchone()[0]
+        return self._update_current(key, choose, pinned=False)
+
+    def versions(self, key=None):
+        with self._lock:
+            rows = self._connection().execute(f"""
+                SELECT v.model_key, v.version, v.trained_at, v.rows, v.data_through, v.metrics,
+                       c.version IS NOT NULL, COALESCE(c.pinned, 0)
+                FROM model_versions v
+                LEFT JOIN model_current c ON c.model_key = v.model_key AND c.version = v.version
+                {"WHERE v.model_key = ?" if key is not None else ""}
+                ORDER BY v.model_key, v.version
+            """, (str(key),) if key is not None else ()).fetchall()
+        return [
+            {"key": row[0], "version": row[1], "trained_at": row[2], "rows": row[3], "data_through": row[4],
+             "metrics": json.loads(row[5]), "current": bool(row[6]), "pinned": bool(row[7])}
+            for row in rows
+        ]
+
+    def remove(self, key=None):
+        """Forget one model (or all) and delete its files"""
+        with self._lock:
+            conn = self._connection()
+            where, params = ("WHERE model_key=?", (str(key),)) if key is not None else ("", ())
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                names = [row[0] for row in conn.execute(f"SELECT path FROM model_versions {where}", params)]
+                conn.execute(f"DELETE FROM model_versions {where}", params)
+                conn.execute(f"DELETE FROM model_current {where}", params)
+                conn.execute("COMMIT")
+                self._version = None  # data_version does not change for our own commits
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        self._unlink(names)
+
+
+# Singleton registry shared by the predictor and the trainer
+model_registry = ModelRegistry()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    command = args[0] if args else "list"
+    if command == "list":
+        for v in model_registry.versions(args[1] if len(args) > 1 else None):
+            flags = ("current" if v['current'] else "") + (" pinned" if v['pinned'] else "")
+            r2 = v['metrics'].get('train_r2')
+            print(f"{v['key']:>8} v{v['version']:<4} trained {time.strftime('%Y-%m-%d %H:%M', time.localtime(v['trained_at']))}"
+                  f"  rows={v['rows']}  r2={'-' if r2 is None else round(r2, 3)}  {flags}")
+    elif command == "promote" and len(args) == 3:
+        print(f"{args[1]}: serving v{model_registry.promote(args[1], int(args[2]))} (pinned)")
+    elif command == "rollback" and len(args) == 2:
+        print(f"{args[1]}: serving v{model_registry.rollback(args[1])} (pinned)")
+    elif command == "unpin" and len(args) == 2:
+        print(f"{args[1]}: serving v{model_registry.unpin(args[1])}")
+    else:
+        print(__doc__)
+        sys.exit(1)
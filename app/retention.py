@@ -0,0 +1,190 @@
+"""
+Storage tiering for AirWatch ASEAN
+Raw measurements are kept for RAW_RETENTION_DAYS (and until their month
+is in the columnar archive, see app.archive), then compacted into
+measurements_hourly; hourly rows older than HOURLY_RETENTION_DAYS are
+compacted into measurements_daily (kept forever). Raw rows are cut by UTC
+day; rollup buckets are station-local ISO text, like the API timestamps. Each day of data is
+moved in its own short transaction on the writer connection, then the
+freed pages are returned to the OS (incremental vacuum + WAL checkpoint).
+"""
+import time
+import logging
+from datetime import datetime, timedelta
+
+from app.config import RAW_RETENTION_DAYS, HOURLY_RETENTION_DAYS, RETENTION_INTERVAL, ARCHIVE_DIR
+from app.db import get_write_connection, write_lock, to_epoch, local_iso
+from app.archive import export_sealed, sealed_until
+
+ROLLUP_COLUMNS = (
+    "aqi_min, aqi_max, aqi_mean, aqi_count, pm25_min, pm25_max, pm25_mean, pm25_count"
+)
+
+# Merge an aggregate into an existing bucket (late rows, re-runs): min/max, count-weighted mean
+_MERGE = """
+    ON CONFLICT(station_uid, bucket) DO UPDATE SET
+        aqi_min = MIN(COALESCE(aqi_min, excluded.aqi_min), COALESCE(excluded.aqi_min, aqi_min)),
+        aqi_max = MAX(COALESCE(aqi_max, excluded.aqi_max), COALESCE(excluded.aqi_max, aqi_max)),
+        aqi_mean = (COALESCE(aqi_mean * aqi_count, 0) + COALESCE(excluded.aqi_mean * excluded.aqi_count, 0))
+                   / NULLIF(aqi_count + excluded.aqi_count, 0),
+        aqi_count = aqi_count + excluded.aqi_count,
+        pm25_min = MIN(COALESCE(pm25_min, excluded.pm25_min), COALESCE(excluded.pm25_min, pm25_min)),
+        pm25_max = MAX(COALESCE(pm25_max, excluded.pm25_max), COALESCE(excluded.pm25_max, pm25_max)),
+        pm25_mean = (COALESCE(pm25_mean * pm25_count, 0) + COALESCE(excluded.pm25_mean * excluded.pm25_count, 0))
+                    / NULLIF(pm25_count + excluded.pm25_count, 0),
+        pm25_count = pm25_count + excluded.pm25_count
+"""
+
+RAW_TO_HOURLY_SQL = f"""
+    INSERT INTO measurements_hourly (station_uid, bucket, {ROLLUP_COLUMNS})
+    SELECT station_uid, strftime('%Y-%m-%dT%H:00:00', timestamp + utc_offset, 'unixepoch'),
+           MIN(aqi), MAX(aqi), AVG(aqi), COUNT(aqi),
+           MIN(pm25), MAX(pm25), AVG(pm25), COUNT(pm25)
+    FROM measurements
+    WHERE timestamp >= ? AND timestamp < ?
+    GROUP BY 1, 2
+    {_MERGE}
+"""
+
+HOURLY_TO_DAILY_SQL = f"""
+    INSERT INTO measurements_daily (station_uid, bucket, {ROLLUP_COLUMNS})
+    SELECT station_uid, substr(bucket, 1, 10),
+           MIN(aqi_min), MAX(aqi_max),
+           SUM(aqi_mean * aqi_count) / NULLIF(SUM(aqi_count), 0), SUM(aqi_count),
+           MIN(pm25_min), MAX(pm25_max),
+           SUM(pm25_mean * pm25_count) / NULLIF(SUM(pm25_count), 0), SUM(pm25_count)
+    FROM measurements_hourly
+    WHERE bucket >= ? AND bucket < ?
+    GROUP BY 1, 2
+    {_MERGE}
+"""
+
+# Outcome of the last run, for /api/metrics
+last_run = {}
+
+
+def _day_start(dt):
+    return datetime(dt.year, dt.month, dt.day)
+
+
+def _compact(conn, oldest_sql, rollup_sql, delete_sql, cutoff, bound=datetime.isoformat):
+    """
+    Move everything older than cutoff, one day per transaction; returns rows removed.
+    bound turns a day boundary into the column's representation.
+    """
+    removed = 0
+    with write_lock:
+        oldest = conn.execute(oldest_sql).fetchone()[0]
+    if oldest is None:
+        return 0
+    day = _day_start(datetime.fromisoformat(local_iso(oldest) if isinstance(oldest, int) else oldest[:10]))
+    while day < cutoff:
+        start, end = bound(day), bound(min(day + timedelta(days=1), cutoff))
+        with write_lock:
+            try:
+                conn.execute(rollup_sql, (start, end))
+                removed += conn.execute(delete_sql, (start, end)).rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        day += timedelta(days=1)
+    return removed
+
+
+def reclaim_space(conn):
+    """Give freed pages back to the OS and truncate the WAL"""
+    with write_lock:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Database created before auto_vacuum was set: one full VACUUM switches it over
+            logging.info("Converting database to incremental auto_vacuum (one-time VACUUM)...")
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        freed = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        conn.execute("PRAGMA incremental_vacuum").fetchall()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        conn.execute("PRAGMA optimize")
+    return freed
+
+
+def run_retention(conn=None, now=None, raw_days=RAW_RETENTION_DAYS, hourly_days=HOURLY_RETENTION_DAYS):
+    """
+    One compaction pass: archive sealed months, raw -> hourly -> daily, then
+    reclaim space. With the archive on, raw rows are only compacted once
+    their month has been exported.
+    """
+    conn = conn or get_write_connection()
+    now = now or datetime.utcnow()
+    started = time.monotonic()
+    raw_removed = hourly_removed = 0
+    archived = []
+    if raw_days > 0:
+        raw_cutoff = _day_start(now - timedelta(days=raw_days))
+        if ARCHIVE_DIR:
+            archived = export_sealed(now)
+            raw_cutoff = min(raw_cutoff, sealed_until() or datetime.min)
+        raw_removed = _compact(
+            conn, "SELECT MIN(timestamp) FROM measurements", RAW_TO_HOURLY_SQL,
+            "DELETE FROM measurements WHERE timestamp >= ? AND timestamp < ?",
+            raw_cutoff, bound=to_epoch
+        )
+        if hourly_days > raw_days:
+            hourly_removed = _compact(
+                conn, "SELECT MIN(bucket) FROM measurements_hourly", HOURLY_TO_DAILY_SQL,
+                "DELETE FROM measurements_hourly WHERE bucket >= ? AND bucket < ?",
+                _day_start(now - timedelta(days=hourly_days))
+            )
+    freed = reclaim_space(conn)
+    last_run.update({
+        "at": now.isoformat(timespec="seconds"),
+        "months_archived": [month for month, _ in archived],
+        "raw_compacted": raw_removed,
+        "hourly_compacted": hourly_removed,
+        "pages_freed": freed,
+        "seconds": round(time.monotonic() - started, 2),
+    })
+    if raw_removed or hourly_removed:
+        logging.info(f"Retention: compacted {raw_removed} raw and {hourly_removed} hourly rows, freed {freed} pages")
+    return last_run
+
+
+def read_history(cursor, uid, limit):
+    """
+    Newest `limit` points for a station, newest first: raw readings, then
+    hourly and daily rollups for the span that has already been compacted.
+    Each point carries its `resolution`.
+    """
+    cursor.execute(
+        "SELECT aqi, pm25, timestamp, utc_offset FROM measurements WHERE station_uid=? ORDER BY timestamp DESC LIMIT ?",
+        (uid, limit)
+    )
+    points = [{"aqi": aqi, "pm25": pm25, "timestamp": local_iso(ts, offset), "resolution": "raw"}
+              for aqi, pm25, ts, offset in cursor.fetchall()]
+
+    for table, resolution in (("measurements_hourly", "hourly"), ("measurements_daily", "daily")):
+        if len(points) >= limit:
+            break
+        # Only buckets strictly older than what we already have
+        before = points[-1]["timestamp"][:13 if resolution == "hourly" else 10] if points else "9999"
+        cursor.execute(f"""
+            SELECT aqi_mean, pm25_mean, bucket FROM {table}
+            WHERE station_uid=? AND bucket < ? ORDER BY bucket DESC LIMIT ?
+        """, (uid, before, limit - len(points)))
+        points.extend(
+            {"aqi": round(aqi) if aqi is not None else None,
+             "pm25": round(pm25, 1) if pm25 is not None else None,
+             "timestamp": bucket, "resolution": resolution}
+            for aqi, pm25, bucket in cursor.fetchall()
+        )
+    return points
+
+
+def retention_task():
+    """Background compaction loop (runs next to the crawler, which owns writes)"""
+    logging.info(">>> Retention task started...")
+    while True:
+        try:
+            run_retention()
+        except Exception as e:
+            logging.error(f"Retention error: {e}")
+        time.sleep(RETENTION_INTERVAL)
@@ -2,7 +2,6 @@
 Model evaluation routes for AirWatch ASEAN (Thesis Chapter 4)
 /api/model-evaluation, /api/model-evaluation-all
 """
-import sqlite3
 import pandas as pd
 import numpy as np
 from fastapi import APIRouter
@@ -11,7 +10,7 @@ from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 from sklearn.model_selection import train_test_split
 
-from app.config import DB_NAME
+from app.storage import store
 
 router = APIRouter()
 
@@ -25,17 +24,7 @@ def api_model_evaluation(uid: int):
     - Random Forest
     - Gradient Boosting
     """
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT aqi, timestamp FROM measurements 
-        WHERE station_uid = ? AND aqi IS NOT NULL
-        ORDER BY timestamp DESC LIMIT 200
-    """, (uid,))
-    
-    rows = cursor.fetchall()
-    conn.close()
+    rows = [(aqi, ts) for ts, aqi in store.recent_aqi(uid, 200, skip_null=True)]
     
     if len(rows) < 30:
         return {"error": "Không đủ dữ liệu (cần ít nhất 30 records)"}
@@ -104,21 +93,8 @@ def api_model_evaluation_all():
     Run model evaluation across multiple stations for thesis Chapter 4
     Returns aggregated statistics
     """
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
     # Get stations with enough data
-    cursor.execute("""
-        SELECT station_uid, COUNT(*) as cnt 
-        FROM measurements 
-        WHERE aqi IS NOT NULL 
-        GROUP BY station_uid 
-        HAVING cnt >= 50
-        LIMIT 20
-    """)
-    
-    stations = cursor.fetchall()
-    conn.close()
+    stations = store.stations_with_data(min_count=50, limit=20)
     
     if not stations:
         return {"error": "Không có đủ dữ liệu để đánh giá"}
@@ -3,12 +3,12 @@ Location routes for AirWatch ASEAN
 /api/location-aqi, /api/weather
 """
 import logging
-import requests
 from datetime import datetime
 from fastapi import APIRouter, HTTPException
 
 from app.config import OPENWEATHER_API_KEY, SATELLITE_ENABLED, STATIONS_CONFIG
-from app.utils import idw_interpolate, fetch_satellite_aqi
+from app.utils import idw_interpolate, fetch_satellite_aqi, get_local_weather
+from app.governor import governed_get, ProviderUnavailable
 
 router = APIRouter()
 
@@ -16,14 +16,20 @@ router = APIRouter()
 @router.get("/api/weather")
 def api_weather(lat: float, lng: float):
     """
-    Lấy thông tin thời tiết từ OpenWeatherMap
+    Lấy thông tin thời tiết: trạm mặt đất gần nhất (dữ liệu iaqi đã lưu),
+    fallback sang OpenWeatherMap
     Returns: temperature (°C), humidity (%), description
     """
+    local = get_local_weather(lat, lng)
+    if local:
+        return local
+
     if not OPENWEATHER_API_KEY:
         return {"error": "OpenWeather API key not configured", "temp": None, "humidity": None}
     
     try:
-        response = requests.get(
+        response = governed_get(
+            "openweathermap",
             "https://api.openweathermap.org/data/2.5/weather",
             params={
                 'lat': lat,
@@ -51,6 +57,8 @@ def api_weather(lat: float, lng: float):
             logging.warning(f"Weather API error: {response.status_code}")
             return {"error": f"API error: {response.status_code}", "temp": None, "humidity": None}
             
+    except ProviderUnavailable:
+        return {"error": "Weather provider temporarily unavailable", "temp": None, "humidity": None}
     except Exception as e:
         logging.error(f"Weather fetch error: {e}")
         return {"error": str(e), "temp": None, "humidity": None}
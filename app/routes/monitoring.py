@@ -0,0 +1,39 @@
+"""
+Monitoring routes for AirWatch ASEAN
+/api/metrics
+"""
+from fastapi import APIRouter
+
+from app.governor import governor
+from app.writer import measurement_writer
+from app.latency import crawler_latency
+from app.forecasts import forecast_cache, forecast_refresher
+from app.training import model_trainer
+from app.predictor import predictor
+from app import retention
+from app import crawler
+
+router = APIRouter()
+
+
+@router.get("/api/metrics")
+def api_metrics():
+    """Counters của tiến trình hiện tại (outbound calls, crawler)"""
+    metrics = {"governor": governor.stats()}
+    if crawler.crawler_scheduler is not None:
+        metrics["scheduler"] = crawler.crawler_scheduler.stats()
+        metrics["latency"] = crawler_latency.stats(hosts=("waqi",))
+    providers = {p.name: p.stats() for p in crawler.crawler_providers if p.stats()}
+    if providers:
+        metrics["providers"] = providers
+    if measurement_writer.is_alive():
+        metrics["writer"] = measurement_writer.stats()
+    metrics["forecasts"] = forecast_cache.stats()
+    if forecast_refresher.is_alive():
+        metrics["forecasts"]["refresher"] = forecast_refresher.stats()
+    metrics["models"] = predictor.models.stats()
+    if model_trainer.is_alive():
+        metrics["training"] = model_trainer.stats()
+    if retention.last_run:
+        metrics["retention"] = dict(retention.last_run)
+    return metrics
@@ -1,14 +1,13 @@
 """
 Station routes for AirWatch ASEAN
-/api/stations, /api/stats, /api/history, /api/heatmap
+/api/stations, /api/stats, /api/history, /api/readings, /api/heatmap
 """
-import sqlite3
 from fastapi import APIRouter
 from fastapi.responses import FileResponse
 
-from app.config import DB_NAME, STATIONS_CONFIG
-from app.db import get_db_connection
-from app.predictor import predictor
+from app.config import STATIONS_CONFIG
+from app.storage import store
+from app.forecasts import forecast_cache
 
 router = APIRouter()
 
@@ -20,20 +19,9 @@ def serve_index():
 
 @router.get("/api/stations")
 def api_stations():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT m.station_uid, m.aqi, m.pm25, m.timestamp 
-        FROM measurements m
-        INNER JOIN (
-            SELECT station_uid, MAX(timestamp) as max_ts 
-            FROM measurements GROUP BY station_uid
-        ) latest ON m.station_uid = latest.station_uid AND m.timestamp = latest.max_ts
-    """)
-    db_data = {row['station_uid']: row for row in cursor.fetchall()}
-    conn.close()
+    db_data = store.latest()
+    # Dự báo đã tính sẵn sau mỗi lần crawl; request không bao giờ chạy model
+    forecasts = forecast_cache.get_many([st['uid'] for st in STATIONS_CONFIG if st['uid'] in db_data], db_data)
     
     res = []
     for st in STATIONS_CONFIG:
@@ -41,15 +29,16 @@ def api_stations():
         data = db_data.get(uid)
         
         if data:
-            preds, trend, confidence = predictor.predict_multi(uid, [1, 6, 12, 24])
+            forecast = forecasts[uid]
+            preds = forecast['predictions']
             res.append({
                 "uid": uid, "name": st['name'], "lat": st['lat'], "lng": st['lng'],
                 "aqi": data['aqi'], "pm25": data['pm25'],
                 "last_update": data['timestamp'],
                 "prediction": preds.get(1, "N/A"),
                 "predictions": preds,
-                "trend": trend,
-                "confidence": confidence
+                "trend": forecast['trend'],
+                "confidence": forecast['confidence']
             })
         else:
             res.append({
@@ -66,29 +55,13 @@ def api_stations():
 @router.get("/api/stats")
 def api_stats():
     """Thống kê tổng quan"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    # Lấy AQI mới nhất của mỗi trạm
-    cursor.execute("""
-        SELECT m.aqi FROM measurements m
-        INNER JOIN (
-            SELECT station_uid, MAX(timestamp) as max_ts 
-            FROM measurements GROUP BY station_uid
-        ) latest ON m.station_uid = latest.station_uid AND m.timestamp = latest.max_ts
-        WHERE m.aqi IS NOT NULL
-    """)
-    
-    aqis = [row[0] for row in cursor.fetchall() if row[0] is not None]
+    # Lấy AQI mới nhất của mỗi trạm WAQI (không tính điểm OpenAQ/OWM, như heatmap)
+    db_data = store.latest()
+    rows = [db_data.get(st['uid']) for st in STATIONS_CONFIG]
+    aqis = [row['aqi'] for row in rows if row and row['aqi'] is not None]
     
     # Đếm alerts trong 24h qua
-    cursor.execute("""
-        SELECT COUNT(*) FROM alerts 
-        WHERE created_at > datetime('now', '-24 hours')
-    """)
-    alert_count = cursor.fetchone()[0]
-    
-    conn.close()
+    alert_count = store.alert_count(hours=24)
     
     if not aqis:
         return {"total_stations": 0, "avg_aqi": 0, "good": 0, "moderate": 0, "unhealthy": 0, "alerts_24h": 0}
@@ -110,40 +83,25 @@ def api_stats():
 
 @router.get("/api/history/{uid}")
 def api_history(uid: int, limit: int = 24):
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT aqi, pm25, timestamp FROM measurements WHERE station_uid=? ORDER BY timestamp DESC LIMIT ?", 
-        (uid, limit)
-    )
-    data = [dict(r) for r in cursor.fetchall()]
-    conn.close()
-    return data[::-1]
+    """Raw readings, then hourly/daily rollups once history has been compacted"""
+    return store.history(uid, limit)[::-1]
+
+
+@router.get("/api/readings/{uid}")
+def api_readings(uid: int, limit: int = 24):
+    """Đầy đủ chỉ số ô nhiễm + thời tiết (iaqi) của 1 trạm"""
+    return store.readings(uid, limit)[::-1]
 
 
 @router.get("/api/heatmap")
 def api_heatmap():
     """Dữ liệu cho heatmap layer"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT m.station_uid, m.aqi
-        FROM measurements m
-        INNER JOIN (
-            SELECT station_uid, MAX(timestamp) as max_ts 
-            FROM measurements GROUP BY station_uid
-        ) latest ON m.station_uid = latest.station_uid AND m.timestamp = latest.max_ts
-        WHERE m.aqi IS NOT NULL
-    """)
-    
-    db_data = {row[0]: row[1] for row in cursor.fetchall()}
-    conn.close()
+    db_data = store.latest()
     
     points = []
     for st in STATIONS_CONFIG:
-        aqi = db_data.get(st['uid'])
+        row = db_data.get(st['uid'])
+        aqi = row['aqi'] if row else None
         if aqi is not None:
             # Intensity based on AQI (normalized 0-1)
             intensity = min(aqi / 300, 1.0)
@@ -0,0 +1,163 @@
+"""
+Adaptive polling scheduler for AirWatch ASEAN
+Learns each station's publish cadence and keeps a priority queue of due times
+"""
+import time
+import heapq
+import logging
+import statistics
+from collections import deque
+from datetime import datetime, timezone
+
+from app.config import CRAWL_INTERVAL, POLL_MAX_INTERVAL, POLL_STALE_AFTER
+from app.storage import store
+
+# Most WAQI stations publish hourly; assume that until history says otherwise
+DEFAULT_CADENCE = 3600
+MAX_CADENCE = 6 * 3600
+HISTORY_SAMPLES = 8
+
+
+class StationState:
+    """Polling state of a single station"""
+    __slots__ = ("uid", "last_ts", "intervals", "last_new_at", "misses", "due_at")
+
+    def __init__(self, uid):
+        self.uid = uid
+        self.last_ts = None  # timestamp of the newest reading we know of
+        self.intervals = deque(maxlen=HISTORY_SAMPLES)  # seconds between readings
+        self.last_new_at = None  # wall-clock time we last saw a new reading
+        self.misses = 0  # polls in a row without a new reading
+        self.due_at = 0.0
+
+    @property
+    def cadence(self):
+        if not self.intervals:
+            return DEFAULT_CADENCE
+        return min(max(statistics.median(self.intervals), CRAWL_INTERVAL), MAX_CADENCE)
+
+    def observe(self, ts):
+        """Record a reading timestamp, returns True if it is new"""
+        if self.last_ts is not None and ts <= self.last_ts:
+            return False
+        if self.last_ts is not None:
+            self.intervals.append((ts - self.last_ts).total_seconds())
+        self.last_ts = ts
+        return True
+
+
+class PollScheduler:
+    """
+    Priority queue of next-due poll times per station.
+
+    - New reading: sleep for about one publish cadence, then poll every
+      CRAWL_INTERVAL until the next reading shows up (latency <= fixed mode).
+    - No new reading for POLL_STALE_AFTER: back off in proportion to how
+      long the station has been silent, up to POLL_MAX_INTERVAL, so
+      stale and dead stations stop eating API quota.
+    - adaptive=False keeps the old behaviour (every station every CRAWL_INTERVAL).
+    """
+
+    def __init__(self, stations, adaptive=True):
+        self.adaptive = adaptive
+        self.stations = {st['uid']: st for st in stations}
+        self.states = {uid: StationState(uid) for uid in self.stations}
+        self._heap = [(0.0, uid) for uid in self.stations]
+        heapq.heapify(self._heap)
+        self.polls = 0
+        self.new_readings = 0
+
+    def learn_from_history(self):
+        """Seed cadence estimates from the last readings stored per station"""
+        try:
+            rows = store.recent_timestamps(HISTORY_SAMPLES + 1)
+        except Exception as e:
+            logging.warning(f"Scheduler could not read history: {e}")
+            return
+
+        for uid, ts in rows:
+            state = self.states.get(uid)
+            if state is None or ts is None:
+                continue
+            try:
+                state.observe(datetime.fromtimestamp(ts, timezone.utc))
+            except (TypeError, ValueError, OverflowError):
+                continue
+        learned = sum(1 for s in self.states.values() if s.intervals)
+        logging.info(f"Scheduler learned publish cadence for {learned}/{len(self.states)} stations")
+
+    def pop_due(self, now=None):
+        """Remove and return all stations whose poll is due"""
+        now = time.time() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due_at, uid = heapq.heappop(self._heap)
+            if due_at != self.states[uid].due_at:
+                continue  # stale heap entry, station was rescheduled
+            due.append(self.stations[uid])
+        return due
+
+    def is_new(self, uid, ts):
+        """True if ts is newer than the last reading known for the station"""
+        state = self.states.get(uid)
+        return state is not None and (state.last_ts is None or ts > state.last_ts)
+
+    def record(self, station, result, now=None):
+        """Reschedule a station after a poll; result is the parsed record or None"""
+        now = time.time() if now is None else now
+        state = self.states[station['uid']]
+        self.polls += 1
+
+        is_new = result is not None and state.observe(result['timestamp'])
+        if is_new:
+            self.new_readings += 1
+            state.misses = 0
+            state.last_new_at = now
+        else:
+            state.misses += 1
+            if state.last_new_at is None:
+                state.last_new_at = now
+
+        self._schedule(state, now + self._next_interval(state, is_new, now))
+
+    def defer(self, station, now=None):
+        """Station did not answer before the sweep deadline: retry next cycle, not a miss"""
+        now = time.time() if now is None else now
+        self._schedule(self.states[station['uid']], now + CRAWL_INTERVAL)
+
+    def _next_interval(self, state, is_new, now):
+        if not self.adaptive:
+            return CRAWL_INTERVAL
+        if is_new:
+            # Wake up one poll interval before the next reading is expected
+            return max(state.cadence - CRAWL_INTERVAL, CRAWL_INTERVAL)
+        silent_for = now - state.last_new_at
+        if silent_for < max(POLL_STALE_AFTER, 2 * state.cadence):
+            return CRAWL_INTERVAL
+        # Stale/dead station: the longer it stays silent, the less often we ask
+        return min(max(silent_for / 4, CRAWL_INTERVAL), POLL_MAX_INTERVAL)
+
+    def _schedule(self, state, due_at):
+        state.due_at = due_at
+        heapq.heappush(self._heap, (due_at, state.uid))
+
+    def seconds_until_next(self, now=None):
+        """Seconds until the earliest due station (never more than CRAWL_INTERVAL)"""
+        now = time.time() if now is None else now
+        if not self._heap:
+            return CRAWL_INTERVAL
+        return min(max(self._heap[0][0] - now, 0), CRAWL_INTERVAL)
+
+    def stats(self, now=None):
+        """Counters for monitoring"""
+        now = time.time() if now is None else now
+        states = self.states.values()
+        return {
+            "mode": "adaptive" if self.adaptive else "fixed",
+            "stations": len(self.states),
+            "due_now": sum(1 for s in states if s.due_at <= now),
+            "backed_off": sum(1 for s in states if s.due_at - now > CRAWL_INTERVAL and s.misses > 0),
+            "median_cadence_s": round(statistics.median(s.cadence for s in states)) if self.states else 0,
+            "polls": self.polls,
+            "new_readings": self.new_readings,
+        }
@@ -0,0 +1,717 @@
+"""
+Measurement storage for AirWatch ASEAN
+One interface over the measurements/alerts store, used by the writer, the
+routes, the scheduler and the predictor:
+
+- SQLiteStore (default): the local DB_NAME file, single writer connection,
+  rollups/retention/archive (app.retention, app.archive).
+- PostgresStore (AQI_DATABASE_URL=postgresql://...): shared by several API
+  nodes. measurements is range-partitioned by month with a BRIN index on
+  timestamp; batches are ingested with COPY through a pooled connection.
+
+Both backends store UTC plus the station's UTC offset and return
+station-local ISO strings (the API format); recent_timestamps returns
+epoch seconds for internal use.
+
+Only the crawler (or `python -m app.migrations`) runs store.init(); web
+workers call require_schema(), which only reads.
+"""
+import io
+import csv
+import json
+import time
+import sqlite3
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from collections import Counter
+
+try:
+    import psycopg2
+    from psycopg2.pool import ThreadedConnectionPool
+    from psycopg2.extras import execute_values
+    PSYCOPG2_AVAILABLE = True
+except ImportError:
+    PSYCOPG2_AVAILABLE = False
+
+from app.config import AQI_DATABASE_URL, PG_POOL_SIZE
+from app.migrations import MIGRATIONS
+from app.db import (
+    init_db, get_read_connection, get_write_connection, write_lock, READING_COLUMNS,
+    to_epoch, utc_offset, to_utc, local_iso
+)
+from app.latest import latest_readings
+from app.retention import read_history
+
+
+def _iso(ts):
+    return ts.isoformat() if isinstance(ts, datetime) else ts
+
+
+def _forecast_row(uid, entry):
+    return (uid, json.dumps(entry['predictions'], ensure_ascii=False), entry['trend'],
+            entry['confidence'], entry['generated_at'], entry['data_through'])
+
+
+def _forecast_entry(row):
+    return {
+        "predictions": {int(h): value for h, value in json.loads(row[1]).items()},
+        "trend": row[2], "confidence": row[3], "generated_at": row[4], "data_through": row[5],
+    }
+
+
+def _alert_time(ts):
+    """UTC alert time in the text format alerts always had"""
+    return to_utc(ts).strftime("%Y-%m-%d %H:%M:%S") if ts is not None else None
+
+
+INSERT_MEASUREMENT_SQL = f"""
+    INSERT OR IGNORE INTO measurements
+        (station_uid, station_name, aqi, pm25, timestamp, utc_offset, source, {", ".join(READING_COLUMNS)})
+    VALUES (?, ?, ?, ?, ?, ?, ?, {", ".join("?" * len(READING_COLUMNS))})
+"""
+
+UPSERT_LATEST_SQL = """
+    INSERT INTO station_latest (station_uid, station_name, aqi, pm25, timestamp, utc_offset, source)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(station_uid) DO UPDATE SET
+        station_name = excluded.station_name, aqi = excluded.aqi, pm25 = excluded.pm25,
+        timestamp = excluded.timestamp, utc_offset = excluded.utc_offset, source = excluded.source
+    WHERE excluded.timestamp > station_latest.timestamp
+"""
+
+
+def measurement_row(item):
+    """Parameters of INSERT_MEASUREMENT_SQL for one record"""
+    return (
+        item['uid'], item['name'], item['aqi'], item['pm25'],
+        to_epoch(item['timestamp']), utc_offset(item['timestamp']),
+        item.get('source', 'waqi'), *(item.get(column) for column in READING_COLUMNS)
+    )
+
+
+def spike_alerts(new_items, history):
+    """
+    Spike rule shared by the storage backends.
+    history: uid -> [(epoch seconds, aqi)] newest first, may include new_items.
+    Returns [(uid, message, aqi)].
+    """
+    alerts = []
+    for item in new_items:
+        current_aqi = item['aqi']
+        current_ts = to_epoch(item['timestamp'])
+        prev = [aqi for ts, aqi in history.get(item['uid'], [])
+                if ts < current_ts and aqi is not None][:2]
+        if not prev:
+            continue
+        prev_avg = sum(prev) / len(prev)
+        # Nếu tăng hơn 30% -> cảnh báo
+        if current_aqi > prev_avg * 1.3 and current_aqi > 100:
+            alerts.append((item['uid'], f"AQI tăng đột biến từ {int(prev_avg)} lên {current_aqi}", current_aqi))
+            logging.warning(f"⚠️ SPIKE ALERT: Station {item['uid']} - AQI {current_aqi}")
+    return alerts
+
+
+def waqi_items(items):
+    """Readings of WAQI stations only; OpenAQ/OWM grid points get no spike alerts"""
+    return [item for item in items if item.get('source', 'waqi') == 'waqi']
+
+
+def detect_spikes(cursor, new_items):
+    """
+    Kiểm tra đột biến AQI cho cả batch vừa ghi.
+    Runs on the writer's cursor so it shares the ingest transaction:
+    one windowed query for the previous readings of every affected
+    station, one executemany for the alerts.
+    """
+    new_items = waqi_items(new_items)
+    if not new_items:
+        return 0
+
+    per_station = Counter(item['uid'] for item in new_items)
+    uids = sorted(per_station)
+    # Each new row needs the 2 readings before it; a station may have several new rows
+    depth = 2 + max(per_station.values())
+    placeholders = ",".join("?" * len(uids))
+    cursor.execute(f"""
+        SELECT station_uid, aqi, timestamp FROM (
+            SELECT station_uid, aqi, timestamp,
+                   ROW_NUMBER() OVER (PARTITION BY station_uid ORDER BY timestamp DESC) AS rn
+            FROM measurements
+            WHERE station_uid IN ({placeholders})
+        ) WHERE rn <= ?
+        ORDER BY station_uid, timestamp DESC
+    """, (*uids, depth))
+
+    history = {}
+    for uid, aqi, ts in cursor.fetchall():
+        history.setdefault(uid, []).append((ts, aqi))
+
+    alerts = spike_alerts(new_items, history)
+    if alerts:
+        cursor.executemany("""
+            INSERT INTO alerts (station_uid, alert_type, message, aqi_value)
+            VALUES (?, 'SPIKE', ?, ?)
+        """, alerts)
+    return len(alerts)
+
+
+def write_measurements(conn, batch, spikes=True):
+    """
+    Insert a batch in one transaction on `conn`; returns the rows that were new.
+    Existing (uid, timestamp) pairs are found with one query so the insert
+    itself can be a single executemany.
+    """
+    if not batch:
+        return []
+
+    # Same reading twice in one batch: keep the first
+    unique = {}
+    for item in batch:
+        unique.setdefault((item['uid'], to_epoch(item['timestamp'])), item)
+
+    cursor = conn.cursor()
+    keys = list(unique)
+    existing = set()
+    for i in range(0, len(keys), 400):  # stay under SQLite's host parameter limit
+        chunk = keys[i:i + 400]
+        cursor.execute(f"""
+            SELECT station_uid, timestamp FROM measurements
+            WHERE (station_uid, timestamp) IN (VALUES {",".join("(?, ?)" for _ in chunk)})
+        """, [value for key in chunk for value in key])
+        existing.update(cursor.fetchall())
+
+    new_items = [item for key, item in unique.items() if key not in existing]
+    cursor.executemany(INSERT_MEASUREMENT_SQL, [measurement_row(item) for item in new_items])
+    # Late/backfilled readings never replace a newer latest row (WHERE clause)
+    cursor.executemany(UPSERT_LATEST_SQL, [
+        (item['uid'], item['name'], item['aqi'], item['pm25'],
+         to_epoch(item['timestamp']), utc_offset(item['timestamp']), item.get('source', 'waqi'))
+        for item in new_items
+    ])
+    # Non-WAQI points carry their own coordinates
+    cursor.executemany("""
+        INSERT OR REPLACE INTO external_stations (uid, source, name, lat, lng)
+        VALUES (?, ?, ?, ?, ?)
+    """, {
+        (item['uid'], item['source'], item['name'], item['lat'], item['lng'])
+        for item in new_items if item.get('source', 'waqi') != 'waqi' and 'lat' in item
+    })
+    # Kiểm tra spike alert cho cả batch trong cùng transaction
+    if spikes:
+        detect_spikes(cursor, new_items)
+    conn.commit()
+    return new_items
+
+
+class SQLiteStore:
+    """Local SQLite file (the original storage)"""
+    name = "sqlite"
+    read_only = False  # informational: requests only ever use get_read_connection (mode=ro)
+
+    def init(self):
+        init_db()
+
+    def schema_behind(self):
+        """None if every migration is applied, else what is missing"""
+        try:
+            version = self._query("SELECT MAX(version) FROM schema_version")[0][0] or 0
+        except sqlite3.OperationalError:
+            version = 0  # no database file or no schema_version table yet
+        needed = MIGRATIONS[-1][0]
+        return f"SQLite schema is at version {version}, this code needs {needed}" if version < needed else None
+
+    def write_batch(self, batch, spikes=True):
+        """Insert a batch in one transaction; returns the rows that were new"""
+        conn = get_write_connection()
+        with write_lock:
+            try:
+                return write_measurements(conn, batch, spikes)
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _query(self, sql, params=()):
+        cursor = get_read_connection().cursor()
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+    def latest(self):
+        """uid -> {station_name, aqi, pm25, timestamp, source}"""
+        return latest_readings.rows()
+
+    def history(self, uid, limit):
+        """Newest `limit` points (raw, then rollups), newest first"""
+        return read_history(get_read_connection().cursor(), uid, limit)
+
+    def readings(self, uid, limit):
+        """Newest `limit` raw rows with every reading column, newest first"""
+        columns = ("aqi", "pm25", *READING_COLUMNS, "timestamp")
+        rows = self._query(
+            f"SELECT {', '.join(columns)}, utc_offset FROM measurements "
+            "WHERE station_uid=? ORDER BY timestamp DESC LIMIT ?",
+            (uid, limit)
+        )
+        return [dict(zip(columns, (*row[:-2], local_iso(row[-2], row[-1])))) for row in rows]
+
+    def recent_aqi(self, uid, limit, skip_null=False):
+        """[(local timestamp, aqi)] newest first"""
+        rows = self._query(
+            "SELECT timestamp, utc_offset, aqi FROM measurements WHERE station_uid=?"
+            + (" AND aqi IS NOT NULL" if skip_null else "")
+            + " ORDER BY timestamp DESC LIMIT ?",
+            (uid, limit)
+        )
+        return [(local_iso(ts, offset), aqi) for ts, offset, aqi in rows]
+
+    def recent_aqi_all(self, per_station, uids=None):
+        """
+        [(uid, epoch seconds, utc_offset, aqi)] - the last `per_station` readings
+        of every station (or of `uids`), grouped by station, newest first
+        """
+        where = f"WHERE station_uid IN ({','.join('?' * len(uids))})" if uids is not None else ""
+        return self._query(f"""
+            SELECT station_uid, timestamp, utc_offset, aqi FROM (
+                SELECT station_uid, timestamp, utc_offset, aqi,
+                       ROW_NUMBER() OVER (PARTITION BY station_uid ORDER BY timestamp DESC) AS rn
+                FROM measurements {where}
+            ) WHERE rn <= ?
+            ORDER BY station_uid, timestamp DESC
+        """, (*(uids or ()), per_station))
+
+    def recent_timestamps(self, per_station):
+        """[(uid, epoch seconds)] - the last `per_station` readings of every station, oldest first"""
+        return self._query("""
+            SELECT station_uid, timestamp FROM (
+                SELECT station_uid, timestamp,
+                       ROW_NUMBER() OVER (PARTITION BY station_uid ORDER BY timestamp DESC) AS rn
+                FROM measurements
+            ) WHERE rn <= ?
+            ORDER BY station_uid, timestamp
+        """, (per_station,))
+
+    def stations_with_data(self, min_count, limit):
+        """[(uid, count)] of stations with at least min_count AQI readings"""
+        return self._query("""
+            SELECT station_uid, COUNT(*) as cnt
+            FROM measurements
+            WHERE aqi IS NOT NULL
+            GROUP BY station_uid
+            HAVING cnt >= ?
+            LIMIT ?
+        """, (min_count, limit))
+
+    def hourly_trends(self, days=7):
+        """[(local hour, avg_aqi, samples)] of WAQI stations over the last `days` days"""
+        return self._query("""
+            SELECT (timestamp + utc_offset) % 86400 / 3600 as hour, AVG(aqi) as avg_aqi, COUNT(*) as count
+            FROM measurements
+            WHERE timestamp > CAST(strftime('%s', 'now') AS INTEGER) - ? AND source = 'waqi'
+            GROUP BY hour
+            ORDER BY hour
+        """, (days * 86400,))
+
+    def alerts(self, limit):
+        columns = ("id", "station_uid", "alert_type", "message", "aqi_value", "created_at")
+        rows = self._query(
+            f"SELECT {', '.join(columns)} FROM alerts ORDER BY created_at DESC LIMIT ?", (limit,)
+        )
+        return [dict(zip(columns, (*row[:-1], _alert_time(row[-1])))) for row in rows]
+
+    def alert_count(self, hours=24):
+        return self._query(
+            "SELECT COUNT(*) FROM alerts WHERE created_at > CAST(strftime('%s', 'now') AS INTEGER) - ?",
+            (hours * 3600,)
+        )[0][0]
+
+    def external_latest(self):
+        """[(source, name, lat, lng, aqi, pm25, pm10, no2, o3, timestamp)] of non-WAQI points"""
+        try:
+            rows = self._query("""
+                SELECT e.source, e.name, e.lat, e.lng, m.aqi, m.pm25, m.pm10, m.no2, m.o3,
+                       m.timestamp, m.utc_offset
+                FROM external_stations e
+                JOIN station_latest l ON l.station_uid = e.uid
+                JOIN measurements m ON m.station_uid = l.station_uid AND m.timestamp = l.timestamp
+            """)
+            return [(*row[:-2], local_iso(row[-2], row[-1])) for row in rows]
+        except Exception:
+            return []  # DB from before the providers existed
+
+    def save_forecasts(self, entries):
+        """Upsert {uid: forecast entry} (see app.forecasts)"""
+        conn = get_write_connection()
+        with write_lock:
+            try:
+                conn.executemany("""
+                    INSERT OR REPLACE INTO forecasts
+                        (station_uid, predictions, trend, confidence, generated_at, data_through)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, [_forecast_row(uid, entry) for uid, entry in entries.items()])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def forecasts(self):
+        """uid -> forecast entry"""
+        return {row[0]: _forecast_entry(row) for row in self._query("""
+            SELECT station_uid, predictions, trend, confidence, generated_at, data_through FROM forecasts
+        """)}
+
+
+PG_SCHEMA = [
+    f"""CREATE TABLE IF NOT EXISTS measurements (
+        station_uid INTEGER NOT NULL,
+        station_name TEXT,
+        aqi INTEGER,
+        pm25 REAL,
+        {", ".join(f"{column} REAL" for column in READING_COLUMNS)},
+        timestamp TIMESTAMP NOT NULL,  -- UTC
+        utc_offset INTEGER NOT NULL DEFAULT 0,  -- seconds, station-local = timestamp + offset
+        source TEXT DEFAULT 'waqi',
+        PRIMARY KEY (station_uid, timestamp)
+    ) PARTITION BY RANGE (timestamp)""",
+    "ALTER TABLE measurements ADD COLUMN IF NOT EXISTS utc_offset INTEGER NOT NULL DEFAULT 0",
+    # Rows arrive in time order, so a BRIN index stays tiny and prunes time-window scans
+    "CREATE INDEX IF NOT EXISTS measurements_timestamp_brin ON measurements USING BRIN (timestamp)",
+    """CREATE TABLE IF NOT EXISTS station_latest (
+        station_uid INTEGER PRIMARY KEY,
+        station_name TEXT,
+        aqi INTEGER,
+        pm25 REAL,
+        timestamp TIMESTAMP,
+        utc_offset INTEGER,
+        source TEXT
+    )""",
+    "ALTER TABLE station_latest ADD COLUMN IF NOT EXISTS utc_offset INTEGER",
+    """CREATE TABLE IF NOT EXISTS external_stations (
+        uid INTEGER PRIMARY KEY,
+        source TEXT,
+        name TEXT,
+        lat REAL,
+        lng REAL
+    )""",
+    """CREATE TABLE IF NOT EXISTS alerts (
+        id BIGSERIAL PRIMARY KEY,
+        station_uid INTEGER,
+        alert_type TEXT,
+        message TEXT,
+        aqi_value INTEGER,
+        created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+    )""",
+    "CREATE INDEX IF NOT EXISTS alerts_created_at ON alerts (created_at)",
+    """CREATE TABLE IF NOT EXISTS forecasts (
+        station_uid INTEGER PRIMARY KEY,
+        predictions TEXT,
+        trend TEXT,
+        confidence INTEGER,
+        generated_at BIGINT,
+        data_through TEXT
+    )""",
+]
+
+# Created by PG_SCHEMA; require_schema checks they exist
+PG_TABLES = ("measurements", "station_latest", "external_stations", "alerts", "forecasts")
+
+PG_COLUMNS = ("station_uid", "station_name", "aqi", "pm25", *READING_COLUMNS, "timestamp", "utc_offset", "source")
+
+# New rows and the station_latest upsert in one statement; returns what was inserted
+PG_INGEST_SQL = f"""
+    WITH inserted AS (
+        INSERT INTO measurements ({", ".join(PG_COLUMNS)})
+        SELECT DISTINCT ON (station_uid, timestamp) {", ".join(PG_COLUMNS)}
+        FROM measurements_staging
+        ORDER BY station_uid, timestamp
+        ON CONFLICT DO NOTHING
+        RETURNING station_uid, station_name, aqi, pm25, timestamp, utc_offset, source
+    ), latest AS (
+        INSERT INTO station_latest (station_uid, station_name, aqi, pm25, timestamp, utc_offset, source)
+        SELECT DISTINCT ON (station_uid) station_uid, station_name, aqi, pm25, timestamp, utc_offset, source
+        FROM inserted
+        ORDER BY station_uid, timestamp DESC
+        ON CONFLICT (station_uid) DO UPDATE SET
+            station_name = EXCLUDED.station_name, aqi = EXCLUDED.aqi, pm25 = EXCLUDED.pm25,
+            timestamp = EXCLUDED.timestamp, utc_offset = EXCLUDED.utc_offset, source = EXCLUDED.source
+        WHERE EXCLUDED.timestamp > station_latest.timestamp
+    )
+    SELECT station_uid, timestamp FROM inserted
+"""
+
+
+def _month_bounds(ts):
+    start = datetime(ts.year, ts.month, 1)
+    end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+
+class PostgresStore:
+    """Shared PostgreSQL store: monthly partitions, BRIN on timestamp, COPY ingest"""
+    name = "postgres"
+
+    def __init__(self, url, pool_size=PG_POOL_SIZE):
+        if not PSYCOPG2_AVAILABLE:
+            raise RuntimeError("AQI_DATABASE_URL is PostgreSQL but psycopg2 is not installed")
+        self.pool = ThreadedConnectionPool(1, pool_size, url)
+        self._partitions = set()
+        self.read_only = False  # set by require_schema: web workers run READ ONLY transactions
+
+    @contextmanager
+    def cursor(self):
+        """Pooled connection for one transaction (commit on success, rollback on error)"""
+        conn = self.pool.getconn()
+        try:
+            if conn.readonly != self.read_only:
+                conn.readonly = self.read_only
+            with conn.cursor() as cursor:
+                yield cursor
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def _query(self, sql, params=()):
+        with self.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [tuple(_iso(value) for value in row) for row in cursor.fetchall()]
+
+    def init(self):
+        with self.cursor() as cursor:
+            for statement in PG_SCHEMA:
+                cursor.execute(statement)
+        self.ensure_partition(datetime.now())
+        logging.info("PostgreSQL measurement store initialized.")
+
+    def schema_behind(self):
+        """None if every table of PG_SCHEMA exists, else the missing ones"""
+        found = self._query(f"SELECT {', '.join(['to_regclass(%s)'] * len(PG_TABLES))}", PG_TABLES)[0]
+        missing = [table for table, oid in zip(PG_TABLES, found) if oid is None]
+        return f"PostgreSQL tables missing: {', '.join(missing)}" if missing else None
+
+    def ensure_partition(self, ts):
+        """Create the monthly partition that holds `ts` (idempotent, safe across nodes)"""
+        start, end = _month_bounds(ts)
+        name = f"measurements_{start:%Y_%m}"
+        if name in self._partitions:
+            return
+        try:
+            with self.cursor() as cursor:
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {name} PARTITION OF measurements
+                    FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')
+                """)
+        except (psycopg2.errors.DuplicateTable, psycopg2.errors.UniqueViolation):
+            pass  # another node created it at the same moment
+        self._partitions.add(name)
+
+    def write_batch(self, batch, spikes=True):
+        """COPY the batch into a staging table, insert new rows, detect spikes; one transaction"""
+        if not batch:
+            return []
+        for month in {_month_bounds(to_utc(item['timestamp']))[0] for item in batch}:
+            self.ensure_partition(month)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for item in batch:
+            writer.writerow([
+                item['uid'], item['name'], item['aqi'], item['pm25'],
+                *(item.get(column) for column in READING_COLUMNS),
+                to_utc(item['timestamp']).isoformat(), utc_offset(item['timestamp']), item.get('source', 'waqi')
+            ])
+        buffer.seek(0)
+
+        with self.cursor() as cursor:
+            cursor.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS measurements_staging
+                (LIKE measurements INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+            """)
+            cursor.copy_expert(
+                f"COPY measurements_staging ({', '.join(PG_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer
+            )
+            cursor.execute(PG_INGEST_SQL)
+            inserted = {(uid, to_epoch(ts)) for uid, ts in cursor.fetchall()}
+            new_items = []
+            for item in batch:
+                key = (item['uid'], to_epoch(item['timestamp']))
+                if key in inserted:
+                    inserted.discard(key)  # first copy of a duplicate only
+                    new_items.append(item)
+
+            external = {
+                (item['uid'], item['source'], item['name'], item['lat'], item['lng'])
+                for item in new_items if item.get('source', 'waqi') != 'waqi' and 'lat' in item
+            }
+            if external:
+                execute_values(cursor, """
+                    INSERT INTO external_stations (uid, source, name, lat, lng) VALUES %s
+                    ON CONFLICT (uid) DO UPDATE SET
+                        source = EXCLUDED.source, name = EXCLUDED.name, lat = EXCLUDED.lat, lng = EXCLUDED.lng
+                """, list(external))
+            if spikes:
+                self._detect_spikes(cursor, new_items)
+        return new_items
+
+    def _detect_spikes(self, cursor, new_items):
+        new_items = waqi_items(new_items)
+        if not new_items:
+            return
+        per_station = Counter(item['uid'] for item in new_items)
+        oldest = to_utc(min(to_epoch(item['timestamp']) for item in new_items))
+        # Lower time bound lets the planner skip old partitions
+        cursor.execute("""
+            SELECT station_uid, aqi, timestamp FROM (
+                SELECT station_uid, aqi, timestamp,
+                       ROW_NUMBER() OVER (PARTITION BY station_uid ORDER BY timestamp DESC) AS rn
+                FROM measurements
+                WHERE station_uid = ANY(%s) AND timestamp >= %s
+            ) recent WHERE rn <= %s
+        """, (sorted(per_station), oldest - timedelta(days=30), 2 + max(per_station.values())))
+        history = {}
+        for uid, aqi, ts in sorted(cursor.fetchall(), key=lambda row: row[2], reverse=True):
+            history.setdefault(uid, []).append((to_epoch(ts), aqi))
+        alerts = spike_alerts(new_items, history)
+        if alerts:
+            execute_values(cursor, """
+                INSERT INTO alerts (station_uid, alert_type, message, aqi_value) VALUES %s
+            """, alerts, template="(%s, 'SPIKE', %s, %s)")
+
+    def latest(self):
+        rows = self._query(
+            "SELECT station_uid, station_name, aqi, pm25, timestamp, utc_offset, source FROM station_latest"
+        )
+        return {
+            row[0]: {"station_name": row[1], "aqi": row[2], "pm25": row[3],
+                     "timestamp": local_iso(row[4], row[5]), "source": row[6]}
+            for row in rows
+        }
+
+    def history(self, uid, limit):
+        rows = self._query(
+            "SELECT aqi, pm25, timestamp, utc_offset FROM measurements "
+            "WHERE station_uid=%s ORDER BY timestamp DESC LIMIT %s",
+            (uid, limit)
+        )
+        return [{"aqi": aqi, "pm25": pm25, "timestamp": local_iso(ts, offset), "resolution": "raw"}
+                for aqi, pm25, ts, offset in rows]
+
+    def readings(self, uid, limit):
+        columns = ("aqi", "pm25", *READING_COLUMNS, "timestamp")
+        rows = self._query(
+            f"SELECT {', '.join(columns)}, utc_offset FROM measurements "
+            "WHERE station_uid=%s ORDER BY timestamp DESC LIMIT %s",
+            (uid, limit)
+        )
+        return [dict(zip(columns, (*row[:-2], local_iso(row[-2], row[-1])))) for row in rows]
+
+    def recent_aqi(self, uid, limit, skip_null=False):
+        rows = self._query(
+            "SELECT timestamp, utc_offset, aqi FROM measurements WHERE station_uid=%s"
+            + (" AND aqi IS NOT NULL" if skip_null else "")
+            + " ORDER BY timestamp DESC LIMIT %s",
+            (uid, limit)
+        )
+        return [(local_iso(ts, offset), aqi) for ts, offset, aqi in rows]
+
+    def recent_aqi_all(self, per_station, uids=None):
+        where = "WHERE station_uid = ANY(%s)" if uids is not None else ""
+        return self._query(f"""
+            SELECT station_uid, EXTRACT(EPOCH FROM timestamp)::bigint, utc_offset, aqi FROM (
+                SELECT station_uid, timestamp, utc_offset, aqi,
+                       ROW_NUMBER() OVER (PARTITION BY station_uid ORDER BY timestamp DESC) AS rn
+                FROM measurements {where}
+            ) recent WHERE rn <= %s
+            ORDER BY station_uid, timestamp DESC
+        """, ((list(uids), per_station) if uids is not None else (per_station,)))
+
+    def recent_timestamps(self, per_station):
+        return self._query("""
+            SELECT station_uid, EXTRACT(EPOCH FROM timestamp)::bigint FROM (
+                SELECT station_uid, timestamp,
+                       ROW_NUMBER() OVER (PARTITION BY station_uid ORDER BY timestamp DESC) AS rn
+                FROM measurements
+            ) recent WHERE rn <= %s
+            ORDER BY station_uid, timestamp
+        """, (per_station,))
+
+    def stations_with_data(self, min_count, limit):
+        return self._query("""
+            SELECT station_uid, COUNT(*) AS cnt
+            FROM measurements
+            WHERE aqi IS NOT NULL
+            GROUP BY station_uid
+            HAVING COUNT(*) >= %s
+            LIMIT %s
+        """, (min_count, limit))
+
+    def hourly_trends(self, days=7):
+        rows = self._query("""
+            SELECT EXTRACT(HOUR FROM timestamp + make_interval(secs => utc_offset))::int AS hour,
+                   AVG(aqi)::float AS avg_aqi, COUNT(*) AS count
+            FROM measurements
+            WHERE timestamp > (now() AT TIME ZONE 'utc') - make_interval(days => %s) AND source = 'waqi'
+            GROUP BY 1
+            ORDER BY 1
+        """, (days,))
+        return rows
+
+    def alerts(self, limit):
+        columns = ("id", "station_uid", "alert_type", "message", "aqi_value", "created_at")
+        rows = self._query(
+            f"SELECT {', '.join(columns)} FROM alerts ORDER BY created_at DESC LIMIT %s", (limit,)
+        )
+        return [dict(zip(columns, (*row[:-1], _alert_time(row[-1])))) for row in rows]
+
+    def alert_count(self, hours=24):
+        return self._query("""
+            SELECT COUNT(*) FROM alerts
+            WHERE created_at > (now() AT TIME ZONE 'utc') - make_interval(hours => %s)
+        """, (hours,))[0][0]
+
+    def external_latest(self):
+        rows = self._query("""
+            SELECT e.source, e.name, e.lat, e.lng, m.aqi, m.pm25, m.pm10, m.no2, m.o3,
+                   m.timestamp, m.utc_offset
+            FROM external_stations e
+            JOIN station_latest l ON l.station_uid = e.uid
+            JOIN measurements m ON m.station_uid = l.station_uid AND m.timestamp = l.timestamp
+        """)
+        return [(*row[:-2], local_iso(row[-2], row[-1])) for row in rows]
+
+    def save_forecasts(self, entries):
+        with self.cursor() as cursor:
+            execute_values(cursor, """
+                INSERT INTO forecasts (station_uid, predictions, trend, confidence, generated_at, data_through)
+                VALUES %s
+                ON CONFLICT (station_uid) DO UPDATE SET
+                    predictions = EXCLUDED.predictions, trend = EXCLUDED.trend, confidence = EXCLUDED.confidence,
+                    generated_at = EXCLUDED.generated_at, data_through = EXCLUDED.data_through
+            """, [_forecast_row(uid, entry) for uid, entry in entries.items()])
+
+    def forecasts(self):
+        return {row[0]: _forecast_entry(row) for row in self._query("""
+            SELECT station_uid, predictions, trend, confidence, generated_at, data_through FROM forecasts
+        """)}
+
+
+# Singleton store selected by AQI_DATABASE_URL
+store = PostgresStore(AQI_DATABASE_URL) if AQI_DATABASE_URL.startswith("postgresql") else SQLiteStore()
+
+
+def require_schema(wait=0):
+    """
+    Startup check of processes that do not migrate (web workers): raises
+    RuntimeError unless the schema is current, after waiting up to `wait`
+    seconds for the crawler to migrate it. The store is read-only afterwards.
+    """
+    store.read_only = True
+    deadline = time.monotonic() + wait
+    while True:
+        behind = store.schema_behind()
+        if behind is None:
+            return
+        if time.monotonic() >= deadline:
+            raise RuntimeError(f"{behind}; start the crawler (python -m app.crawler) or run python -m app.migrations")
+        time.sleep(1)
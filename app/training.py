@@ -0,0 +1,88 @@
+"""
+Model training for AirWatch ASEAN
+Requests never train. The trainer thread, started with the crawler (one per
+data directory), looks every TRAIN_INTERVAL seconds for models that are
+missing or past their lifetime and fits them in a process pool, so the fits
+use every core and never hold the web process's GIL. Lifetimes are
+MODEL_CACHE_HOURS x 0.75-1.0, fixed per station, which spreads the
+retraining of models first trained together. New models are registered
+as versions in app.registry (metrics, promotion, rollback); until one is
+promoted, requests keep the last good model or the heuristic forecast.
+"""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from app.config import TRAIN_INTERVAL, TRAIN_WORKERS
+from app.predictor import predictor, fit_model
+
+
+class ModelTrainer(threading.Thread):
+    """Background retraining of due models in a ProcessPoolExecutor"""
+
+    def __init__(self, interval=TRAIN_INTERVAL, workers=TRAIN_WORKERS):
+        super().__init__(name="model-trainer", daemon=True)
+        self.interval = interval
+        self.workers = workers or os.cpu_count() or 1
+        self.listeners = []  # callables(model keys), run after models were published
+        self.runs = 0
+        self.trained = 0
+        self.errors = 0
+        self.last_seconds = None
+
+    def run(self):
+        logging.info(">>> Model trainer started...")
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Training error: {e}")
+            time.sleep(self.interval)
+
+    def run_once(self):
+        """Train and register every due model; returns the keys whose new model was promoted"""
+        sets = predictor.training_sets()
+        if not sets:
+            return []
+        started = time.monotonic()
+        published = []
+        # A fresh pool per run: idle workers would hold numpy/sklearn memory for nothing
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(sets))) as pool:
+            futures = {pool.submit(fit_model, uid, X, y): uid for uid, (X, y, _) in sets.items()}
+            for future in as_completed(futures):
+                uid = futures[future]
+                try:
+                    model, metrics = future.result()
+                except Exception as e:
+                    self.errors += 1
+                    logging.error(f"Training error for model {uid}: {e}")
+                    continue
+                _, y, data_through = sets[uid]
+                self.trained += 1
+                if predictor.publish_model(uid, model, metrics, rows=len(y), data_through=data_through):
+                    published.append(uid)
+        self.runs += 1
+        self.last_seconds = round(time.monotonic() - started, 2)
+        logging.info(f"Trained {len(sets)} models in {self.last_seconds}s, {len(published)} promoted.")
+        for listener in self.listeners:
+            try:
+                listener(published)
+            except Exception as e:
+                logging.error(f"Trainer listener error: {e}")
+        return published
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "trained": self.trained,
+            "workers": self.workers,
+            "last_seconds": self.last_seconds,
+            "errors": self.errors,
+        }
+
+
+# Singleton trainer, started by the crawler
+model_trainer = ModelTrainer()
@@ -0,0 +1,124 @@
+"""
+Tree-ensemble inference engine for AirWatch ASEAN
+A trained GradientBoostingRegressor flattened into contiguous NumPy node
+arrays (feature, threshold, left, right, value) and scored with vectorized
+NumPy: all rows walk all trees together, one array step per tree level,
+instead of one sklearn predict call (with its input validation) per row.
+Several station models can be stacked into one engine, so a single call
+scores one row per station, each row with its own station's trees.
+
+Leaves point to themselves (left = right = own index, threshold = +inf),
+so every row takes `depth` steps without checking for leaves. Results are
+bit-identical to sklearn: inputs are compared as float32 like sklearn's
+trees do, and the stage outputs are added in the same order.
+The engine is a plain object of arrays, so joblib.load(mmap_mode='r') keeps
+them memory-mapped and the page cache is shared by every worker process.
+Used for the per-station models only: for one large model (the global
+model) sklearn's compiled predict is faster, see benchmark_trees.py for the
+parity check and per-row timings.
+"""
+import numpy as np
+
+TREE_LEAF = -1  # sklearn's children_left / children_right at leaves
+BLOCK_NODES = 1 << 16  # rows x trees walked at once; bounds the temporary arrays
+
+
+class TreeEnsemble:
+    """
+    Flattened trees of one or more boosted models. `roots[m]` are the root
+    nodes of model m's trees; models with fewer trees are padded with a
+    zero-valued leaf.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, learning_rate, init, depth):
+        self.feature = feature  # intp, 0 at leaves
+        self.threshold = threshold  # float64, go left when x <= threshold
+        self.left = left  # intp node index
+        self.right = right
+        self.value = value  # float64 node values (only leaves are used)
+        self.roots = roots  # intp (models, trees)
+        self.learning_rate = learning_rate  # float64 (models,)
+        self.init = init  # float64 (models,) - prediction of the init estimator
+        self.depth = depth  # deepest tree
+
+    @property
+    def n_models(self):
+        return len(self.roots)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.feature, self.threshold, self.left, self.right, self.value,
+                                      self.roots, self.learning_rate, self.init))
+
+    def predict(self, X, model_index=None):
+        """Row i scored by model model_index[i] (default: model 0)"""
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)  # sklearn trees compare float32 inputs
+        model_index = np.zeros(len(X), dtype=np.intp) if model_index is None else np.asarray(model_index)
+        out = np.empty(len(X))
+        block = max(1, BLOCK_NODES // self.roots.shape[1])
+        for start in range(0, len(X), block):
+            out[start:start + block] = self._predict_block(X[start:start + block], model_index[start:start + block])
+        return out
+
+    def _predict_block(self, X, model_index):
+        n_rows = len(X)
+        columns = X.T.ravel()  # feature f of row i at f * n_rows + i
+        rows = np.arange(n_rows)
+        node = self.roots[model_index].T  # (trees, rows): all trees walk down together
+        for _ in range(self.depth):
+            go_left = columns[self.feature[node] * n_rows + rows] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        # init, then each stage in turn like sklearn's predict_stages: cumsum adds
+        # sequentially (not pairwise), so the float sums are identical
+        stages = np.vstack([self.init[model_index], self.learning_rate[model_index] * self.value[node]])
+        return np.cumsum(stages, axis=0)[-1]
+
+    @classmethod
+    def stack(cls, engines):
+        """One engine holding all models of `engines`, in order"""
+        offsets = np.cumsum([0] + [len(e.feature) for e in engines])
+        n_trees = max(e.roots.shape[1] for e in engines)
+        pad = offsets[-1]  # shared zero leaf appended at the end
+        roots = np.full((sum(e.n_models for e in engines), n_trees), pad, dtype=np.intp)
+        row = 0
+        for engine, offset in zip(engines, offsets):
+            roots[row:row + engine.n_models, :engine.roots.shape[1]] = engine.roots + offset
+            row += engine.n_models
+        return cls(
+            feature=np.concatenate([e.feature for e in engines] + [[0]]).astype(np.intp),
+            threshold=np.concatenate([e.threshold for e in engines] + [[np.inf]]),
+            left=np.concatenate([e.left + offset for e, offset in zip(engines, offsets)] + [[pad]]).astype(np.intp),
+            right=np.concatenate([e.right + offset for e, offset in zip(engines, offsets)] + [[pad]]).astype(np.intp),
+            value=np.concatenate([e.value for e in engines] + [[0.0]]),
+            roots=roots,
+            learning_rate=np.concatenate([e.learning_rate for e in engines]),
+            init=np.concatenate([e.init for e in engines]),
+            depth=max(e.depth for e in engines),
+        )
+
+
+def export_gbr(model):
+    """Flatten a fitted single-output GradientBoostingRegressor"""
+    trees = [estimator.tree_ for estimator in model.estimators_[:, 0]]
+    offsets = np.cumsum([0] + [tree.node_count for tree in trees])[:-1]
+    left = np.concatenate([tree.children_left for tree in trees])
+    right = np.concatenate([tree.children_right for tree in trees])
+    leaf = left == TREE_LEAF
+    index = np.arange(len(left))
+    offset = np.repeat(offsets, [tree.node_count for tree in trees])
+
+    if isinstance(model.init_, str):  # init="zero"
+        init = 0.0
+    else:
+        init = float(np.ravel(model.init_.predict(np.zeros((1, model.n_features_in_))))[0])
+    return TreeEnsemble(
+        feature=np.where(leaf, 0, np.concatenate([tree.feature for tree in trees])).astype(np.intp),
+        threshold=np.where(leaf, np.inf, np.concatenate([tree.threshold for tree in trees])),
+        left=np.where(leaf, index, left + offset).astype(np.intp),
+        right=np.where(leaf, index, right + offset).astype(np.intp),
+        value=np.concatenate([tree.value[:, 0, 0] for tree in trees]).astype(np.float64),
+        roots=offsets.astype(np.intp)[None, :],
+        learning_rate=np.array([model.learning_rate], dtype=np.float64),
+        init=np.array([init], dtype=np.float64),
+        depth=max(tree.max_depth for tree in trees),
+    )
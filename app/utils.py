@@ -4,10 +4,12 @@ IDW interpolation, geo calculations, satellite data
 """
 import math
 import logging
-import requests
+from datetime import datetime, timedelta, timezone
 
 from app.config import STATIONS_CONFIG, OPENWEATHER_API_KEY, OPENAQ_API_KEY
-from app.db import get_db_connection
+from app.storage import store
+from app.db import guess_utc_offset
+from app.governor import governed_get, ProviderUnavailable
 
 
 def haversine_km(lat1, lng1, lat2, lng2):
@@ -51,6 +53,73 @@ def pm25_to_aqi(pm25):
     return 500 if pm25 > 500.4 else 0
 
 
+def get_local_weather(lat, lng, max_dist_km=25, max_age_hours=3):
+    """
+    Weather from the latest iaqi reading of the nearest ground station
+    (no outbound call). Returns None if no station within max_dist_km has
+    reported temperature in the last max_age_hours (then OWM is asked).
+    """
+    nearby = sorted(
+        ((haversine_km(lat, lng, st['lat'], st['lng']), st) for st in STATIONS_CONFIG),
+        key=lambda item: item[0]
+    )
+    nearby = [(dist, st) for dist, st in nearby if dist <= max_dist_km][:5]
+    if not nearby:
+        return None
+
+    for dist, st in nearby:
+        rows = store.readings(st['uid'], 1)
+        row = rows[0] if rows else None
+        # Reading timestamps are station-local; compare with the station's local "now"
+        local_now = datetime.now(timezone.utc) + timedelta(seconds=guess_utc_offset(st['lng'], st.get('country')))
+        cutoff = (local_now - timedelta(hours=max_age_hours)).replace(tzinfo=None).isoformat()
+        if row and row['temperature'] is not None and row['timestamp'] >= cutoff:
+            return {
+                "temp": round(row['temperature'], 1),
+                "humidity": round(row['humidity']) if row['humidity'] is not None else None,
+                "wind_speed": row['wind'] if row['wind'] is not None else 0,
+                "pressure": row['pressure'],
+                "location": st.get('name', ''),
+                "distance_km": round(dist, 1),
+                "source": "ground_station",
+                "timestamp": row['timestamp']
+            }
+    return None
+
+
+def get_ingested_satellite_aqi(lat, lng, max_dist_km=250, max_age_hours=6):
+    """
+    Nearest recent OpenWeatherMap/OpenAQ reading already ingested by the
+    crawler's providers (no outbound call). None if nothing close and fresh.
+    """
+    rows = store.external_latest()
+
+    # Ingested timestamps are station-local; approximate the local "now" the same way
+    local_now = datetime.now(timezone.utc) + timedelta(hours=round(lng / 15))
+    cutoff = (local_now - timedelta(hours=max_age_hours)).replace(tzinfo=None).isoformat()
+    candidates = [
+        (haversine_km(lat, lng, row[2], row[3]), row) for row in rows
+        if row[4] is not None and row[9] and row[9] >= cutoff
+    ]
+    candidates = [(dist, row) for dist, row in candidates if dist <= max_dist_km]
+    if not candidates:
+        return None
+    dist, (source, name, _, _, aqi, pm25, pm10, no2, o3, ts) = min(candidates, key=lambda c: c[0])
+    return {
+        'aqi': aqi,
+        'source': f'{source}_satellite',
+        'pm25': round(pm25, 1) if pm25 is not None else None,
+        'pm10': round(pm10, 1) if pm10 is not None else None,
+        'no2': round(no2, 1) if no2 is not None else None,
+        'o3': round(o3, 1) if o3 is not None else None,
+        'location_name': name,
+        'distance_km': round(dist, 1),
+        'timestamp': ts,
+        'cached': True,
+        'data_type': 'satellite_model' if source == 'openweathermap' else 'ground_station'
+    }
+
+
 def fetch_satellite_aqi(lat, lng):
     """
     Fetch AQI from OpenWeatherMap Air Pollution API
@@ -58,11 +127,17 @@ def fetch_satellite_aqi(lat, lng):
     Free tier: 1000 calls/day
     
     API returns AQI scale 1-5 and component concentrations (PM2.5, PM10, etc.)
+    Readings the ingest providers already stored are used first.
     """
+    ingested = get_ingested_satellite_aqi(lat, lng)
+    if ingested:
+        return ingested
+
     # Try OpenWeatherMap first (better coverage)
     if OPENWEATHER_API_KEY:
         try:
-            response = requests.get(
+            response = governed_get(
+                "openweathermap",
                 "http://api.openweathermap.org/data/2.5/air_pollution",
                 params={
                     'lat': lat,
@@ -103,13 +178,16 @@ def fetch_satellite_aqi(lat, lng):
                         'data_type': 'satellite_model'
                     }
                     
+        except ProviderUnavailable:
+            logging.info("OpenWeatherMap call skipped (rate limit, quota or open circuit)")
         except Exception as e:
             logging.error(f"OpenWeatherMap API error: {e}")
     
     # Fallback to OpenAQ if configured
     if OPENAQ_API_KEY:
         try:
-            response = requests.get(
+            response = governed_get(
+                "openaq",
                 "https://api.openaq.org/v3/locations",
                 params={
                     'coordinates': f'{lat},{lng}',
@@ -135,6 +213,8 @@ def fetch_satellite_aqi(lat, lng):
                                         'pm25': pm25,
                                         'location_name': loc.get('name')
                                     }
+        except ProviderUnavailable:
+            logging.info("OpenAQ call skipped (rate limit, quota or open circuit)")
         except Exception as e:
             logging.error(f"OpenAQ API error: {e}")
     
@@ -146,20 +226,8 @@ def idw_interpolate(lat, lng, stations_data=None, power=2.0, max_dist_km=500):
     IDW interpolation with confidence indicator
     Returns: {aqi, nearest_station, distance_km, confidence, source}
     """
-    # Get current AQI from database
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT m.station_uid, m.aqi
-        FROM measurements m
-        INNER JOIN (
-            SELECT station_uid, MAX(timestamp) as max_ts 
-            FROM measurements GROUP BY station_uid
-        ) latest ON m.station_uid = latest.station_uid AND m.timestamp = latest.max_ts
-        WHERE m.aqi IS NOT NULL
-    """)
-    db_aqi = {row[0]: row[1] for row in cursor.fetchall()}
-    conn.close()
+    # Current AQI from the latest-reading snapshot
+    db_aqi = {uid: row['aqi'] for uid, row in store.latest().items() if row['aqi'] is not None}
     
     # Build station data with current AQI
     stations = []
@@ -0,0 +1,143 @@
+"""
+Measurement writer for AirWatch ASEAN
+Single writer thread: takes crawler results from a queue and commits them
+to the measurement store in short batches (by size or time), with spike
+detection in the same transaction (see app.storage). Listeners are called
+with the new rows of each committed batch (e.g. the forecast refresher).
+A batch that fails is retried row by row, so one bad record only costs
+itself; rows that still fail are appended to WRITER_DEAD_LETTER as flat
+NDJSON records (the format app.backfill reads) instead of being lost.
+"""
+import json
+import time
+import queue
+import logging
+import threading
+
+from app.config import WRITER_BATCH_SIZE, WRITER_MAX_DELAY, WRITER_DEAD_LETTER
+from app.db import to_epoch
+from app.storage import store
+
+
+class MeasurementWriter(threading.Thread):
+    """
+    Queue-fed writer thread. A batch is committed when it reaches
+    `batch_size` rows or its oldest row has waited `max_delay` seconds.
+    Rows whose (uid, timestamp) equals the last value written for that
+    station are dropped before touching the DB.
+    """
+
+    def __init__(self, batch_size=WRITER_BATCH_SIZE, max_delay=WRITER_MAX_DELAY, dead_letter=WRITER_DEAD_LETTER):
+        super().__init__(name="measurement-writer", daemon=True)
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.dead_letter = dead_letter
+        self.queue = queue.Queue()
+        self.last_written = {}  # uid -> epoch of the last row written/seen (naive and aware timestamps compare)
+        self.inserted = 0
+        self.ignored = 0
+        self.batches = 0
+        self.errors = 0
+        self.rejected = 0  # rows written to the dead-letter file
+        self.listeners = []  # callables(new_items), run after each commit
+        self._pending = 0  # rows taken off the queue but not yet committed
+
+    def submit(self, item):
+        self.queue.put(item)
+
+    def submit_many(self, items):
+        for item in items:
+            self.queue.put(item)
+
+    def run(self):
+        logging.info(">>> Measurement writer started...")
+        while True:
+            batch = [self.queue.get()]
+            self._pending = 1
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                    self._pending = len(batch)
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                # One bad record must not end the only writer thread
+                self.errors += 1
+                logging.error(f"Writer batch error: {e}; retrying {len(batch)} rows one by one")
+                self._write_each(batch)
+            finally:
+                self._pending = 0
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write(self, batch):
+        fresh = [item for item in batch if self.last_written.get(item['uid']) != to_epoch(item['timestamp'])]
+        self.ignored += len(batch) - len(fresh)
+        if not fresh:
+            return
+        new_items = store.write_batch(fresh)
+
+        for item in fresh:
+            last = self.last_written.get(item['uid'])
+            epoch = to_epoch(item['timestamp'])
+            if last is None or epoch > last:
+                self.last_written[item['uid']] = epoch
+        self.inserted += len(new_items)
+        self.ignored += len(fresh) - len(new_items)
+        self.batches += 1
+        if new_items:
+            logging.info(f"Saved {len(new_items)} new records.")
+            for listener in self.listeners:
+                try:
+                    listener(new_items)
+                except Exception as e:
+                    logging.error(f"Writer listener error: {e}")
+
+    def _write_each(self, batch):
+        """Retry of a failed batch, one row per transaction; rows that fail again go to the dead-letter file"""
+        rejected = []
+        for item in batch:
+            try:
+                self._write([item])
+            except Exception as e:
+                rejected.append((item, e))
+        if rejected:
+            self._reject(rejected)
+
+    def _reject(self, rejected):
+        self.rejected += len(rejected)
+        try:
+            with open(self.dead_letter, "a", encoding="utf-8") as f:
+                for item, error in rejected:
+                    record = {**item, "error": str(error)}
+                    f.write(json.dumps(record, ensure_ascii=False,
+                                       default=lambda v: v.isoformat() if hasattr(v, "isoformat") else str(v)) + "\n")
+        except OSError as e:
+            logging.error(f"Dead-letter write error: {e}")
+        for item, error in rejected:
+            logging.error(f"DB Write Error: station {item.get('uid')} at {item.get('timestamp')} rejected: {error}")
+        logging.error(f"{len(rejected)} rows written to {self.dead_letter}")
+
+    def flush(self):
+        """Block until everything submitted so far is committed"""
+        self.queue.join()
+
+    def stats(self):
+        return {
+            "inserted": self.inserted,
+            "ignored": self.ignored,
+            "in_flight": self.queue.qsize() + self._pending,
+            "batches": self.batches,
+            "errors": self.errors,
+            "rejected": self.rejected,
+        }
+
+
+# Singleton writer, started by the crawler
+measurement_writer = MeasurementWriter()
@@ -0,0 +1,143 @@
+"""
+Query plan / timing benchmark for the measurements and alerts indexes
+Builds a synthetic database at schema version 1 (ISO text timestamps, no
+indexes besides UNIQUE), runs the hot queries, applies the remaining
+migrations (indexes, integer epoch timestamps) and runs the app's current
+SQL again.
+
+    python benchmark_queries.py [--stations 200] [--days 60]
+"""
+import os
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+from app.migrations import run_migrations
+
+# name -> (SQL at schema v1, same query as the app runs it now (app.storage), params)
+QUERIES = {
+    "predict_multi": (
+        "SELECT timestamp, aqi FROM measurements WHERE station_uid=? ORDER BY timestamp DESC LIMIT 168",
+        "SELECT timestamp, utc_offset, aqi FROM measurements WHERE station_uid=? ORDER BY timestamp DESC LIMIT 168",
+        "station",
+    ),
+    "api_history": (
+        "SELECT aqi, pm25, timestamp FROM measurements WHERE station_uid=? ORDER BY timestamp DESC LIMIT ?",
+        "SELECT aqi, pm25, timestamp, utc_offset FROM measurements WHERE station_uid=? ORDER BY timestamp DESC LIMIT ?",
+        "station_limit",
+    ),
+    "api_trends": (
+        """SELECT strftime('%H', timestamp) as hour, AVG(aqi) as avg_aqi, COUNT(*) as count
+           FROM measurements
+           WHERE timestamp > datetime('now', '-7 days')
+           GROUP BY strftime('%H', timestamp)
+           ORDER BY hour""",
+        """SELECT (timestamp + utc_offset) % 86400 / 3600 as hour, AVG(aqi) as avg_aqi, COUNT(*) as count
+           FROM measurements
+           WHERE timestamp > CAST(strftime('%s', 'now') AS INTEGER) - 7 * 86400 AND source = 'waqi'
+           GROUP BY hour
+           ORDER BY hour""",
+        None,
+    ),
+    "alerts_24h": (
+        "SELECT COUNT(*) FROM alerts WHERE created_at > datetime('now', '-24 hours')",
+        "SELECT COUNT(*) FROM alerts WHERE created_at > CAST(strftime('%s', 'now') AS INTEGER) - 86400",
+        None,
+    ),
+    "api_alerts": (
+        "SELECT * FROM alerts ORDER BY created_at DESC LIMIT ?",
+        "SELECT * FROM alerts ORDER BY created_at DESC LIMIT ?",
+        "limit",
+    ),
+}
+
+
+def populate(conn, stations, days):
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    rng = random.Random(42)
+    rows = []
+    for uid in range(1, stations + 1):
+        aqi = rng.randint(20, 150)
+        for h in range(days * 24):
+            aqi = max(0, aqi + rng.randint(-8, 8))
+            rows.append((uid, f"Station {uid}", aqi, aqi / 3, (now - timedelta(hours=h)).isoformat()))
+    conn.executemany(
+        "INSERT OR IGNORE INTO measurements (station_uid, station_name, aqi, pm25, timestamp) VALUES (?, ?, ?, ?, ?)",
+        rows
+    )
+    alerts = [
+        (rng.randint(1, stations), "SPIKE", "benchmark", rng.randint(100, 300),
+         (datetime.utcnow() - timedelta(minutes=rng.randint(0, days * 1440))).strftime("%Y-%m-%d %H:%M:%S"))
+        for _ in range(stations * days // 2)
+    ]
+    conn.executemany(
+        "INSERT INTO alerts (station_uid, alert_type, message, aqi_value, created_at) VALUES (?, ?, ?, ?, ?)",
+        alerts
+    )
+    conn.commit()
+    return len(rows), len(alerts)
+
+
+def params_for(kind, stations, rng):
+    if kind == "station":
+        return (rng.randint(1, stations),)
+    if kind == "station_limit":
+        return (rng.randint(1, stations), 24)
+    if kind == "limit":
+        return (20,)
+    return ()
+
+
+def run(conn, stations, repeat, current):
+    rng = random.Random(7)
+    results = {}
+    for name, (sql_v1, sql_now, kind) in QUERIES.items():
+        sql = sql_now if current else sql_v1
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params_for(kind, stations, rng)).fetchall()
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            conn.execute(sql, params_for(kind, stations, rng)).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        results[name] = (statistics.median(timings), [row[-1] for row in plan])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--stations", type=int, default=200)
+    parser.add_argument("--days", type=int, default=60)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "benchmark.db")
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    run_migrations(conn, target=1)
+    n_rows, n_alerts = populate(conn, args.stations, args.days)
+    print(f"📊 {n_rows} measurements, {n_alerts} alerts ({path})")
+
+    conn.execute("ANALYZE")
+    before = run(conn, args.stations, args.repeat, current=False)
+    size_before = os.path.getsize(path)
+    applied = run_migrations(conn)
+    conn.execute("VACUUM")
+    conn.execute("ANALYZE")
+    after = run(conn, args.stations, args.repeat, current=True)
+    print(f"Database: {size_before / 1e6:.1f} MB -> {os.path.getsize(path) / 1e6:.1f} MB (after VACUUM)")
+    print(f"Applied: {', '.join(f'{v:03d} {n}' for v, n in applied)}\n")
+
+    for name in QUERIES:
+        (t0, plan0), (t1, plan1) = before[name], after[name]
+        print(f"{name}: {t0:.2f} ms -> {t1:.2f} ms ({t0 / max(t1, 1e-6):.1f}x)")
+        print(f"   before: {' | '.join(plan0)}")
+        print(f"   after:  {' | '.join(plan1)}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
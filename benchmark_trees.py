@@ -0,0 +1,109 @@
+"""
+Parity check and per-row latency of the tree engine (app.tree_engine)
+Trains station models and a global model with the app's parameters on
+synthetic data, checks that the flattened engine predicts exactly what
+sklearn predicts (exit code 1 otherwise), then times the forecast's
+scoring patterns: one rolling step (a row per station, each with its own
+model) and bulk scoring of many rows.
+
+    python benchmark_trees.py [--stations 200] [--rows 168] [--repeat 20]
+"""
+import sys
+import time
+import argparse
+import statistics
+
+import numpy as np
+from sklearn.ensemble import GradientBoostingRegressor
+
+from app.predictor import STATION_MODEL_PARAMS, GLOBAL_MODEL_PARAMS
+from app.tree_engine import TreeEnsemble, export_gbr
+
+
+def synthetic(rng, n_rows):
+    """[hour, day_of_week, is_weekend, lag_1, lag_3] and AQI, like app.predictor._history"""
+    aqi = np.maximum(0, rng.integers(20, 150) + np.cumsum(rng.integers(-15, 16, n_rows + 3)))
+    hour = np.arange(n_rows) % 24
+    day_of_week = np.arange(n_rows) // 24 % 7
+    X = np.column_stack([hour, day_of_week, day_of_week >= 5, aqi[1:n_rows + 1], aqi[3:n_rows + 3]])
+    return X.astype(float), aqi[:n_rows].astype(float)
+
+
+def timed(fn, repeat):
+    """Median seconds of fn()"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--stations", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=168, help="training rows per station")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    rng = np.random.default_rng(42)
+
+    data = [synthetic(rng, args.rows) for _ in range(args.stations)]
+    started = time.perf_counter()
+    models = [GradientBoostingRegressor(**STATION_MODEL_PARAMS).fit(X, y) for X, y in data]
+    X_all = np.vstack([X for X, _ in data])
+    station_X = np.repeat(rng.uniform(-10, 25, (args.stations, 4)), args.rows, axis=0)
+    X_global = np.column_stack([X_all, station_X])
+    global_model = GradientBoostingRegressor(**GLOBAL_MODEL_PARAMS).fit(X_global, np.concatenate([y for _, y in data]))
+    print(f"📊 {args.stations} station models + 1 global model trained in {time.perf_counter() - started:.1f}s")
+
+    engines = [export_gbr(model) for model in models]
+    stacked = TreeEnsemble.stack(engines)
+    global_engine = export_gbr(global_model)
+
+    # === Parity: every station model on its own rows, stacked and alone, and the global model ===
+    station_ids = np.repeat(np.arange(args.stations), args.rows)
+    expected = np.concatenate([model.predict(X) for model, (X, _) in zip(models, data)])
+    checks = {
+        "station (stacked)": (stacked.predict(X_all, station_ids), expected),
+        "station (single)": (np.concatenate([e.predict(X) for e, (X, _) in zip(engines, data)]), expected),
+        "global": (global_engine.predict(X_global), global_model.predict(X_global)),
+    }
+    failed = False
+    for name, (got, want) in checks.items():
+        mismatches = int(np.sum(got != want))
+        failed |= mismatches > 0
+        print(f"{'✅' if not mismatches else '❌'} parity {name}: {mismatches}/{len(want)} rows differ, "
+              f"max |diff| {np.max(np.abs(got - want)):.3g}")
+
+    # === Latency: one rolling step = one row per station ===
+    step = np.vstack([X[:1] for X, _ in data])
+    step_global = X_global[::args.rows]
+    step_ids = np.arange(args.stations)
+    rows = len(step)
+    print(f"\nRolling step ({rows} stations, 1 row each):")
+    results = {
+        "sklearn, predict per station": timed(lambda: [m.predict(step[k:k + 1]) for k, m in enumerate(models)], args.repeat),
+        "engine, stacked": timed(lambda: stacked.predict(step, step_ids), args.repeat),
+        "engine, stack + predict": timed(lambda: TreeEnsemble.stack(engines).predict(step, step_ids), args.repeat),
+        "sklearn, global model": timed(lambda: global_model.predict(step_global), args.repeat),
+        "engine, global model": timed(lambda: global_engine.predict(step_global), args.repeat),
+    }
+    for name, seconds in results.items():
+        print(f"   {name}: {seconds * 1000:.2f} ms ({seconds / rows * 1e6:.2f} µs/row)")
+
+    # === Latency: bulk scoring ===
+    rows = len(X_global)
+    print(f"\nBulk ({rows} rows):")
+    results = {
+        "sklearn, global model": timed(lambda: global_model.predict(X_global), args.repeat),
+        "engine, global model": timed(lambda: global_engine.predict(X_global), args.repeat),
+        "sklearn, station models": timed(lambda: [m.predict(X) for m, (X, _) in zip(models, data)], args.repeat),
+        "engine, station models stacked": timed(lambda: stacked.predict(X_all, station_ids), args.repeat),
+    }
+    for name, seconds in results.items():
+        print(f"   {name}: {seconds * 1000:.2f} ms ({seconds / rows * 1e6:.2f} µs/row)")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,24 +7,29 @@ from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import Response
-from threading import Thread
 
 # App modules
-from app.config import setup_logging
-from app.db import init_db
-from app.crawler import crawler_task
+from app.config import setup_logging, RUN_CRAWLER, SCHEMA_WAIT_SECONDS
+from app.storage import store, require_schema
+from app.crawler import start_embedded_crawler, acquire_crawler_lock
 
 # Database (SQLAlchemy for users)
 from database import init_user_db
 
 # Import routers
-from app.routes import stations, predictions, location, evaluation, auth_routes, user
+from app.routes import stations, predictions, location, evaluation, auth_routes, user, monitoring
 
 # Setup logging
 setup_logging()
 
-# Initialize databases on import (for Railway/production)
-init_db()          # Init AQI database (SQLite - creates measurements table)
+# Initialize databases on import (for Railway/production). Only the crawler migrates
+# the AQI database (SQLite file or PostgreSQL, see AQI_DATABASE_URL): the worker that
+# wins the crawler lock, or `python -m app.crawler` with RUN_CRAWLER=off. The other
+# workers read only and refuse to start on an older schema.
+if RUN_CRAWLER == "embedded" and acquire_crawler_lock():
+    store.init()
+else:
+    require_schema(wait=SCHEMA_WAIT_SECONDS if RUN_CRAWLER == "embedded" else 0)
 init_user_db()     # Init User database (PostgreSQL/SQLite)
 
 # Create FastAPI app
@@ -56,10 +61,11 @@ app.include_router(location.router)
 app.include_router(evaluation.router)
 app.include_router(auth_routes.router)
 app.include_router(user.router)
+app.include_router(monitoring.router)
 
-# Start crawler in background thread
-crawler_thread = Thread(target=crawler_task, daemon=True)
-crawler_thread.start()
+# Start crawler in background thread - only the worker that wins the crawler
+# lock runs it; with RUN_CRAWLER=off, run `python -m app.crawler` separately
+crawler_thread = start_embedded_crawler() if RUN_CRAWLER == "embedded" else None
 
 
 if __name__ == "__main__":
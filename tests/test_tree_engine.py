@@ -0,0 +1,64 @@
+"""Parity of the tree engine (app.tree_engine) with sklearn's predict"""
+import numpy as np
+import pytest
+from sklearn.ensemble import GradientBoostingRegressor
+
+import app.tree_engine as tree_engine
+from app.predictor import STATION_MODEL_PARAMS
+from app.tree_engine import TreeEnsemble, export_gbr
+
+
+def synthetic(rng, n_rows):
+    """[hour, day_of_week, is_weekend, lag_1, lag_3] and AQI, like benchmark_trees.py"""
+    aqi = np.maximum(0, rng.integers(20, 150) + np.cumsum(rng.integers(-15, 16, n_rows + 3)))
+    hour = np.arange(n_rows) % 24
+    day_of_week = np.arange(n_rows) // 24 % 7
+    X = np.column_stack([hour, day_of_week, day_of_week >= 5, aqi[1:n_rows + 1], aqi[3:n_rows + 3]])
+    return X.astype(float), aqi[:n_rows].astype(float)
+
+
+@pytest.fixture(scope="module")
+def fitted():
+    """Station models of different sizes, with their training data"""
+    rng = np.random.default_rng(42)
+    params = [STATION_MODEL_PARAMS, {"n_estimators": 20, "max_depth": 2}, {"n_estimators": 35, "max_depth": 5, "init": "zero"}]
+    result = []
+    for kwargs in params:
+        X, y = synthetic(rng, 168)
+        result.append((GradientBoostingRegressor(**kwargs).fit(X, y), X))
+    return result
+
+
+def test_export_matches_sklearn(fitted):
+    for model, X in fitted:
+        assert np.array_equal(export_gbr(model).predict(X), model.predict(X))
+
+
+def test_export_matches_at_thresholds(fitted):
+    # Inputs exactly on a split threshold go left, as in sklearn
+    model, X = fitted[0]
+    engine = export_gbr(model)
+    split = np.flatnonzero(np.isfinite(engine.threshold))[:len(X)]
+    X_edge = X[:len(split)].copy()
+    X_edge[np.arange(len(split)), engine.feature[split]] = engine.threshold[split]
+    assert np.array_equal(engine.predict(X_edge), model.predict(X_edge))
+
+
+def test_stack_matches_each_model(fitted):
+    engines = [export_gbr(model) for model, _ in fitted]
+    stacked = TreeEnsemble.stack(engines)
+    assert stacked.n_models == len(fitted)
+    X_all = np.vstack([X for _, X in fitted])
+    model_index = np.repeat(np.arange(len(fitted)), [len(X) for _, X in fitted])
+    expected = np.concatenate([model.predict(X) for model, X in fitted])
+    assert np.array_equal(stacked.predict(X_all, model_index), expected)
+
+
+def test_stack_matches_across_blocks(fitted, monkeypatch):
+    monkeypatch.setattr(tree_engine, "BLOCK_NODES", 64)  # a few rows per block
+    stacked = TreeEnsemble.stack([export_gbr(model) for model, _ in fitted])
+    rng = np.random.default_rng(7)
+    model_index = rng.integers(0, len(fitted), 300)
+    X = np.vstack([fitted[m][1][i % 168] for i, m in enumerate(model_index)])
+    expected = np.array([fitted[m][0].predict(X[i:i + 1])[0] for i, m in enumerate(model_index)])
+    assert np.array_equal(stacked.predict(X, model_index), expected)
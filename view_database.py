@@ -58,11 +58,12 @@ def view_database():
             cursor.execute("SELECT COUNT(DISTINCT station_uid) FROM measurements")
             stations = cursor.fetchone()[0]
             
-            cursor.execute("SELECT MIN(timestamp), MAX(timestamp) FROM measurements")
+            # timestamps are UTC epoch seconds (+ utc_offset for station-local time)
+            cursor.execute("SELECT datetime(MIN(timestamp), 'unixepoch'), datetime(MAX(timestamp), 'unixepoch') FROM measurements")
             min_ts, max_ts = cursor.fetchone()
             
             console.print(f"\n[bold green]📈 Measurements:[/] {count:,} records | {stations} stations")
-            console.print(f"   [dim]Date range: {min_ts} → {max_ts}[/]")
+            console.print(f"   [dim]Date range (UTC): {min_ts} → {max_ts}[/]")
             
             # Create beautiful table with STATION NAMES
             table = Table(title="🕐 Latest 15 Measurements", box=box.ROUNDED)
@@ -72,7 +73,7 @@ def view_database():
             table.add_column("Timestamp", style="dim")
             
             cursor.execute("""
-                SELECT station_uid, aqi, pm25, timestamp 
+                SELECT station_uid, aqi, pm25, datetime(timestamp + utc_offset, 'unixepoch')
                 FROM measurements 
                 ORDER BY timestamp DESC 
                 LIMIT 15
@@ -112,7 +113,10 @@ def view_database():
     else:
         # Fallback without rich
         print("\n--- Measurements (latest 10) ---")
-        cursor.execute("SELECT station_uid, aqi, pm25, timestamp FROM measurements ORDER BY timestamp DESC LIMIT 10")
+        cursor.execute("""
+            SELECT station_uid, aqi, pm25, datetime(timestamp + utc_offset, 'unixepoch')
+            FROM measurements ORDER BY timestamp DESC LIMIT 10
+        """)
         for row in cursor.fetchall():
             name = get_station_name(row[0])
             print(f"  {name}: AQI={row[1]}, PM2.5={row[2]}, Time={row[3]}")